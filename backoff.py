@@ -0,0 +1,347 @@
+"""A variable-order Markov chain that backs off to shorter prefixes.
+
+A BackoffChain is built once, with a maximum prefix length N, and holds the
+successor counts for every prefix length from 1 to N, in a trie of
+contexts. The trie is keyed by the words before a successor, last word
+first. So the node for "the white" is the child for "the" of the node for
+"white", and it holds the successors of "the white" in the text. Contexts
+that end in the same words share the nodes for those words.
+
+The starts of sentences are contexts too: a prefix with fewer words than
+the chain's prefix length is the start of a sentence, and its path in the
+trie ends with an extra START edge. With no backing off, the chain
+generates exactly like a MarkovChain built from the same text with the
+same prefix length.
+
+A context that was only seen once has only one successor, and so do all
+the longer contexts that end with it, so those aren't kept once the chain
+is built. That leaves the trie with about half the nodes.
+
+When the longest context of a prefix has fewer than min_successors
+different successors (or isn't in the trie at all, at the end of the
+text), generation backs off to the longest shorter one that has enough,
+down to the words' overall frequencies. That avoids dead ends, and with
+min_successors above 1, long runs copied straight from the text.
+
+with_prefix_len gives a view of the same trie with a lower prefix length,
+so one build serves every prefix length up to N.
+
+This module exports the BackoffChain class.
+"""
+import copy
+from array import array
+
+import markov
+
+# The edge for the start of a sentence. It's never a word id.
+START = 0xFFFFFFFF
+
+# Trie edges are keyed by (node << _NODE_SHIFT) | word id, since one int
+# takes much less memory than a tuple
+_NODE_SHIFT = 32
+_EDGE_MASK = (1 << _NODE_SHIFT) - 1
+
+
+class BackoffChain(markov.BaseChain):
+    """A trie of successor counts for every prefix length up to a maximum.
+
+    Build one with from_string or from_files. Each node of the trie is an
+    integer, and its successors are stored like a MarkovChain's: a bare word
+    id when one word followed the context once, or else a _SuccessorTable.
+    Node 0 is the root, the empty context, which every word follows.
+
+    Public methods:
+        from_string, from_files (class methods): Build a chain.
+        with_prefix_len: Get a view of the chain with a lower prefix length.
+        index_syllables: Build a syllable index, as MarkovChain does.
+        generate, next_word, start: Generate text, as for any chain.
+    """
+
+    def __init__(self, prefix_len, vocab=None, min_successors=1):
+        """Initialize an empty chain.
+
+        Args:
+            prefix_len (int): the longest prefix length to store
+            vocab (markov.Vocabulary): the vocabulary to intern words in. By
+                default, a new, empty one.
+            min_successors (int): how many different successors a context
+                needs for generation to use it rather than back off
+        """
+        if prefix_len < 1:
+            raise ValueError('Prefix length must be at least one')
+        if min_successors < 1:
+            raise ValueError('min_successors must be at least one')
+        self._prefix_len = prefix_len
+        self._max_prefix_len = prefix_len
+        self._vocab = markov.Vocabulary() if vocab is None else vocab
+        self._min_successors = min_successors
+        # maps (node << _NODE_SHIFT) | edge to the child node
+        self._children = {}
+        # the successors of each node, or None for none
+        self._entries = [None]
+        self.syllables_indexed = False
+        self._lookup_syllables = None
+        self._syllables = array("B")
+        self._word_flags = array("B")
+        self._aliases = markov._AliasCache()
+
+    @property
+    def max_prefix_len(self):
+        """The longest prefix length stored, and allowed in views."""
+        return self._max_prefix_len
+
+    @property
+    def min_successors(self):
+        """How many different successors a context needs to be used."""
+        return self._min_successors
+
+    def with_prefix_len(self, prefix_len, min_successors=None):
+        """Get a view of the chain that generates with a lower prefix length.
+
+        The view shares the trie with this chain, so it's cheap to make.
+        With no backing off, it generates exactly like a MarkovChain built
+        with that prefix length.
+
+        Args:
+            prefix_len (int): at most max_prefix_len
+            min_successors (int): optional new value for the view
+        Returns:
+            A BackoffChain
+        """
+        if not 1 <= prefix_len <= self._max_prefix_len:
+            raise ValueError("Prefix length must be from 1 to {}".format(
+                self._max_prefix_len))
+        view = copy.copy(self)
+        view._prefix_len = prefix_len
+        if min_successors is not None:
+            if min_successors < 1:
+                raise ValueError('min_successors must be at least one')
+            view._min_successors = min_successors
+        return view
+
+    def _path(self, prefix):
+        """Get the edges from the root to a prefix's longest context."""
+        if len(prefix) < self._prefix_len:
+            return prefix[::-1] + (START,)
+        return prefix[::-1]
+
+    def _add(self, prefix, word_id):
+        """Record word_id following prefix, and every shorter context."""
+        self._add_path(self._path(prefix), word_id, True)
+
+    def _add_start(self, prefix, word_id):
+        """Record word_id following prefix at the start of a sentence.
+
+        The shorter contexts already count the word, as it's also added
+        following the words before it.
+        """
+        self._add_path(self._path(prefix), word_id, False)
+
+    def _add_path(self, path, word_id, every_node):
+        children = self._children
+        entries = self._entries
+        node = 0
+        if every_node:
+            self._count(0, word_id)
+        for edge in path:
+            key = (node << _NODE_SHIFT) | edge
+            child = children.get(key)
+            if child is None:
+                child = children[key] = len(entries)
+                entries.append(None)
+            node = child
+            if every_node:
+                self._count(node, word_id)
+        if not every_node:
+            self._count(node, word_id)
+
+    def _count(self, node, word_id):
+        entries = self._entries
+        entry = entries[node]
+        if entry is None:
+            entries[node] = word_id
+        elif type(entry) is int:
+            table = markov._SuccessorTable({entry: 1})
+            table.add(word_id)
+            entries[node] = table
+        else:
+            entry.add(word_id)
+
+    # the same interface MarkovChain gives the Punkt builder
+    def _update_words(self, words, current_prefix=()):
+        prefix_len = self._prefix_len
+        add_word = self._vocab.add
+        for word in words:
+            word_id = add_word(word)
+            self._add(current_prefix, word_id)
+            current_prefix = (current_prefix + (word_id,))[-prefix_len:]
+        return current_prefix
+
+    def _add_chain_start(self, sentence):
+        prefix = ()
+        for word in sentence.split()[:self._prefix_len]:
+            word_id = self._vocab.add(word)
+            self._add_start(prefix, word_id)
+            prefix += (word_id,)
+
+    def _context(self, prefix):
+        """Find the node whose successors generation uses after prefix.
+
+        That's the longest context with at least min_successors different
+        successors, or the root if none has.
+        """
+        children = self._children
+        entries = self._entries
+        min_successors = self._min_successors
+        node = best = 0
+        for edge in self._path(prefix):
+            if edge < 0:
+                # markov.UNKNOWN_WORD, which is never in the trie
+                break
+            node = children.get((node << _NODE_SHIFT) | edge)
+            if node is None:
+                break
+            entry = entries[node]
+            if entry is None:
+                break
+            if min_successors > 1 and (type(entry) is int or
+                                       len(entry.counts) < min_successors):
+                # longer contexts only have fewer successors
+                break
+            best = node
+        return best
+
+    def _sample_next(self, prefix, max_syllables=None):
+        entry = self._entries[self._context(prefix)]
+        if entry is None:
+            # nothing has been added to the chain
+            return None
+        if not self.syllables_indexed:
+            if max_syllables is not None:
+                raise ValueError("The chain has no syllable index")
+            return markov._sample(entry, aliases=self._aliases)
+        return markov._sample(entry, max_syllables, self._word_syllables,
+                              self._aliases)
+
+    def successors(self, prefix):
+        """Return a {word id: count} dictionary of the words generation can
+        pick after a prefix (a tuple of word ids), after backing off."""
+        entry = self._entries[self._context(prefix)]
+        if entry is None:
+            return {}
+        return dict(markov._successor_counts(entry))
+
+    def _prune(self):
+        """Remove the nodes below contexts that were only seen once.
+
+        Their successors are the same as their parent's, so generating
+        from the parent instead gives the same results.
+        """
+        children = {}
+        entries = [self._entries[0]]
+        # the new number of each node that's kept
+        kept = {0: 0}
+        # nodes are numbered in the order they're added, so parents come
+        # before their children
+        for key, node in self._children.items():
+            parent = kept.get(key >> _NODE_SHIFT)
+            if parent is None or (parent != 0 and
+                                  type(entries[parent]) is int):
+                continue
+            kept[node] = children[
+                (parent << _NODE_SHIFT) | (key & _EDGE_MASK)] = len(entries)
+            entries.append(self._entries[node])
+        self._children = children
+        self._entries = entries
+
+    def _successor_items(self):
+        """Iterate over the contexts a MarkovChain with this prefix length
+        would have, without backing off, apart from those pruned from the
+        trie."""
+        prefix_len = self._prefix_len
+        paths = {0: ()}
+        for key, node in self._children.items():
+            parent_path = paths.get(key >> _NODE_SHIFT)
+            if parent_path is None or parent_path[-1:] == (START,):
+                continue
+            path = parent_path + (key & _EDGE_MASK,)
+            if len(path) > prefix_len:
+                continue
+            paths[node] = path
+            entry = self._entries[node]
+            if entry is None:
+                continue
+            if path[-1] == START:
+                yield path[-2::-1], markov._successor_counts(entry)
+            elif len(path) == prefix_len:
+                yield path[::-1], markov._successor_counts(entry)
+
+    def index_syllables(self, syllables):
+        """Group each context's successors by their number of syllables.
+
+        Args:
+            syllables: a function that returns the number of syllables in
+                a word, or None if it isn't known.
+        """
+        self._lookup_syllables = syllables
+        self._syllables = array("B")
+        for entry in self._entries:
+            if entry is not None and type(entry) is not int:
+                entry._ids = None
+        self.syllables_indexed = True
+        # the syllable counts may have changed
+        self.version += 1
+
+    # looked up the same way as for a MarkovChain
+    _word_syllables = markov.MarkovChain._word_syllables
+    syllable_count = markov.MarkovChain.syllable_count
+    ends_sentence = markov.MarkovChain.ends_sentence
+
+    @classmethod
+    def from_string(cls, text, prefix_len=2, punkt=False, min_successors=1):
+        """Build a chain from a string.
+
+        Args:
+            text (string): the input text
+            prefix_len (int): the longest prefix length to store
+            punkt (bool): find sentences with NLTK's Punkt tokenizer,
+                rather than the faster built-in rules
+            min_successors (int): see __init__
+
+        Returns:
+            A BackoffChain
+        """
+        chain = cls(prefix_len, min_successors=min_successors)
+        builder = (markov._PunktBuilder(chain) if punkt else
+                   markov._ChainBuilder(chain))
+        builder.feed(text.split())
+        builder.close()
+        chain._prune()
+        return chain
+
+    @classmethod
+    def from_files(cls, file_names, prefix_len, punkt=False,
+                   min_successors=1):
+        """Build a chain from a list of files, as MarkovChain.from_files does.
+
+        Args:
+            file_names (list of strings): files to read input text from
+            prefix_len (int): the longest prefix length to store
+            punkt (bool): find sentences with NLTK's Punkt tokenizer,
+                rather than the faster built-in rules
+            min_successors (int): see __init__
+
+        Returns:
+            A BackoffChain
+        """
+        chain = cls(prefix_len, min_successors=min_successors)
+        builder_class = (markov._PunktBuilder if punkt else
+                         markov._ChainBuilder)
+        for file_name in file_names:
+            with markov._open_text(file_name) as f:
+                builder = builder_class(chain)
+                for words in markov._read_words(f):
+                    builder.feed(words)
+                builder.close()
+        chain._prune()
+        return chain
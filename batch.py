@@ -0,0 +1,322 @@
+"""Generating many haiku at once, in lockstep, with NumPy.
+
+A BatchSampler keeps the state of a batch of haiku in arrays (the chain's
+current prefix, and the syllables left in the poem, for each) and advances
+every haiku in the batch by a word at each step, with a handful of NumPy
+operations over the whole batch. Finished haiku are replaced by new ones
+until enough have been started.
+
+It needs a csrchain.CSRChain, since its successors are already in flat
+arrays. Like FeasibilityTable, it only ever draws a word that can still
+lead to a finished haiku, but it works out every position that can be
+finished before generating, in one pass over the chain for each number of
+syllables left, instead of lazily. Each word is drawn with the chain's
+probabilities restricted to those words, as generate_haiku draws it, though
+from NumPy's random generator rather than the random module, so the haiku
+differ from generate_haiku's for the same seed.
+
+This module exports the BatchSampler class.
+"""
+import numpy as np
+
+import chainfile
+import csrchain
+import markov
+import util
+
+# Draws a row may have rejected in a row before it picks from the words
+# that can finish directly, as FeasibilityTable.sample does
+_SAMPLE_TRIES = 8
+# Bits for a syllable count in _cut_keys; the syllable index stores counts
+# up to markov.UNKNOWN_SYLLABLES
+_SYLLABLE_BITS = 8
+
+
+class BatchSampler:
+    """Generates haiku from a CSRChain, a batch at a time.
+
+    Building one works out which (prefix, syllables left) positions can be
+    finished, which takes a few vectorized passes over the chain; after
+    that, generate can be called any number of times.
+    """
+
+    def __init__(self, chain, line_syllables, batch_size=4096):
+        """Initialize the sampler.
+
+        Args:
+            chain (csrchain.CSRChain): the chain to generate from. It must
+                have a syllable index.
+            line_syllables (sequence of ints): syllables in each line
+            batch_size (int): how many haiku to generate at once
+        Raises:
+            ValueError if the chain isn't a CSRChain with a syllable index,
+                or no haiku can be generated from it
+        """
+        if not isinstance(chain, csrchain.CSRChain):
+            raise ValueError("The batch sampler needs a CSR chain")
+        if not chain.syllables_indexed:
+            raise ValueError("The chain has no syllable index")
+        self._chain = chain
+        self.batch_size = batch_size
+        self.line_syllables = tuple(line_syllables)
+        self.total_syllables = sum(line_syllables)
+        if self.total_syllables >= 32:
+            raise ValueError("A haiku can have at most 31 syllables")
+        # the poem's syllables left at the end of each line, in line order
+        self._line_ends = []
+        remaining = self.total_syllables
+        for syllables in line_syllables:
+            remaining -= syllables
+            self._line_ends.append(remaining)
+        # how many of the poem's remaining syllables are in the current line
+        self._line_remaining = np.zeros(self.total_syllables + 1,
+                                        dtype=np.int64)
+        for remaining in range(1, self.total_syllables + 1):
+            line_end = max(end for end in self._line_ends if end < remaining)
+            self._line_remaining[remaining] = remaining - line_end
+
+        offsets = chain._offsets
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self._successors = np.asarray(chain._successors)
+        self._syllables = np.asarray(chain._successor_syllables,
+                                     dtype=np.int64)
+        self._cumulative = np.concatenate(
+            ([0], np.asarray(chain._cumulative, dtype=np.int64)))
+        self._counts = np.diff(self._cumulative)
+        entry_prefixes = np.repeat(np.arange(len(offsets) - 1),
+                                   np.diff(offsets))
+        # successors are sorted by prefix, then syllables, so searching
+        # these finds where a prefix's successors get too long for a line
+        self._cut_keys = (entry_prefixes << _SYLLABLE_BITS) | self._syllables
+        self._next = self._next_prefixes(entry_prefixes)
+        self._words = self._decode_words()
+        self._finishes = self._find_finishes()
+        self._start = chain._find(())
+        if (self._start is None or
+                not self._feasible[self._start] >> self.total_syllables & 1):
+            raise ValueError("Can't generate a haiku from this text")
+
+    def _decode_words(self):
+        """Get the chain's whole vocabulary as a list of strings."""
+        offsets = self._chain._arrays["word_offsets"].tolist()
+        data = self._chain._arrays["word_bytes"].tobytes()
+        return [data[start:end].decode("utf-8")
+                for start, end in zip(offsets, offsets[1:])]
+
+    def _next_prefixes(self, entry_prefixes):
+        """Find the prefix each successor leads to, or -1 for none."""
+        chain = self._chain
+        prefixes = np.asarray(chain._prefixes)
+        prefix_len = prefixes.shape[1]
+        rows = prefixes[entry_prefixes]
+        lengths = np.count_nonzero(rows != chainfile._NONE, axis=1)
+        full = lengths == prefix_len
+        # a full prefix drops its first word; a shorter one, at the start of
+        # a sentence, grows
+        new_rows = rows
+        new_rows[full, :-1] = rows[full, 1:]
+        new_rows[full, -1] = self._successors[full]
+        short = np.flatnonzero(~full)
+        new_rows[short, lengths[short]] = self._successors[short]
+        del rows
+
+        hashes = np.asarray(chain._hashes)
+        hash_order = np.asarray(chain._hash_order)
+        targets = csrchain._hash_rows(new_rows)
+        positions = np.searchsorted(hashes, targets)
+        found = positions < len(hashes)
+        positions[~found] = 0
+        candidates = hash_order[positions]
+        found &= hashes[positions] == targets
+        matches = found & np.all(prefixes[candidates] == new_rows, axis=1)
+        next_prefixes = np.where(matches, candidates, -1)
+        # hash collisions: look at the other prefixes with the same hash
+        for entry in np.flatnonzero(found & ~matches).tolist():
+            position = int(positions[entry]) + 1
+            while (position < len(hashes) and
+                   hashes[position] == targets[entry]):
+                candidate = int(hash_order[position])
+                if np.array_equal(prefixes[candidate], new_rows[entry]):
+                    next_prefixes[entry] = candidate
+                    break
+                position += 1
+        return next_prefixes
+
+    def _find_finishes(self):
+        """Work out which successors can lead to a finished haiku.
+
+        Returns:
+            A bit mask for each successor, with bit r set if the successor
+            fits and the poem can be finished after it, with r syllables
+            left before it. Also sets self._feasible, the same for each
+            prefix (if any of its successors can).
+        """
+        syllables = self._syllables
+        next_prefixes = self._next
+        offsets = self._offsets
+        word_flags = self._chain._arrays["word_flags"]
+        ends_sentence = (word_flags[self._successors] &
+                         markov.WORD_ENDS_SENTENCE) != 0
+        has_next = next_prefixes >= 0
+        zero_syllables = np.any((syllables == 0) & has_next)
+        feasible = np.zeros(len(offsets) - 1, dtype=np.int64)
+        finishes = np.zeros(len(syllables), dtype=np.int64)
+        for remaining in range(1, self.total_syllables + 1):
+            fits = syllables <= self._line_remaining[remaining]
+            last = fits & (syllables == remaining) & ends_sentence
+            going_on = np.flatnonzero(fits & (syllables < remaining) &
+                                      has_next)
+            shifts = remaining - syllables[going_on]
+            targets = next_prefixes[going_on]
+            while True:
+                can = last.copy()
+                can[going_on] = feasible[targets] >> shifts & 1
+                prefix_can = np.logical_or.reduceat(can, offsets[:-1])
+                updated = feasible | prefix_can.astype(np.int64) << remaining
+                changed = np.any(updated != feasible)
+                feasible = updated
+                # words with no syllables lead to positions with the same
+                # number left, which this pass may just have found
+                if not (changed and zero_syllables):
+                    break
+            finishes |= can.astype(np.int64) << remaining
+        self._feasible = feasible
+        return finishes
+
+    def generate(self, count, rng, stats=None, clean=True):
+        """Generate haiku.
+
+        Args:
+            count (int): how many haiku to generate
+            rng (numpy.random.Generator): the source of random numbers
+            stats (haiku.GenerationStats): optional counters to update. Only
+                the counts are, not the timings, since the haiku in a batch
+                are generated together.
+            clean (bool): whether to fix the haiku's punctuation. Without,
+                the caller has to, with util.strip_punctuation.
+        Yields:
+            Haiku (strings), in the order they're finished.
+        """
+        size = min(self.batch_size, count)
+        width = 2 * self.total_syllables
+        prefixes = np.full(size, self._start, dtype=np.int64)
+        remaining = np.full(size, self.total_syllables, dtype=np.int64)
+        tries = np.zeros(size, dtype=np.int64)
+        words = np.zeros((size, width), dtype=np.int64)
+        word_counts = np.zeros(size, dtype=np.int64)
+        active = np.arange(size)
+        started = size
+        while len(active):
+            rows_prefix = prefixes[active]
+            rows_remaining = remaining[active]
+            lo = self._offsets[rows_prefix]
+            hi = np.searchsorted(
+                self._cut_keys,
+                rows_prefix << _SYLLABLE_BITS |
+                self._line_remaining[rows_remaining],
+                side="right")
+            base = self._cumulative[lo]
+            targets = base + rng.integers(self._cumulative[hi] - base)
+            entries = np.searchsorted(self._cumulative, targets,
+                                      side="right") - 1
+            accepted = (self._finishes[entries] >> rows_remaining & 1) == 1
+
+            rejected = active[~accepted]
+            if len(rejected):
+                if stats is not None:
+                    stats.rejections += len(rejected)
+                tries[rejected] += 1
+                gave_up = np.flatnonzero(~accepted &
+                                         (tries[active] >= _SAMPLE_TRIES))
+                if len(gave_up):
+                    if stats is not None:
+                        stats.fallbacks += len(gave_up)
+                    entries[gave_up] = self._pick_finishing(
+                        lo[gave_up], hi[gave_up], rows_remaining[gave_up],
+                        rng)
+                    accepted[gave_up] = True
+
+            rows = active[accepted]
+            entries = entries[accepted]
+            tries[rows] = 0
+            if np.any(word_counts[rows] == width):
+                # words with no syllables made a haiku long
+                words = np.concatenate([words, np.zeros_like(words)], axis=1)
+                width *= 2
+            words[rows, word_counts[rows]] = entries
+            word_counts[rows] += 1
+            prefixes[rows] = self._next[entries]
+            remaining[rows] -= self._syllables[entries]
+
+            finished = rows[remaining[rows] == 0]
+            if len(finished):
+                yield from self._haiku(words[finished], word_counts[finished],
+                                       stats, clean)
+            for row in finished.tolist():
+                if started < count:
+                    started += 1
+                    prefixes[row] = self._start
+                    remaining[row] = self.total_syllables
+                    word_counts[row] = 0
+                else:
+                    remaining[row] = -1
+            active = np.flatnonzero(remaining > 0)
+
+    def _pick_finishing(self, lo, hi, remaining, rng):
+        """Pick a successor that can finish for each of several rows.
+
+        Args:
+            lo, hi (arrays): the successors each row picks from are lo to
+                hi - 1
+            remaining (array): the syllables left in each row's poem
+            rng (numpy.random.Generator): the source of random numbers
+        Returns:
+            An array of successor indexes
+        """
+        lengths = hi - lo
+        ends = np.cumsum(lengths)
+        # every row's successors, one after another
+        entries = np.arange(ends[-1]) + np.repeat(lo - (ends - lengths),
+                                                  lengths)
+        counts = self._counts[entries]
+        counts[(self._finishes[entries] >> np.repeat(remaining, lengths) &
+                1) == 0] = 0
+        cumulative = np.concatenate(([0], np.cumsum(counts)))
+        base = cumulative[ends - lengths]
+        targets = base + rng.integers(cumulative[ends] - base)
+        return entries[np.searchsorted(cumulative, targets, side="right") - 1]
+
+    def _haiku(self, entries, word_counts, stats, clean=True):
+        """Join the words of finished haiku into lines.
+
+        Args:
+            entries (array): a row of successor indexes for each haiku,
+                padded past their word counts
+            word_counts (array): the number of words in each haiku
+            stats (haiku.GenerationStats): optional counters to update
+            clean (bool): whether to fix the haiku's punctuation
+        Returns:
+            A list of haiku (strings)
+        """
+        line_ends = self._line_ends
+        vocabulary = self._words
+        all_haiku = []
+        for word_ids, syllables, word_count in zip(
+                self._successors[entries].tolist(),
+                self._syllables[entries].tolist(), word_counts.tolist()):
+            lines = []
+            start = 0
+            remaining = self.total_syllables
+            for end in range(word_count):
+                remaining -= syllables[end]
+                if remaining == line_ends[len(lines)]:
+                    lines.append(" ".join([vocabulary[word_id] for word_id
+                                           in word_ids[start:end + 1]]))
+                    start = end + 1
+            haiku = "\n".join(lines)
+            all_haiku.append(util.strip_punctuation(haiku) if clean
+                             else haiku)
+        if stats is not None:
+            stats.haiku += len(all_haiku)
+            stats.words += int(word_counts.sum())
+        return all_haiku
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Compare the built-in sentence rules with NLTK's Punkt tokenizer.
+
+For each text in the corpus, builds the chain both ways, and reports the
+build times, and how much the sentence starts (the successors of the empty
+prefix, counted with multiplicity) found by each agree.
+
+Run from the top of the repository:
+
+    python3 benchmarks/sentence_starts.py [-l PREFIX_LEN] [files...]
+"""
+import argparse
+import collections
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import markov  # noqa: E402
+
+
+def _build(file_name, prefix_len, punkt):
+    start = time.perf_counter()
+    chain = markov.MarkovChain.from_files([file_name], prefix_len,
+                                          punkt=punkt)
+    elapsed = time.perf_counter() - start
+    vocab = chain.vocab
+    starts = collections.Counter({vocab.word(word_id): count
+                                  for word_id, count
+                                  in chain.successors(()).items()})
+    return elapsed, starts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*",
+                        default=sorted(glob.glob("corpus/*.txt")))
+    parser.add_argument("-l", "--prefix-len", type=int, default=2)
+    args = parser.parse_args()
+
+    # load the Punkt model before timing anything
+    markov.MarkovChain.from_string("Load Punkt. Now.", punkt=True)
+    print("{:<28} {:>9} {:>9} {:>8} {:>8} {:>8} {:>9} {:>6}".format(
+        "file", "rules (s)", "punkt (s)", "speedup", "rules", "punkt",
+        "agree", "jaccard"))
+    for file_name in args.files:
+        rules_time, rules = _build(file_name, args.prefix_len, False)
+        punkt_time, punkt = _build(file_name, args.prefix_len, True)
+        agree = sum((rules & punkt).values())
+        union = sum((rules | punkt).values())
+        print("{:<28} {:>9.2f} {:>9.2f} {:>7.1f}x {:>8} {:>8} {:>9} "
+              "{:>6.3f}".format(
+                  os.path.basename(file_name), rules_time, punkt_time,
+                  punkt_time / rules_time, sum(rules.values()),
+                  sum(punkt.values()), agree, agree / union))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Measure the latency of the haiku server.
+
+Starts a server in this process, makes requests to it from several
+concurrent clients (each over its own keep-alive connection), and reports
+latency percentiles and throughput.
+
+Run from the top of the repository:
+
+    python3 benchmarks/server_latency.py [-n REQUESTS] [-c CLIENTS] [files...]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import server  # noqa: E402
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+async def _client(host, port, targets, latencies):
+    async with server.Client(host, port) as client:
+        for target in targets:
+            start = time.perf_counter()
+            status, response = await client.get(target)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                raise RuntimeError(response["error"])
+
+
+async def _run(chains, requests, clients, jobs):
+    targets = ["/haiku?corpus={}&prefix_len={}".format(*key)
+               for key in sorted(chains)]
+    latencies = []
+    async with server.HaikuServer(chains, port=0, jobs=jobs) as haiku_server:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            _client(haiku_server.host, haiku_server.port,
+                    [targets[i % len(targets)]
+                     for i in range(n, requests, clients)],
+                    latencies)
+            for n in range(clients)])
+        elapsed = time.perf_counter() - start
+    return sorted(latencies), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", default=["corpus/walden.txt"])
+    parser.add_argument("-l", "--prefix-len", dest="prefix_lens", type=int,
+                        nargs="+", default=[2])
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("-c", "--clients", type=int, default=8)
+    parser.add_argument("-j", "--jobs", type=int)
+    args = parser.parse_args()
+
+    chains = server.load_chains(args.files, args.prefix_lens)
+    latencies, elapsed = asyncio.run(
+        _run(chains, args.requests, args.clients, args.jobs))
+    print("{} requests from {} clients in {:.2f} s ({:.0f} requests/s)"
+          .format(len(latencies), args.clients, elapsed,
+                  len(latencies) / elapsed))
+    for name, fraction in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]:
+        print("{}: {:.2f} ms".format(
+            name, _percentile(latencies, fraction) * 1000))
+    print("max: {:.2f} ms".format(latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
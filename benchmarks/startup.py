@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Measure how long short haiku.py runs take to start.
+
+Runs each command below in a fresh interpreter a few times, and reports
+the best and median wall time, against a target. It also checks that the
+modules only some paths need (NLTK, multiprocessing, NumPy and so on)
+aren't imported by the ones that don't, and, with --importtime, lists the
+slowest imports of haiku.py, from python -X importtime.
+
+    python        the interpreter alone, for reference
+    import        import haiku
+    help          haiku.py --help
+    model         haiku.py --model, generating one haiku from a compiled
+                  chain (of tender_buttons.txt, built first)
+
+The exit status is 1 if any command's best time is over the target, or it
+imported a module it shouldn't have.
+
+Run from the top of the repository:
+
+    python3 benchmarks/startup.py [--target MS] [--importtime]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+HAIKU = os.path.join(ROOT, "haiku.py")
+
+# Modules that generating a haiku from a compiled chain has no need for
+LAZY_MODULES = ["nltk", "multiprocessing", "numpy", "chaincache", "backoff",
+                "sharding", "asyncio"]
+
+# Prints the lazy modules a command imported, after running it
+_CHECK = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    if sys.argv[0] == "-c":
+        exec(sys.argv[1])
+    else:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print(" ".join(name for name in {modules!r} if name in sys.modules),
+      file=sys.stderr)
+"""
+
+
+def _commands(model):
+    return [("python", ["-c", "pass"]),
+            ("import", ["-c", "import haiku"]),
+            ("help", [HAIKU, "--help"]),
+            ("model", [HAIKU, "--model", model, "--seed", "1"])]
+
+
+def _time(args, repeat):
+    """Run a command repeat times, and return its wall times, in ms."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def _lazy_imports(args):
+    """Get the modules in LAZY_MODULES a command imports."""
+    result = subprocess.run(
+        [sys.executable, "-c", _CHECK.format(modules=LAZY_MODULES)] +
+        args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, text=True)
+    return result.stderr.split()
+
+
+def _slowest_imports(count):
+    """Get the count slowest imports made directly by haiku, from -X
+    importtime, as (cumulative microseconds, module) pairs."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import haiku"], cwd=ROOT, check=True,
+                            stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        depth = len(name) - len(name.lstrip())
+        # a module's imports are listed before it, indented by two more
+        # spaces
+        if depth == 0:
+            if name == "haiku":
+                break
+            imports = []
+        elif depth == 2:
+            imports.append((int(fields[1]), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", type=float, default=100,
+                        help="Target wall time, in ms (default is 100)")
+    parser.add_argument("-r", "--repeat", type=int, default=7,
+                        help="Runs of each command (default is 7)")
+    parser.add_argument("--importtime", action="store_true",
+                        help="List the slowest imports of haiku.py")
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        model = os.path.join(directory, "tender_buttons.model")
+        subprocess.run([sys.executable, HAIKU, "--compile", "-o", model,
+                        "corpus/tender_buttons.txt"], cwd=ROOT, check=True)
+        print("{:<8} {:>9} {:>11}  {}".format("command", "best (ms)",
+                                              "median (ms)", "lazy imports"))
+        for name, command in _commands(model):
+            times = _time(command, args.repeat)
+            imported = _lazy_imports(command)
+            over = min(times) > args.target
+            ok = ok and not over and not imported
+            print("{:<8} {:>9.1f} {:>11.1f}  {}{}".format(
+                name, min(times), statistics.median(times),
+                ", ".join(imported) or "none",
+                "  (over the target)" if over else ""))
+    if args.importtime:
+        print("\nslowest imports of haiku.py:")
+        for microseconds, module in _slowest_imports(15):
+            print("{:>8.1f} ms  {}".format(microseconds / 1000, module))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Benchmark util.strip_punctuation against the implementation it replaced.
+
+The old version made three passes over the text, calling a predicate for
+every character, and then checked every index against lists of unmatched
+characters, which is quadratic in the length of the text. The inputs are
+passages of Moby Dick (which has plenty of quotes) of increasing length.
+
+Run from the top of the repository:
+
+    python3 benchmarks/strip_punctuation.py
+"""
+import os
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import util  # noqa: E402
+
+CORPUS_FILE = "corpus/moby_dick.txt"
+LENGTHS = [100, 1000, 10000, 50000]
+
+
+def old_strip_unbalanced_punctuation(text, is_open_char, is_close_char):
+    opening_chars = []
+    unmatched_closing_chars = []
+    for idx, c in enumerate(text):
+        if is_open_char(text, idx):
+            opening_chars.append(idx)
+        elif is_close_char(text, idx):
+            if opening_chars:
+                opening_chars.pop()
+            else:
+                unmatched_closing_chars.append(idx)
+    char_indices = [i for (i, _) in enumerate(text)
+                    if not(i in opening_chars or i in unmatched_closing_chars)]
+    return "".join([text[i] for i in char_indices])
+
+
+def old_strip_punctuation(text):
+    def quote_is_open(text, idx):
+        if text[idx-1] in string.whitespace:
+            return True
+        elif len(text) == idx + 1:
+            return False
+        elif text[idx+1] in string.whitespace:
+            return False
+        else:
+            return True
+
+    text = old_strip_unbalanced_punctuation(
+        text,
+        lambda text, idx: text[idx] == "\"" and quote_is_open(text, idx),
+        lambda text, idx: text[idx] == "\"" and not quote_is_open(text, idx))
+    text = old_strip_unbalanced_punctuation(
+        text, lambda text, idx: text[idx] == "“",
+        lambda text, idx: text[idx] == "”")
+    return old_strip_unbalanced_punctuation(
+        text, lambda text, idx: text[idx] == "(",
+        lambda text, idx: text[idx] == ")")
+
+
+def _time(function, text):
+    """Return the best time of a few runs, in seconds."""
+    timer = timeit.Timer(lambda: function(text))
+    number, _ = timer.autorange()
+    return min(timer.repeat(3, number)) / number
+
+
+def main():
+    with open(CORPUS_FILE) as f:
+        corpus = f.read()
+    # skip the front matter, which has no quotes
+    corpus = corpus[len(corpus) // 3:]
+    print("{:>8} {:>12} {:>12} {:>8}".format("chars", "old (ms)", "new (ms)",
+                                              "speedup"))
+    for length in LENGTHS:
+        text = corpus[:length]
+        if old_strip_punctuation(text) != util.strip_punctuation(text):
+            sys.exit("Outputs differ for {} characters".format(length))
+        old = _time(old_strip_punctuation, text)
+        new = _time(util.strip_punctuation, text)
+        print("{:>8} {:>12.3f} {:>12.3f} {:>7.0f}x".format(
+            length, old * 1000, new * 1000, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Benchmark suite over the texts in corpus/, at prefix lengths 1 to 4.
+
+For each text and prefix length, in a fresh process (so memory use isn't
+muddled by earlier cases), it measures:
+
+    build_seconds         time to build the chain with from_files
+    peak_memory_mb        peak memory allocated while building, traced
+                          with tracemalloc
+    next_word_per_second  words generated with GenerationState.next_word
+    first_haiku_seconds   time to the first haiku, filling in the
+                          feasibility table
+    haiku_per_second      haiku generated with generate_haiku after that
+    rejections_per_haiku  words the feasibility sampler drew and rejected
+    fallbacks_per_haiku   times it gave up drawing and listed the
+                          successors instead
+
+Random seeds are fixed, so the counts are the same from run to run, and
+only the timings vary; the build and next_word timings are the best of a few
+runs. The results are written as JSON, and compared
+against a stored baseline: any timing or memory use more than --tolerance
+worse than the baseline, or any increase in the counts, is reported, and
+makes the exit status 1. Timings are compared relative to a fixed
+reference workload, timed alongside each case, so a machine that's busier
+than when the baseline was saved doesn't show up as a regression. Even so,
+the baseline is only meaningful on the machine it was saved on.
+
+Run from the top of the repository:
+
+    python3 benchmarks/suite.py                     # run and compare
+    python3 benchmarks/suite.py --save-baseline     # update the baseline
+    python3 benchmarks/suite.py -c walden -l 2      # just some cases
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+import haiku  # noqa: E402
+import markov  # noqa: E402
+
+BASELINE_FILE = os.path.join(ROOT, "benchmarks", "baseline.json")
+RESULTS_FILE = os.path.join(ROOT, "benchmarks", "results.json")
+PREFIX_LENS = [1, 2, 3, 4]
+SEED = 1
+
+NEXT_WORDS = 100000
+HAIKU = 200
+# Timings are the best of this many runs, to smooth out noise
+REPEAT = 3
+
+# Whether a larger value of each metric is better
+HIGHER_IS_BETTER = {
+    "build_seconds": False,
+    "peak_memory_mb": False,
+    "next_word_per_second": True,
+    "first_haiku_seconds": False,
+    "haiku_per_second": True,
+    "rejections_per_haiku": False,
+    "fallbacks_per_haiku": False,
+}
+# Metrics that are the same from run to run with the same seed
+COUNTS = {"rejections_per_haiku", "fallbacks_per_haiku"}
+
+
+def _build_peak_memory_mb(file_name, prefix_len):
+    """Build a chain, and return it and the most memory allocated while
+    building it.
+
+    This is traced, rather than read from the process's peak resident size,
+    which earlier work (like the calibration) may already have pushed above
+    anything a small chain needs.
+    """
+    tracemalloc.start()
+    try:
+        chain = markov.MarkovChain.from_files([file_name], prefix_len)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return chain, peak / (1 << 20)
+
+
+def _best_of(function):
+    """Time the quickest of REPEAT calls to a function, in seconds."""
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _reference_work():
+    """A fixed workload like the chain's, to calibrate timings against."""
+    counts = {}
+    rng = random.Random(SEED)
+    for _ in range(100000):
+        key = (rng.randrange(1000), rng.randrange(1000))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def run_case(file_name, prefix_len, next_words=NEXT_WORDS, haiku_count=HAIKU):
+    """Measure one text at one prefix length.
+
+    Returns:
+        A dictionary of metrics, keyed by the names in HIGHER_IS_BETTER
+    """
+    result = {"calibration_seconds": _best_of(_reference_work)}
+    chain, result["peak_memory_mb"] = _build_peak_memory_mb(file_name,
+                                                            prefix_len)
+    result["build_seconds"] = _best_of(
+        lambda: markov.MarkovChain.from_files([file_name], prefix_len))
+
+    def generate_words():
+        random.seed(SEED)
+        state = chain.start()
+        for _ in range(next_words):
+            if not state.next_word():
+                state = chain.start()
+    result["next_word_per_second"] = next_words / _best_of(generate_words)
+
+    random.seed(SEED)
+    start = time.perf_counter()
+    try:
+        haiku.generate_haiku(chain)
+    except ValueError:
+        # no haiku in this text at this prefix length
+        return result
+    result["first_haiku_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(haiku_count):
+        haiku.generate_haiku(chain)
+    result["haiku_per_second"] = haiku_count / (time.perf_counter() - start)
+    table = haiku._feasibility_table(chain)
+    result["rejections_per_haiku"] = table.rejections / (haiku_count + 1)
+    result["fallbacks_per_haiku"] = table.fallbacks / (haiku_count + 1)
+    return result
+
+
+def _run_in_subprocess(file_name, prefix_len, quick):
+    command = [sys.executable, os.path.abspath(__file__), "--case",
+               file_name, str(prefix_len)]
+    if quick:
+        command.append("--quick")
+    output = subprocess.run(command, cwd=ROOT, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def compare(results, baseline, tolerance):
+    """Find the metrics that got worse than the baseline.
+
+    Args:
+        results, baseline (dict): results files, as written by main()
+        tolerance (float): how much worse (as a fraction) a timing or
+            memory metric can get before it counts. The counts can't get any
+            worse.
+
+    Returns:
+        A list of (case, metric, baseline value, new value) tuples, where
+        new timings are scaled by how long a reference workload took in the
+        baseline and the new results
+    """
+    old_cases = {(case["corpus"], case["prefix_len"]): case
+                 for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        old = old_cases.get((case["corpus"], case["prefix_len"]))
+        if old is None:
+            continue
+        # how much slower this machine is running than the baseline's
+        slowdown = case["calibration_seconds"] / old["calibration_seconds"]
+        for metric, higher_is_better in HIGHER_IS_BETTER.items():
+            if metric not in case or metric not in old:
+                continue
+            new_value, old_value = case[metric], old[metric]
+            if metric.endswith("_seconds"):
+                new_value /= slowdown
+            elif metric.endswith("_per_second"):
+                new_value *= slowdown
+            if metric in COUNTS:
+                # these don't depend on timing, so any increase counts
+                worse = new_value > old_value + 1e-9
+            elif higher_is_better:
+                worse = new_value < old_value * (1 - tolerance)
+            else:
+                worse = new_value > old_value * (1 + tolerance)
+            if worse:
+                regressions.append(("{}/{}".format(case["corpus"],
+                                                   case["prefix_len"]),
+                                    metric, old_value, new_value))
+    return regressions
+
+
+def _print_case(case):
+    print("{:>16}/{} {}".format(
+        case["corpus"], case["prefix_len"],
+        " ".join("{}={:.4g}".format(metric, case[metric])
+                 for metric in HIGHER_IS_BETTER if metric in case)),
+        flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--corpus", nargs="+",
+                        help="Names of the corpus texts to run (default all)")
+    parser.add_argument("-l", "--prefix-len", type=int, nargs="+",
+                        default=PREFIX_LENS,
+                        help="Prefix lengths to run (default 1 to 4)")
+    parser.add_argument("-o", "--output", default=RESULTS_FILE,
+                        help="Where to write the results")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help="Results to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Write the results to the baseline file too")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help=("How much worse than the baseline a timing "
+                              "can get, as a fraction (default 0.5)"))
+    parser.add_argument("--quick", action="store_true",
+                        help="Do a tenth of the generation work")
+    parser.add_argument("--case", nargs=2, metavar=("FILE", "PREFIX_LEN"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    scale = 10 if args.quick else 1
+    if args.case:
+        file_name, prefix_len = args.case
+        json.dump(run_case(file_name, int(prefix_len), NEXT_WORDS // scale,
+                           HAIKU // scale), sys.stdout)
+        return
+
+    file_names = sorted(glob.glob("corpus/*"))
+    if args.corpus:
+        file_names = [file_name for file_name in file_names
+                      if os.path.basename(file_name).split(".")[0]
+                      in args.corpus]
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": SEED,
+        "quick": args.quick,
+        "cases": [],
+    }
+    for file_name in file_names:
+        for prefix_len in args.prefix_len:
+            case = {"corpus": os.path.basename(file_name).split(".")[0],
+                    "prefix_len": prefix_len}
+            case.update(_run_in_subprocess(file_name, prefix_len,
+                                           args.quick))
+            _print_case(case)
+            results["cases"].append(case)
+
+    outputs = [args.output] + ([args.baseline] if args.save_baseline else [])
+    for output in outputs:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("quick") != args.quick:
+        print("The baseline was run with{} --quick; the timings aren't "
+              "comparable".format("" if baseline.get("quick") else "out"))
+    regressions = compare(results, baseline, args.tolerance)
+    for case, metric, old_value, new_value in regressions:
+        print("REGRESSION {} {}: {:.4g} -> {:.4g}".format(
+            case, metric, old_value, new_value))
+    if regressions:
+        sys.exit(1)
+    print("No regressions against {}".format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
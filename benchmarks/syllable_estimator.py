@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Measure the syllable estimator, and what it does for generating haiku.
+
+First, how often syllables.estimate gets the syllables of words in the CMU
+pronouncing dictionary right, on a random sample of them, counted as if
+they weren't in it.
+
+Then, for each text in the corpus, builds the chain twice, once counting
+only the words in the dictionary (as haiku.py does by default) and once
+estimating the others (as with --estimate-syllables), and reports for each:
+
+    oov         the fraction of the words in the text that aren't in the
+                dictionary, which are never used without estimates
+    haiku/s     haiku generated per second, after the first
+    rejections  words drawn and then rejected, per haiku, because the haiku
+                couldn't be finished after them
+    fallbacks   times per haiku drawing gave up, and listed the successors
+                that could finish instead
+
+Run from the top of the repository:
+
+    python3 benchmarks/syllable_estimator.py [-l PREFIX_LEN] [files...]
+"""
+import argparse
+import collections
+import glob
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import haiku  # noqa: E402
+import markov  # noqa: E402
+import syllables  # noqa: E402
+import util  # noqa: E402
+
+SEED = 1
+
+
+def accuracy(sample_size):
+    """Compare estimates to the dictionary, for a sample of its words.
+
+    Returns:
+        (fraction right, fraction off by at most one, {error: count})
+    """
+    table = syllables.get_table()
+    words = sorted(word for word in table if word.isalpha())
+    sample = random.Random(SEED).sample(words, min(sample_size, len(words)))
+    errors = collections.Counter(syllables.estimate(word) - table[word]
+                                 for word in sample)
+    return (errors[0] / len(sample),
+            sum(errors[error] for error in (-1, 0, 1)) / len(sample),
+            errors)
+
+
+def _oov_fraction(file_name):
+    """The fraction of the words in a text that aren't in the dictionary."""
+    words = missing = 0
+    with markov._open_text(file_name) as f:
+        for chunk in markov._read_words(f):
+            words += len(chunk)
+            missing += sum(util.lookup_syllables(word) is None
+                           for word in chunk)
+    return missing / words
+
+
+def run_case(file_name, prefix_len, estimate, haiku_count):
+    """Generate haiku from a text, with or without estimates.
+
+    Returns:
+        A dictionary of the metrics described above, or None if the text
+        can't make a haiku
+    """
+    chain = markov.MarkovChain.from_files([file_name], prefix_len)
+    chain.index_syllables(util.estimate_syllables if estimate
+                          else util.lookup_syllables)
+    random.seed(SEED)
+    try:
+        haiku.generate_haiku(chain)
+    except ValueError:
+        return None
+    stats = haiku.GenerationStats()
+    start = time.perf_counter()
+    for _ in range(haiku_count):
+        haiku.generate_haiku(chain, stats)
+    return {"haiku_per_second": haiku_count / (time.perf_counter() - start),
+            "rejections": stats.rejections / haiku_count,
+            "fallbacks": stats.fallbacks / haiku_count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*",
+                        default=sorted(glob.glob("corpus/*.txt")))
+    parser.add_argument("-l", "--prefix-len", type=int, default=2)
+    parser.add_argument("-n", "--count", type=int, default=500,
+                        help="Haiku to generate from each chain")
+    parser.add_argument("--sample", type=int, default=20000,
+                        help="Dictionary words to estimate")
+    args = parser.parse_args()
+
+    right, close, errors = accuracy(args.sample)
+    print("estimates of {} dictionary words: {:.1%} right, {:.1%} within "
+          "one syllable".format(args.sample, right, close))
+    print("  off by: " + ", ".join(
+        "{:+d}: {}".format(error, count)
+        for error, count in sorted(errors.items()) if error))
+    print()
+    print("{:<24} {:>6} {:>18} {:>18} {:>18}".format(
+        "file", "oov", "haiku/s", "rejections", "fallbacks"))
+    print("{:<24} {:>6} {:>18} {:>18} {:>18}".format(
+        "", "", *["dict / estimated"] * 3))
+    for file_name in args.files:
+        oov = _oov_fraction(file_name)
+        cases = [run_case(file_name, args.prefix_len, estimate, args.count)
+                 for estimate in (False, True)]
+        columns = []
+        for metric in ("haiku_per_second", "rejections", "fallbacks"):
+            columns.append(" / ".join(
+                "{:>7.2f}".format(case[metric]) if case else "{:>7}".format(
+                    "-") for case in cases))
+        print("{:<24} {:>6.1%} {:>18} {:>18} {:>18}".format(
+            os.path.basename(file_name), oov, *columns), flush=True)
+
+
+if __name__ == '__main__':
+    main()
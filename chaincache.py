@@ -0,0 +1,160 @@
+"""An on-disk cache of built Markov chains.
+
+Runs with the same input files and prefix length build the same chain each
+time. A ChainCache keeps built chains in a directory, keyed by a hash of
+the input files' contents, the prefix length, the sentence splitter and
+markov.BUILD_VERSION, so changing a corpus file (or the way chains are
+built) means the chain is built afresh rather than read from the cache.
+
+Processes running at the same time can share a cache:
+
+- Entries are written to a temporary file and renamed into place, so no
+  process ever reads a partly written chain.
+- Loading an entry updates its modification time, and when the cache is
+  over its size limit, the entries with the oldest times are removed.
+  Removing an entry while another process reads it is harmless, since the
+  reader keeps its open file.
+- Two processes that miss the same entry at once both build the chain, and
+  the second to finish replaces the first's identical entry.
+
+Entries are pickles, so only use a cache directory you trust.
+
+This module exports the ChainCache class.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import markov
+
+# The default limit on the total size of a cache's entries
+DEFAULT_MAX_BYTES = 1 << 30
+
+_SUFFIX = ".chain"
+_TEMP_PREFIX = ".tmp-"
+# Temporary files older than this (in seconds) were left by a process that
+# died while writing them
+_STALE_TEMP_AGE = 3600
+
+
+class ChainCache:
+    """A size-limited directory of built chains.
+
+    Use it through MarkovChain.from_files:
+
+        cache = ChainCache("~/.cache/haiku")
+        chain = MarkovChain.from_files(file_names, 2, cache=cache)
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """Initialize the cache, creating its directory if necessary.
+
+        Args:
+            directory (string): where to keep the cached chains
+            max_bytes (int): the most space the cached chains may take up;
+                the least recently used ones are removed to stay under it
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, cls, file_names, prefix_len, punkt=False):
+        """Get the key of the chain cls.from_files would build.
+
+        Args:
+            cls (type): the chain class
+            file_names (list of strings): the input files, whose contents
+                are hashed
+            prefix_len (int): the prefix length of the chain
+            punkt (bool): whether sentences are found with Punkt
+
+        Returns:
+            A string, which changes whenever the chain would
+        """
+        digest = hashlib.sha256(json.dumps(
+            [cls.__module__, cls.__qualname__, markov.BUILD_VERSION,
+             prefix_len, punkt]).encode("utf-8"))
+        for file_name in file_names:
+            digest.update(_hash_file(file_name))
+        return digest.hexdigest()
+
+    def load(self, key):
+        """Get a cached chain, and mark it as recently used.
+
+        Returns:
+            The chain, or None if it isn't in the cache
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                chain = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # damaged, or written by an incompatible version of the code
+            _remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by another process since it was read
+            pass
+        return chain
+
+    def store(self, key, chain):
+        """Add a chain to the cache, evicting others if it's too full."""
+        fd, temp_name = tempfile.mkstemp(prefix=_TEMP_PREFIX,
+                                         dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(chain, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, self._path(key))
+        except BaseException:
+            _remove(temp_name)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used chains until the cache fits."""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.startswith(_TEMP_PREFIX):
+                if now - stat.st_mtime > _STALE_TEMP_AGE:
+                    _remove(path)
+            elif name.endswith(_SUFFIX):
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+
+def _hash_file(file_name, block_size=1 << 20):
+    """Return the SHA-256 digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def _remove(path):
+    """Remove a file, unless another process already has."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,347 @@
+"""Compiled Markov chain files.
+
+A compiled chain is a single binary file holding everything needed to
+generate text: the vocabulary, every prefix, and each prefix's successor
+table (the sentence starts are the successors of the empty prefix).
+If the chain had a syllable index when it was saved, the file keeps each
+word's syllable count, and each successor table is sorted by it. The file
+also keeps each word's flags (see markov.word_flags), so generating from it
+doesn't have to look at the words themselves.
+Loading one memory-maps the file, so generation can start right away,
+without reading the source text or rebuilding the chain.
+
+This module exports the save and load functions, and the CompiledChain
+class that load returns.
+"""
+import bisect
+import mmap
+import random
+import struct
+import sys
+from array import array
+
+import markov
+
+MAGIC = b"HAIKUMC\0"
+VERSION = 3
+
+# magic, version, prefix length, number of words, prefixes, successor
+# entries and hash slots, and whether there's a syllable index
+_HEADER = struct.Struct("<8s7I")
+# marks unused positions in short prefixes and empty hash slots
+_NONE = 0xFFFFFFFF
+
+_FNV_OFFSET = 0xcbf29ce484222325
+_FNV_PRIME = 0x100000001b3
+_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _hash_prefix(prefix):
+    """Hash a padded prefix (a sequence of word ids) with FNV-1a.
+
+    The built-in hash can't be used because the hash table is stored in the
+    file, so it has to be the same in every process and Python version.
+    """
+    h = _FNV_OFFSET
+    for word_id in prefix:
+        h = ((h ^ word_id) * _FNV_PRIME) & _MASK
+    return h
+
+
+def _pad(prefix, prefix_len):
+    return tuple(prefix) + (_NONE,) * (prefix_len - len(prefix))
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _section_sizes(prefix_len, word_bytes, n_words, n_prefixes, n_entries,
+                   n_slots):
+    """List the (typecode, length) of each section, in file order."""
+    return [
+        ("I", n_words + 1),              # word offsets into the word bytes
+        ("B", word_bytes),               # UTF-8 encoded words
+        ("B", n_words),                  # syllables in each word
+        ("B", n_words),                  # flags of each word
+        ("I", n_prefixes * prefix_len),  # padded prefixes
+        ("I", n_prefixes + 1),           # offsets into the successor entries
+        ("I", n_entries),                # successor word ids
+        ("Q", n_entries),                # cumulative successor counts
+        ("B", n_entries),                # syllables in each successor
+        ("I", n_slots),                  # hash table of prefix indices
+    ]
+
+
+def _section_offsets(sizes):
+    """Return the file offset of each section, and the end of the last one."""
+    offsets = []
+    end = _HEADER.size
+    for typecode, length in sizes:
+        offsets.append(_align(end))
+        end = offsets[-1] + array(typecode).itemsize * length
+    return offsets, end
+
+
+def save(chain, file_name):
+    """Write a compiled copy of a chain to a file.
+
+    Args:
+        chain (markov.BaseChain): the chain to save
+        file_name (string): where to write it
+    """
+    prefix_len = chain.prefix_len
+    vocab = chain.vocab
+    indexed = chain.syllables_indexed
+
+    word_offsets = array("I", [0])
+    word_bytes = bytearray()
+    word_syllables = array("B")
+    word_flags = array("B")
+    for word_id in range(len(vocab)):
+        word = vocab.word(word_id)
+        word_bytes += word.encode("utf-8")
+        word_offsets.append(len(word_bytes))
+        word_flags.append(markov.word_flags(word))
+        count = chain.syllable_count(word_id) if indexed else None
+        word_syllables.append(
+            markov.UNKNOWN_SYLLABLES if count is None else count)
+
+    prefixes = array("I")
+    table_offsets = array("I", [0])
+    successors = array("I")
+    cumulative = array("Q")
+    successor_syllables = array("B")
+    padded_prefixes = []
+    total = 0
+    for prefix, counts in chain.items():
+        padded = _pad(prefix, prefix_len)
+        padded_prefixes.append(padded)
+        prefixes.extend(padded)
+        ids = list(counts)
+        if indexed:
+            ids.sort(key=word_syllables.__getitem__)
+        for word_id in ids:
+            total += counts[word_id]
+            successors.append(word_id)
+            cumulative.append(total)
+            successor_syllables.append(word_syllables[word_id])
+        table_offsets.append(len(successors))
+
+    # open addressing with linear probing, at most half full
+    n_slots = 1
+    while n_slots < 2 * len(padded_prefixes):
+        n_slots *= 2
+    slots = array("I", [_NONE]) * n_slots
+    for index, padded in enumerate(padded_prefixes):
+        slot = _hash_prefix(padded) & (n_slots - 1)
+        while slots[slot] != _NONE:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = index
+
+    sections = [word_offsets, array("B", word_bytes), word_syllables,
+                word_flags, prefixes, table_offsets, successors, cumulative,
+                successor_syllables, slots]
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+    sizes = _section_sizes(prefix_len, len(word_bytes), len(vocab),
+                           len(padded_prefixes), len(successors), n_slots)
+    offsets, _ = _section_offsets(sizes)
+
+    with open(file_name, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, prefix_len, len(vocab),
+                             len(padded_prefixes), len(successors), n_slots,
+                             int(indexed)))
+        for offset, section in zip(offsets, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            section.tofile(f)
+
+
+def load(file_name):
+    """Memory-map a compiled chain file.
+
+    Args:
+        file_name (string): a file written by save()
+
+    Returns:
+        A CompiledChain
+    Raises:
+        ValueError if the file isn't a compiled chain, or was written by an
+            incompatible version of this module.
+    """
+    with open(file_name, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    chain = CompiledChain(buf)
+    chain.file_name = file_name
+    return chain
+
+
+class _CompiledVocabulary:
+    """A read-only vocabulary backed by a compiled chain's word table."""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+        self._ids = None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __contains__(self, word):
+        return self.get_id(word) is not None
+
+    def word(self, word_id):
+        """Return the word with the given id."""
+        start = self._offsets[word_id]
+        end = self._offsets[word_id + 1]
+        return str(self._data[start:end], "utf-8")
+
+    def get_id(self, word):
+        """Return the id of a word, or None if it isn't in the vocabulary."""
+        if self._ids is None:
+            # only needed to look up seed text, so build it on first use
+            self._ids = {self.word(i): i for i in range(len(self))}
+        return self._ids.get(word)
+
+
+class CompiledChain(markov.BaseChain):
+    """A Markov chain read from a memory-mapped compiled chain file.
+
+    Every table is a view of the mapped file, so loading is nearly free
+    and pages of the file are shared between processes that load it.
+    Use load() to open one. Pickling a chain opened that way just records
+    the file name, and unpickling maps the file again.
+    """
+
+    file_name = None
+
+    def __reduce__(self):
+        if self.file_name is None:
+            raise TypeError("Can't pickle a CompiledChain that wasn't "
+                            "loaded from a file")
+        return (load, (self.file_name,))
+
+    def __init__(self, buf):
+        """Initialize from a buffer holding a compiled chain file."""
+        if len(buf) < _HEADER.size:
+            raise ValueError("Not a compiled chain file")
+        (magic, version, prefix_len, n_words, n_prefixes, n_entries,
+         n_slots, indexed) = _HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError("Not a compiled chain file")
+        if version != VERSION:
+            raise ValueError(
+                "Unsupported compiled chain version {}".format(version))
+        sizes = _section_sizes(prefix_len, 0, n_words, n_prefixes,
+                               n_entries, n_slots)
+        # the size of the word data is the last word offset
+        word_offsets = self._section(buf, _align(_HEADER.size), "I",
+                                     n_words + 1)
+        sizes[1] = ("B", word_offsets[-1])
+        offsets, end = _section_offsets(sizes)
+        if len(buf) < end:
+            raise ValueError("Compiled chain file is truncated")
+        (word_offsets, words, self._word_syllables, self._word_flags,
+         self._prefixes, self._table_offsets, self._successors,
+         self._cumulative, self._successor_syllables, self._slots) = [
+            self._section(buf, offset, typecode, length)
+            for offset, (typecode, length) in zip(offsets, sizes)]
+
+        self._buf = buf
+        self._prefix_len = prefix_len
+        self.syllables_indexed = bool(indexed)
+        self._vocab = _CompiledVocabulary(word_offsets, words)
+
+    @staticmethod
+    def _section(buf, offset, typecode, length):
+        size = array(typecode).itemsize * length
+        view = memoryview(buf)[offset:offset + size].cast(typecode)
+        if sys.byteorder != "little" and typecode != "B":
+            # can't use the mapped file directly, so copy and swap it
+            view = array(typecode, view)
+            view.byteswap()
+        return view
+
+    def _find(self, prefix):
+        """Return the index of a prefix, or None if it isn't in the chain."""
+        if markov.UNKNOWN_WORD in prefix:
+            return None
+        padded = _pad(prefix, self._prefix_len)
+        mask = len(self._slots) - 1
+        slot = _hash_prefix(padded) & mask
+        prefix_len = self._prefix_len
+        while True:
+            index = self._slots[slot]
+            if index == _NONE:
+                return None
+            start = index * prefix_len
+            if tuple(self._prefixes[start:start + prefix_len]) == padded:
+                return index
+            slot = (slot + 1) & mask
+
+    def index_syllables(self, syllables):
+        """Compiled chains are read-only, so their syllable index is the one
+        they were saved with, if any.
+
+        Raises:
+            ValueError, always
+        """
+        raise ValueError("A compiled chain's syllable index can't be "
+                         "changed; compile it again from the text instead")
+
+    def syllable_count(self, word_id):
+        """Return the number of syllables in a word, or None if unknown."""
+        count = self._word_syllables[word_id]
+        return None if count == markov.UNKNOWN_SYLLABLES else count
+
+    def ends_sentence(self, word_id):
+        """Return whether a word ends with sentence-final punctuation."""
+        return bool(self._word_flags[word_id] & markov.WORD_ENDS_SENTENCE)
+
+    def _sample_next(self, prefix, max_syllables=None):
+        index = self._find(prefix)
+        if index is None:
+            return None
+        lo = self._table_offsets[index]
+        hi = self._table_offsets[index + 1]
+        if max_syllables is not None:
+            if not self.syllables_indexed:
+                raise ValueError("The chain has no syllable index")
+            hi = bisect.bisect_right(self._successor_syllables,
+                                     max_syllables, lo, hi)
+            if hi == lo:
+                return None
+        cumulative = self._cumulative
+        base = cumulative[lo - 1] if lo else 0
+        target = base + random.randrange(cumulative[hi - 1] - base)
+        entry = bisect.bisect_right(cumulative, target, lo, hi)
+        return self._successors[entry]
+
+    def _counts(self, index):
+        """Return the {word id: count} dictionary for a prefix index."""
+        cumulative = self._cumulative
+        lo = self._table_offsets[index]
+        hi = self._table_offsets[index + 1]
+        counts = {}
+        previous = cumulative[lo - 1] if lo else 0
+        for entry in range(lo, hi):
+            counts[self._successors[entry]] = cumulative[entry] - previous
+            previous = cumulative[entry]
+        return counts
+
+    def _successor_items(self):
+        prefix_len = self._prefix_len
+        for index in range(len(self._table_offsets) - 1):
+            start = index * prefix_len
+            prefix = tuple(w for w in self._prefixes[start:start + prefix_len]
+                           if w != _NONE)
+            yield prefix, self._counts(index)
+
+    def successors(self, prefix):
+        """Return a {word id: count} dictionary of the successors of a
+        prefix (a tuple of word ids)."""
+        index = self._find(prefix)
+        if index is None:
+            return {}
+        return self._counts(index)
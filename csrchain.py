@@ -0,0 +1,386 @@
+"""Markov chains stored in flat NumPy arrays.
+
+A CSRChain holds a chain in compressed sparse row form, in a handful of
+arrays:
+
+    prefixes      (n_prefixes, prefix_len) word ids; the short prefixes at
+                  the starts of sentences are padded at the end
+    offsets       where each prefix's successors start, and where the last
+                  one's end
+    successors    the successor word ids, a row of them per prefix
+    cumulative    the running total of the successors' counts, across the
+                  whole chain
+    hashes        the prefixes' hashes, sorted, for finding a prefix with
+                  searchsorted
+    hash_order    the prefix each of the sorted hashes belongs to
+    word_offsets  where each word starts in word_bytes
+    word_bytes    every word of the vocabulary, UTF-8 encoded, joined
+    word_flags    each word's flags (see markov.word_flags)
+
+and with a syllable index, word_syllables and successor_syllables, with
+each prefix's successors sorted by syllable count (as in chainfile).
+
+That's about 12 bytes per distinct (prefix, successor) pair and 16 per
+prefix, instead of the hundred or so bytes of Python objects per prefix a
+MarkovChain takes. The chain is built straight from the word ids of the
+text, without building a MarkovChain first. save writes each array to a
+.npy file in a directory, and load memory-maps them back.
+
+This module needs NumPy, unlike the rest of the package.
+
+This module exports the CSRChain class, and the save and load functions.
+"""
+import json
+import os
+import random
+from array import array
+
+import numpy as np
+
+import chainfile
+import markov
+
+FORMAT = "haiku-csr"
+VERSION = 2
+
+_ARRAYS = ("prefixes", "offsets", "successors", "cumulative", "hashes",
+           "hash_order", "word_offsets", "word_bytes", "word_flags")
+_SYLLABLE_ARRAYS = ("word_syllables", "successor_syllables")
+
+
+class _TokenRecorder:
+    """Collects the word ids of a file and the starts of its sentences.
+
+    It stands in for a chain, with the methods _ChainBuilder and
+    _PunktBuilder add words through, so the sentences are found the same
+    way as for a MarkovChain.
+    """
+
+    def __init__(self, vocab, prefix_len):
+        self.vocab = vocab
+        self.prefix_len = prefix_len
+        self.tokens = array("I")
+        # (padded prefix, successor) rows for the sentence starts
+        self.starts = array("I")
+
+    def _add(self, prefix, word_id):
+        # the prefix is always the words before it in the file
+        self.tokens.append(word_id)
+
+    def _add_start(self, prefix, word_id):
+        self.starts.extend(chainfile._pad(prefix, self.prefix_len))
+        self.starts.append(word_id)
+
+    def _update_words(self, words, current_prefix=()):
+        self.tokens.extend(map(self.vocab.add, words))
+        return ()
+
+    def _add_chain_start(self, sentence):
+        ids = [self.vocab.add(word)
+               for word in sentence.split()[:self.prefix_len]]
+        for length, word_id in enumerate(ids):
+            self._add_start(tuple(ids[:length]), word_id)
+
+    def rows(self):
+        """Get a (prefix..., successor) row for each successor recorded."""
+        prefix_len = self.prefix_len
+        ids = np.frombuffer(self.tokens, dtype=np.uint32)
+        n = len(ids)
+        rows = np.full((n, prefix_len + 1), chainfile._NONE, dtype=np.uint32)
+        rows[:, prefix_len] = ids
+        for column in range(prefix_len):
+            rows[prefix_len:, column] = ids[column:n - prefix_len + column]
+        # the first words of the file have shorter prefixes
+        for i in range(min(prefix_len, n)):
+            rows[i, :i] = ids[:i]
+        starts = np.frombuffer(self.starts, dtype=np.uint32)
+        return np.concatenate([rows, starts.reshape(-1, prefix_len + 1)])
+
+
+def _hash_rows(prefixes):
+    """Hash each row of padded prefixes, as chainfile._hash_prefix does."""
+    hashes = np.full(len(prefixes), chainfile._FNV_OFFSET, dtype=np.uint64)
+    for column in prefixes.T:
+        hashes ^= column
+        hashes *= np.uint64(chainfile._FNV_PRIME)
+    return hashes
+
+
+class CSRChain(markov.BaseChain):
+    """A read-only Markov chain stored in NumPy arrays.
+
+    Build one with from_string or from_files, or load one saved with save.
+    Pickling a loaded chain just records its directory, and unpickling
+    memory-maps the files again.
+    """
+
+    directory = None
+
+    def __init__(self, prefix_len, arrays, indexed=False):
+        """Initialize from the arrays described in the module docstring.
+
+        Args:
+            prefix_len (int): the prefix length of the chain
+            arrays (dict): maps each array's name to the array
+            indexed (bool): whether arrays has the syllable arrays
+        """
+        self._prefix_len = prefix_len
+        self._arrays = arrays
+        self._prefixes = arrays["prefixes"]
+        self._offsets = arrays["offsets"]
+        self._successors = arrays["successors"]
+        self._cumulative = arrays["cumulative"]
+        self._hashes = arrays["hashes"]
+        self._hash_order = arrays["hash_order"]
+        self._vocab = chainfile._CompiledVocabulary(arrays["word_offsets"],
+                                                    arrays["word_bytes"])
+        self.syllables_indexed = indexed
+        if indexed:
+            self._word_syllables = arrays["word_syllables"]
+            self._successor_syllables = arrays["successor_syllables"]
+
+    def __reduce__(self):
+        if self.directory is None:
+            return (CSRChain, (self._prefix_len, self._arrays,
+                               self.syllables_indexed))
+        return (load, (self.directory,))
+
+    @property
+    def nbytes(self):
+        """The total size of the chain's arrays, in bytes."""
+        return sum(array.nbytes for array in self._arrays.values())
+
+    @classmethod
+    def from_string(cls, text, prefix_len=2, punkt=False):
+        """Build a chain from a string, as MarkovChain.from_string does.
+
+        Returns:
+            A CSRChain
+        """
+        vocab = markov.Vocabulary()
+        recorder = _TokenRecorder(vocab, prefix_len)
+        builder = (markov._PunktBuilder(recorder) if punkt else
+                   markov._ChainBuilder(recorder))
+        builder.feed(text.split())
+        builder.close()
+        return cls._from_rows(prefix_len, vocab, [recorder.rows()])
+
+    @classmethod
+    def from_files(cls, file_names, prefix_len, punkt=False):
+        """Build a chain from a list of files, as MarkovChain.from_files does.
+
+        Only the word ids of one file are held as Python objects at a time.
+
+        Returns:
+            A CSRChain
+        """
+        if prefix_len < 1:
+            raise ValueError('Prefix length must be at least one')
+        vocab = markov.Vocabulary()
+        builder_class = (markov._PunktBuilder if punkt else
+                         markov._ChainBuilder)
+        rows = []
+        for file_name in file_names:
+            recorder = _TokenRecorder(vocab, prefix_len)
+            with markov._open_text(file_name) as f:
+                builder = builder_class(recorder)
+                for words in markov._read_words(f):
+                    builder.feed(words)
+                builder.close()
+            rows.append(recorder.rows())
+        return cls._from_rows(prefix_len, vocab, rows)
+
+    @classmethod
+    def _from_rows(cls, prefix_len, vocab, rows):
+        """Count the (prefix, successor) rows, and build the arrays."""
+        rows = np.concatenate(rows)
+        # sort by the prefix, then the successor
+        rows = rows[np.lexsort(rows.T[::-1])]
+        new_pair = np.ones(len(rows), dtype=bool)
+        new_pair[1:] = np.any(rows[1:] != rows[:-1], axis=1)
+        pair_starts = np.flatnonzero(new_pair)
+        counts = np.diff(np.append(pair_starts, len(rows)))
+        pairs = rows[pair_starts]
+        del rows
+
+        new_prefix = np.ones(len(pairs), dtype=bool)
+        new_prefix[1:] = np.any(pairs[1:, :prefix_len] !=
+                                pairs[:-1, :prefix_len], axis=1)
+        prefix_starts = np.flatnonzero(new_prefix)
+        prefixes = np.ascontiguousarray(pairs[prefix_starts, :prefix_len])
+        hashes = _hash_rows(prefixes)
+        hash_order = np.argsort(hashes, kind="stable")
+
+        encoded = [word.encode("utf-8") for word in vocab._words]
+        word_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in encoded], out=word_offsets[1:])
+        word_bytes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        # the sentence-ending characters are ASCII, so they're whole bytes
+        last_bytes = word_bytes[np.maximum(word_offsets[1:] - 1, 0)]
+        ends = np.isin(last_bytes, np.frombuffer(
+            markov._SENTENCE_END.encode("ascii"), dtype=np.uint8))
+        ends &= word_offsets[1:] > word_offsets[:-1]
+        word_flags = np.where(ends, markov.WORD_ENDS_SENTENCE,
+                              0).astype(np.uint8)
+        arrays = {
+            "prefixes": prefixes,
+            "offsets": np.append(prefix_starts, len(pairs)).astype(np.int64),
+            "successors": np.ascontiguousarray(pairs[:, prefix_len]),
+            "cumulative": np.cumsum(counts, dtype=np.uint64),
+            "hashes": hashes[hash_order],
+            "hash_order": hash_order,
+            "word_offsets": word_offsets,
+            "word_bytes": word_bytes,
+            "word_flags": word_flags,
+        }
+        return cls(prefix_len, arrays)
+
+    def index_syllables(self, syllables):
+        """Sort each prefix's successors by their number of syllables.
+
+        Afterwards, next_word can be asked for a word with at most some
+        number of syllables, as for a MarkovChain.
+
+        Args:
+            syllables: a function that returns the number of syllables in
+                a word, or None if it isn't known.
+        """
+        word_syllables = np.empty(len(self._vocab), dtype=np.uint8)
+        for word_id in range(len(word_syllables)):
+            count = syllables(self._vocab.word(word_id))
+            if count is None or count >= markov.UNKNOWN_SYLLABLES:
+                count = markov.UNKNOWN_SYLLABLES
+            word_syllables[word_id] = count
+        offsets = self._offsets
+        successor_syllables = word_syllables[self._successors]
+        rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        order = np.lexsort((successor_syllables, rows))
+        counts = np.diff(self._cumulative, prepend=np.uint64(0))
+
+        arrays = dict(self._arrays)
+        arrays["successors"] = self._successors[order]
+        arrays["cumulative"] = np.cumsum(counts[order], dtype=np.uint64)
+        arrays["word_syllables"] = word_syllables
+        arrays["successor_syllables"] = successor_syllables[order]
+        version = self.version
+        self.__init__(self._prefix_len, arrays, indexed=True)
+        self.directory = None
+        # the syllable counts may have changed
+        self.version = version + 1
+
+    def syllable_count(self, word_id):
+        """Return the number of syllables in a word, or None if unknown."""
+        if not self.syllables_indexed:
+            return None
+        count = int(self._word_syllables[word_id])
+        return None if count == markov.UNKNOWN_SYLLABLES else count
+
+    def ends_sentence(self, word_id):
+        """Return whether a word ends with sentence-final punctuation."""
+        return bool(self._arrays["word_flags"][word_id] &
+                    markov.WORD_ENDS_SENTENCE)
+
+    def _find(self, prefix):
+        """Return the index of a prefix, or None if it isn't in the chain."""
+        if markov.UNKNOWN_WORD in prefix:
+            return None
+        padded = chainfile._pad(prefix, self._prefix_len)
+        target = chainfile._hash_prefix(padded)
+        hashes = self._hashes
+        position = int(np.searchsorted(hashes, np.uint64(target)))
+        while position < len(hashes) and hashes[position] == target:
+            index = int(self._hash_order[position])
+            if tuple(self._prefixes[index].tolist()) == padded:
+                return index
+            position += 1
+        return None
+
+    def _sample_next(self, prefix, max_syllables=None):
+        index = self._find(prefix)
+        if index is None:
+            return None
+        lo = int(self._offsets[index])
+        hi = int(self._offsets[index + 1])
+        if max_syllables is not None:
+            if not self.syllables_indexed:
+                raise ValueError("The chain has no syllable index")
+            # words with unknown syllable counts are never chosen
+            max_syllables = min(max_syllables,
+                                markov.UNKNOWN_SYLLABLES - 1)
+            hi = lo + int(np.searchsorted(self._successor_syllables[lo:hi],
+                                          max_syllables, side="right"))
+            if hi == lo:
+                return None
+        cumulative = self._cumulative
+        base = int(cumulative[lo - 1]) if lo else 0
+        target = base + random.randrange(int(cumulative[hi - 1]) - base)
+        entry = lo + int(np.searchsorted(cumulative[lo:hi], target,
+                                         side="right"))
+        return int(self._successors[entry])
+
+    def _counts(self, index):
+        """Return the {word id: count} dictionary for a prefix index."""
+        lo = int(self._offsets[index])
+        hi = int(self._offsets[index + 1])
+        cumulative = self._cumulative[max(lo - 1, 0):hi].tolist()
+        if lo == 0:
+            cumulative.insert(0, 0)
+        counts = np.diff(cumulative).tolist()
+        return dict(zip(self._successors[lo:hi].tolist(), counts))
+
+    def _successor_items(self):
+        for index, prefix in enumerate(self._prefixes.tolist()):
+            yield (tuple(w for w in prefix if w != chainfile._NONE),
+                   self._counts(index))
+
+    def successors(self, prefix):
+        """Return a {word id: count} dictionary of the successors of a
+        prefix (a tuple of word ids)."""
+        index = self._find(prefix)
+        if index is None:
+            return {}
+        return self._counts(index)
+
+
+def save(chain, directory):
+    """Save a CSRChain's arrays as .npy files in a directory.
+
+    Args:
+        chain (CSRChain): the chain to save
+        directory (string): where to save it; created if necessary
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, values in chain._arrays.items():
+        np.save(os.path.join(directory, name + ".npy"), values)
+    with open(os.path.join(directory, "chain.json"), "w") as f:
+        json.dump({"format": FORMAT, "version": VERSION,
+                   "prefix_len": chain.prefix_len,
+                   "syllables_indexed": chain.syllables_indexed}, f)
+
+
+def load(directory):
+    """Memory-map a chain saved with save.
+
+    Returns:
+        A CSRChain
+    Raises:
+        ValueError if the directory doesn't hold a chain saved by a
+            compatible version of this module
+    """
+    try:
+        with open(os.path.join(directory, "chain.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise ValueError("Not a CSR chain directory: " + directory)
+    if meta.get("format") != FORMAT:
+        raise ValueError("Not a CSR chain directory: " + directory)
+    if meta.get("version") != VERSION:
+        raise ValueError("Unsupported CSR chain version {}".format(
+            meta.get("version")))
+    names = _ARRAYS + (_SYLLABLE_ARRAYS if meta["syllables_indexed"] else ())
+    arrays = {name: np.load(os.path.join(directory, name + ".npy"),
+                            mmap_mode="r")
+              for name in names}
+    chain = CSRChain(meta["prefix_len"], arrays, meta["syllables_indexed"])
+    chain.directory = directory
+    return chain
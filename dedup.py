@@ -0,0 +1,113 @@
+"""Remembering which haiku have been generated, in a fixed amount of memory.
+
+Generating millions of haiku from a small or repetitive text gives the same
+ones over and over. Keeping every haiku to spot the repeats would take
+memory in proportion to the output; a Bloom filter takes a fixed amount, at
+the cost of a small chance of taking a new haiku for a repeat (never the
+other way around).
+
+Each haiku is hashed a line at a time, so the lines don't need joining
+into one string first.
+
+This module exports the BloomFilter class.
+"""
+import hashlib
+import math
+
+_MASK = (1 << 64) - 1
+
+
+class BloomFilter:
+    """A Bloom filter of haiku, or other sequences of lines.
+
+    The filter has a fixed size. The number of hash functions is chosen for
+    the false positive rate asked for, which holds until capacity haiku
+    have been added; after that, the rate goes up as the filter fills.
+
+    Attributes:
+        capacity (int): how many haiku can be added before the false
+            positive rate gets worse than error_rate
+        error_rate (float): the false positive rate asked for
+        count (int): how many haiku have been added (not counting repeats)
+    """
+
+    def __init__(self, max_bytes=16 << 20, error_rate=1e-6):
+        """Initialize an empty filter.
+
+        Args:
+            max_bytes (int): the size of the filter, in bytes
+            error_rate (float): the chance of taking a new haiku for a
+                repeat, up to the filter's capacity
+        Raises:
+            ValueError if max_bytes isn't positive, or error_rate isn't
+                between 0 and 1
+        """
+        if max_bytes < 1:
+            raise ValueError("A Bloom filter needs at least one byte")
+        if not 0 < error_rate < 1:
+            raise ValueError("The error rate must be between 0 and 1")
+        self.error_rate = error_rate
+        self._bits = bytearray(max_bytes)
+        self._size = max_bytes * 8
+        self._hashes = max(1, round(-math.log2(error_rate)))
+        self.capacity = int(self._size * math.log(2) ** 2 /
+                            -math.log(error_rate))
+        self.count = 0
+        self._set_bits = 0
+
+    @property
+    def nbytes(self):
+        """The size of the filter, in bytes."""
+        return len(self._bits)
+
+    def estimated_error_rate(self):
+        """Estimate the chance that a new haiku would be taken for a repeat
+        now, from how many of the filter's bits are set."""
+        return (self._set_bits / self._size) ** self._hashes
+
+    def _positions(self, lines):
+        """The byte indexes and bit masks of the bits a sequence of lines
+        maps to."""
+        digest = hashlib.blake2b(digest_size=16)
+        for line in lines:
+            digest.update(line.encode("utf-8"))
+            # so that moving a word to the next line makes a different haiku
+            digest.update(b"\n")
+        value = int.from_bytes(digest.digest(), "little")
+        size = self._size
+        # the positions would cycle back early if the step had a factor in
+        # common with the size, so move it on to one that doesn't (the size
+        # is a multiple of 8, so only odd steps can do)
+        step = (value >> 64) % size | 1
+        while math.gcd(step, size) != 1:
+            step += 2
+        first = value & _MASK
+        positions = [(first + i * step) % size for i in range(self._hashes)]
+        return [(position >> 3, 1 << (position & 7))
+                for position in positions]
+
+    def add(self, lines):
+        """Add a haiku to the filter.
+
+        Args:
+            lines (iterable of strings): the haiku's lines
+        Returns:
+            Whether the haiku was (probably) added before
+        """
+        bits = self._bits
+        new_bits = 0
+        for index, mask in self._positions(lines):
+            if not bits[index] & mask:
+                bits[index] |= mask
+                new_bits += 1
+        if not new_bits:
+            return True
+        self._set_bits += new_bits
+        self.count += 1
+        return False
+
+    def __contains__(self, lines):
+        """Check whether a haiku was (probably) added, without adding it."""
+        bits = self._bits
+        return all(bits[index] & mask
+                   for index, mask in self._positions(lines))
@@ -0,0 +1,157 @@
+"""Feasibility of completing a haiku from a point in a Markov chain.
+
+Generating a haiku word by word can reach a dead end: a prefix with no
+successor short enough for the rest of the line, or a last line that can't
+end on a sentence-final word. This module works out which positions can
+still be completed, so generation can steer around dead ends instead of
+restarting.
+
+A position is a prefix together with the number of syllables left in the
+whole poem. The line structure fixes which line that falls in, and how many
+syllables are left in it. A word fits if it's in the pronouncing dictionary
+and doesn't run past the end of the current line. The last word of the
+poem must end with sentence-final punctuation, unless the table is for
+part of a poem.
+
+This module exports the FeasibilityTable class.
+"""
+import bisect
+import random
+
+# Rejection sampling attempts before sample() falls back to listing every
+# successor that can finish
+_SAMPLE_TRIES = 8
+
+
+class FeasibilityTable:
+    """Which positions in a chain can be completed into a haiku.
+
+    The table is filled in lazily, and remembers every answer it works out,
+    so each position is only ever explored once. Exploring a position stops
+    at the first successor that can finish, and every step uses up at least
+    one syllable (except for the rare zero-syllable words), so answering a
+    question only ever looks a few words ahead.
+
+    The chain must have a syllable index.
+    """
+
+    def __init__(self, chain, line_syllables, end_sentence=True):
+        """Initialize the table.
+
+        Args:
+            chain (markov.BaseChain): the chain to generate from
+            line_syllables (sequence of ints): syllables in each line
+            end_sentence (bool): whether the last word must end a sentence
+        """
+        if not chain.syllables_indexed:
+            raise ValueError("The chain has no syllable index")
+        self._chain = chain
+        self._end_sentence = end_sentence
+        self._prefix_len = chain.prefix_len
+        self.total_syllables = sum(line_syllables)
+        # the number of syllables left in the poem at the end of each line
+        self._line_ends = []
+        remaining = self.total_syllables
+        for syllables in line_syllables:
+            remaining -= syllables
+            self._line_ends.append(remaining)
+        self._line_ends.reverse()
+        # answers so far: prefix -> bit masks over syllables left
+        self._known = {}
+        self._feasible = {}
+        self._in_progress = set()
+        self._loops_found = 0
+        # how many sampled words sample() had to reject, and how many times
+        # it gave up sampling and listed the successors instead
+        self.rejections = 0
+        self.fallbacks = 0
+
+    def line_remaining(self, remaining):
+        """Return how many of the poem's remaining syllables are in the
+        current line."""
+        index = bisect.bisect_left(self._line_ends, remaining) - 1
+        return remaining - self._line_ends[index]
+
+    def _leads_to_finish(self, prefix, word_id, remaining):
+        """Check whether word_id fits after prefix, and the poem can still be
+        finished after it."""
+        syllables = self._chain.syllable_count(word_id)
+        if syllables is None or syllables > self.line_remaining(remaining):
+            return False
+        if syllables == remaining:
+            return (not self._end_sentence or
+                    self._chain.ends_sentence(word_id))
+        next_prefix = (prefix + (word_id,))[-self._prefix_len:]
+        return self.can_finish(next_prefix, remaining - syllables)
+
+    def can_finish(self, prefix, remaining):
+        """Check whether a haiku can be finished from a position.
+
+        Args:
+            prefix (tuple of ints): the chain's current prefix
+            remaining (int): the number of syllables left in the poem
+
+        Returns:
+            True if some sequence of successors completes the poem.
+        """
+        bit = 1 << remaining
+        if self._known.get(prefix, 0) & bit:
+            return bool(self._feasible[prefix] & bit)
+        key = (prefix, remaining)
+        if key in self._in_progress:
+            # only reachable through zero-syllable words; a completion
+            # from here would be found without going round the loop
+            self._loops_found += 1
+            return False
+        loops_found = self._loops_found
+        self._in_progress.add(key)
+        try:
+            result = any(self._leads_to_finish(prefix, word_id, remaining)
+                         for word_id in self._chain.successors(prefix))
+        finally:
+            self._in_progress.remove(key)
+        # a negative answer that went round a loop depends on a position
+        # that was still being explored, so it isn't final
+        if result or loops_found == self._loops_found:
+            self._known[prefix] = self._known.get(prefix, 0) | bit
+            if result:
+                self._feasible[prefix] = self._feasible.get(prefix, 0) | bit
+            else:
+                self._feasible.setdefault(prefix, 0)
+        return result
+
+    def sample(self, prefix, remaining):
+        """Pick a random successor that can still lead to a finished haiku.
+
+        The word is chosen with the chain's probabilities, restricted to the
+        successors that fit and can finish.
+
+        Args:
+            prefix (tuple of ints): the chain's current prefix
+            remaining (int): the number of syllables left in the poem
+
+        Returns:
+            A word id, or None if the poem can't be finished from here.
+        """
+        max_syllables = self.line_remaining(remaining)
+        for _ in range(_SAMPLE_TRIES):
+            word_id = self._chain._sample_next(prefix, max_syllables)
+            if word_id is None:
+                return None
+            if self._leads_to_finish(prefix, word_id, remaining):
+                return word_id
+            self.rejections += 1
+        # most of the eligible successors are dead ends, so pick from the
+        # ones that aren't directly
+        self.fallbacks += 1
+        candidates = [(word_id, count) for word_id, count
+                      in self._chain.successors(prefix).items()
+                      if self._leads_to_finish(prefix, word_id, remaining)]
+        if not candidates:
+            return None
+        target = random.randrange(sum(count for _, count in candidates))
+        for word_id, count in candidates:
+            target -= count
+            if target < 0:
+                return word_id
+
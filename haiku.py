@@ -3,58 +3,209 @@
 
 Build a Markov chain using the specified input files and prefix length,
 and generate a haiku using that Markov chain.
+The chain can also be compiled to a file once (--compile), and loaded
+from there (--model) to skip rebuilding it on every run.
+With -n, generate many haiku at once (across -j worker processes),
+written out as newline-delimited JSON.
+"haiku.py serve" runs an HTTP server that keeps chains in memory; see the
+server module.
 """
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import weakref
+
+import chainfile
+import feasibility
 import markov
 import util
 
+# Syllables in each line of a haiku
+LINE_SYLLABLES = (5, 7, 5)
+
+# (chain version, FeasibilityTable) pairs for the chains generate_haiku has
+# been used with
+_feasibility_tables = weakref.WeakKeyDictionary()
+
+
+class GenerationStats:
+    """Counters describing the work generate_haiku does.
+
+    Pass one to generate_haiku or generate_many to have it updated. Without
+    one, generation skips the bookkeeping entirely.
+
+    Attributes:
+        haiku (int): haiku generated
+        failures (int): calls that raised ValueError, because the chain
+            can't make a haiku
+        words (int): words in the generated haiku
+        rejections (int): words drawn and then rejected because no haiku
+            could be finished after them. Words that aren't in the
+            pronouncing dictionary or have too many syllables are never
+            drawn: the chain's syllable index leaves them out.
+        fallbacks (int): times drawing gave up, and the successors that can
+            finish were listed instead
+        checked (int): haiku checked for repeats by drop_duplicates
+        duplicates (int): haiku drop_duplicates dropped as repeats
+        stage_seconds (dict): time spent in each of STAGES, in seconds
+        slowest_seconds (float): the longest one haiku took
+    """
+
+    STAGES = ("setup", "line 1", "line 2", "line 3", "punctuation")
+
+    def __init__(self):
+        self.haiku = 0
+        self.failures = 0
+        self.words = 0
+        self.rejections = 0
+        self.fallbacks = 0
+        self.checked = 0
+        self.duplicates = 0
+        self.stage_seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.slowest_seconds = 0.0
+
+    def merge(self, other):
+        """Add the counts from another GenerationStats to this one."""
+        self.haiku += other.haiku
+        self.failures += other.failures
+        self.words += other.words
+        self.rejections += other.rejections
+        self.fallbacks += other.fallbacks
+        self.checked += other.checked
+        self.duplicates += other.duplicates
+        for stage, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage] += seconds
+        self.slowest_seconds = max(self.slowest_seconds, other.slowest_seconds)
+
+    def as_dict(self):
+        """Get the counters as a JSON-serializable dictionary."""
+        return {"haiku": self.haiku, "failures": self.failures,
+                "words": self.words, "rejections": self.rejections,
+                "fallbacks": self.fallbacks, "checked": self.checked,
+                "duplicates": self.duplicates,
+                "stage_seconds": dict(self.stage_seconds),
+                "slowest_seconds": self.slowest_seconds}
+
+    def format(self):
+        """Describe the counters, for people to read."""
+        haiku = max(self.haiku, 1)
+        total = sum(self.stage_seconds.values())
+        lines = ["haiku: {} ({} failed)".format(self.haiku, self.failures),
+                 "words per haiku: {:.2f}".format(self.words / haiku),
+                 "rejections per haiku: {:.2f}".format(
+                     self.rejections / haiku),
+                 "fallbacks per haiku: {:.2f}".format(self.fallbacks / haiku)]
+        if self.checked:
+            lines.append("duplicates: {} (unique yield {:.1%})".format(
+                self.duplicates, 1 - self.duplicates / self.checked))
+        if not total:
+            # generate_batch doesn't time the haiku
+            return "\n".join(lines)
+        lines.append("mean time: {:.3f} ms, slowest: {:.3f} ms".format(
+            total / haiku * 1000, self.slowest_seconds * 1000))
+        for stage in self.STAGES:
+            lines.append("  {}: {:.3f} ms".format(
+                stage, self.stage_seconds[stage] / haiku * 1000))
+        return "\n".join(lines)
+
+    def _start(self, table):
+        """Start timing a haiku generated with a FeasibilityTable."""
+        self._table_counts = table.rejections, table.fallbacks
+        self._started = self._lap_started = time.perf_counter()
+
+    def _lap(self, stage):
+        """Record the time since the last stage ended against stage."""
+        now = time.perf_counter()
+        self.stage_seconds[stage] += now - self._lap_started
+        self._lap_started = now
 
-def get_next_word(chain, seed_text, remaining_syllables):
+    def _finish(self, table, words):
+        """Record a finished haiku, after the punctuation stage."""
+        self._lap("punctuation")
+        rejections, fallbacks = self._table_counts
+        self.rejections += table.rejections - rejections
+        self.fallbacks += table.fallbacks - fallbacks
+        self.haiku += 1
+        self.words += words
+        self.slowest_seconds = max(self.slowest_seconds,
+                                   self._lap_started - self._started)
+
+
+def get_next_word(chain, state, remaining_syllables):
     """Generate a word with fewer than the specified number of syllables.
 
+    The word is drawn directly from the successors that are in the CMU
+    dictionary and short enough, using the chain's syllable index (which is
+    built here if the chain doesn't have one yet).
+
     Args:
         chain (MarkovChain): Markov chain to use to generate the next word.
-        seed_text (string): The text that's been generated so far.
+        state (GenerationState): The chain's state after the text that's
+            been generated so far. It's advanced past the new word.
         remaining_syllables (int): Maximum number of syllables allowed.
     Returns:
         The generated word (string).
     Raises:
-        RuntimeError, if it fails to generate an acceptable word after
-            100 tries. This error will be caught in generate_haiku().
+        RuntimeError, if no word that can follow the text so far is valid.
     """
-    # try to get a valid word 100 times
-    for i in range(100):
-        word = chain.next_word(seed_text)
-        if (util.in_dict(word) and
-            util.get_syllable_count(word) <= remaining_syllables):
-            # This word is valid
-            return word
-    else:
-        # After 100 attempts, give up
+    if not chain.syllables_indexed:
+        chain.index_syllables(util.lookup_syllables)
+    word_id = state.sample(max_syllables=remaining_syllables)
+    if word_id is None:
         raise RuntimeError("Couldn't find a valid word")
+    state.advance(word_id)
+    return chain.vocab.word(word_id)
 
 
-def generate_line(chain, syllable_count, previous_text=""):
+def _generate_line(chain, syllable_count, state, end_sentence):
+    """Generate a line, steering around dead ends with a FeasibilityTable
+    for the line alone.
+
+    Raises:
+        RuntimeError if no line can follow the text so far. The state is
+            only advanced if one can.
+    """
+    if not chain.syllables_indexed:
+        chain.index_syllables(util.lookup_syllables)
+    table = feasibility.FeasibilityTable(chain, (syllable_count,),
+                                         end_sentence)
+    remaining = syllable_count
+    line = []
+    while remaining > 0:
+        # every word drawn after the first can finish the line
+        word_id = table.sample(state.prefix, remaining)
+        if word_id is None:
+            raise RuntimeError("Couldn't find a valid line")
+        state.advance(word_id)
+        line.append(chain.vocab.word(word_id))
+        remaining -= chain.syllable_count(word_id)
+    return " ".join(line)
+
+
+def generate_line(chain, syllable_count, state=None):
     """Generate a line with the specified number of syllables.
 
     Args:
         chain (MarkovChain): Markov chain to use to generate line
         syllable_count (int): How many syllables the line should have.
-        previous_text (string): The text that's been generated so far.
+        state (GenerationState): The chain's state after the text that's
+            been generated so far; it's advanced to the end of the line.
+            By default, start a new text.
     Returns:
         The generated line (string)
+    Raises:
+        RuntimeError if no line of that many syllables can follow the text
+            so far.
     """
-    remaining_syllables = syllable_count
-    seed_text = previous_text
-    line = []
-    while remaining_syllables > 0:
-        next_word = get_next_word(chain, seed_text, remaining_syllables)
-        seed_text += " " + next_word
-        line.append(next_word)
-        remaining_syllables -= util.get_syllable_count(next_word)
-    return " ".join(line)
+    if state is None:
+        state = chain.start()
+    return _generate_line(chain, syllable_count, state, end_sentence=False)
 
 
-def generate_end_line(chain, syllable_count, previous_text):
+def generate_end_line(chain, syllable_count, state):
     """Generate the last line of the haiku.
 
     This line must end with punctuation (.?!) to prevents awkward endings
@@ -63,63 +214,488 @@ def generate_end_line(chain, syllable_count, previous_text):
     Args
         chain (MarkovChain): Markov chain to use to generate line
         syllable_count (int): How many syllables the line should have.
-        previous_text (string): The text that's been generated so far.
+        state (GenerationState): The chain's state after the text that's
+            been generated so far; it's advanced to the end of the line.
     Returns:
         The generated line (string)
     Raises:
-        RuntimeError if the generated line doesn't end with punctuation.
-            This error will be caught in generate_haiku()
+        RuntimeError if no line ending with punctuation can follow the text
+            so far.
     """
-    # Try 100 times to generate a line with end punctuation
-    for i in range(100):
-        three = generate_line(chain, 5, previous_text)
-        if three[-1] in ".!?":
-            # last line ends with punctuation, so use it
-            return three
-    else:
-        raise RuntimeError("Doesn't end with punctuation!")
+    return _generate_line(chain, syllable_count, state, end_sentence=True)
 
 
 def generate_haiku_attempt(chain):
-    """Try to generate a haiku.
+    """Try to generate a haiku, a line at a time.
 
-    Let any RuntimeErrors propagate up to generate_haiku()
+    Each line is sure to be finished once started, but an early line can
+    still lead to a later one that can't be; generate_haiku looks ahead
+    over the whole poem instead.
 
     Args:
         chain (MarkovChain): Markov chain to use to generate line
     Returns:
         The generated haiku (string).
+    Raises:
+        RuntimeError if a line couldn't be generated.
     """
-    one = generate_line(chain, 5)
-    two = generate_line(chain, 7, one)
-    three = generate_end_line(chain, 5, " ".join([one, two]))
+    state = chain.start()
+    one = generate_line(chain, 5, state)
+    two = generate_line(chain, 7, state)
+    three = generate_end_line(chain, 5, state)
     return "\n".join([one, two, three])
 
 
-def generate_haiku(chain):
+def _feasibility_table(chain):
+    """Get the FeasibilityTable for a chain, creating it the first time,
+    and again whenever the chain changes."""
+    version, table = _feasibility_tables.get(chain, (None, None))
+    if version != chain.version:
+        if not chain.syllables_indexed:
+            chain.index_syllables(util.lookup_syllables)
+        table = feasibility.FeasibilityTable(chain, LINE_SYLLABLES)
+        _feasibility_tables[chain] = chain.version, table
+    return table
+
+
+def generate_haiku(chain, stats=None, clean=True):
     """Generate a haiku, and fix any mismatched punctuation in the result.
 
-    If it fails to generate a haiku, try again...and keep trying forever.
+    Each word is chosen from the successors that can still lead to a
+    complete haiku (with the last line ending in .!?), so generation never
+    hits a dead end and never has to start over.
 
     Args:
         chain (MarkovChain): Markov chain to use to generate line
+        stats (GenerationStats): optional counters to update
+        clean (bool): whether to fix the punctuation. Without, the caller
+            has to, with util.strip_punctuation.
     Returns:
         The generated haiku (string).
+    Raises:
+        ValueError if no haiku can be generated from this chain.
     """
-    while True:
-        # NOTE: if a valid haiku can't be generated from this text,
-        # this will loop forever!
-        try:
-            haiku = generate_haiku_attempt(chain)
-            break
-        except RuntimeError:
-            continue
-    cleaned_haiku = util.strip_punctuation(haiku)
-    return cleaned_haiku
+    table = _feasibility_table(chain)
+    if stats is not None:
+        stats._start(table)
+    state = chain.start()
+    remaining = table.total_syllables
+    if not table.can_finish(state.prefix, remaining):
+        if stats is not None:
+            stats.failures += 1
+        raise ValueError("Can't generate a haiku from this text")
+    if stats is not None:
+        stats._lap("setup")
+    lines = []
+    words = 0
+    for number, syllable_count in enumerate(LINE_SYLLABLES, 1):
+        line_end = remaining - syllable_count
+        line = []
+        while remaining > line_end:
+            word_id = table.sample(state.prefix, remaining)
+            state.advance(word_id)
+            line.append(chain.vocab.word(word_id))
+            remaining -= chain.syllable_count(word_id)
+        lines.append(" ".join(line))
+        words += len(line)
+        if stats is not None:
+            stats._lap("line {}".format(number))
+    haiku = "\n".join(lines)
+    if clean:
+        haiku = util.strip_punctuation(haiku)
+    if stats is not None:
+        stats._finish(table, words)
+    return haiku
+
+
+# The chain used by generate_many's worker processes
+_worker_chain = None
+
+
+def _init_worker(chain):
+    global _worker_chain
+    _worker_chain = chain
+
+
+def _generate_range(seed, start, stop, stats=None, clean=True):
+    """Generate the haiku numbered start to stop - 1 with the worker chain.
+
+    Each haiku gets its own random seed, derived from the run's seed and its
+    number, so the results don't depend on how the work is split up.
+
+    Returns:
+        A list of (index, haiku) pairs, and the GenerationStats passed in
+    """
+    haiku = []
+    for index in range(start, stop):
+        random.seed("{}:{}".format(seed, index))
+        haiku.append((index, generate_haiku(_worker_chain, stats, clean)))
+    return haiku, stats
+
+
+def _generate_chunk(args):
+    return _generate_range(*args)
+
+
+def generate_many(chain, count, jobs=1, seed=None, chunk_size=64,
+                  stats=None, start=0, seen=None):
+    """Generate many haiku, spread across worker processes.
+
+    The results are reproducible: the same seed always gives the same
+    haiku, whatever the number of jobs.
+
+    Args:
+        chain (MarkovChain): Markov chain to use to generate the haiku.
+            Worker processes get a copy of it; a compiled chain is
+            memory-mapped again in each worker instead.
+        count (int): How many haiku to generate.
+        jobs (int): How many worker processes to use. With 1, the haiku
+            are generated in this process.
+        seed (int): Optional random seed.
+        chunk_size (int): How many haiku to hand to a worker at a time.
+        stats (GenerationStats): Optional counters to update, with the
+            work done in every process.
+        start (int): The number of the first haiku, to carry on from an
+            earlier call with the same seed.
+        seen (dedup.BloomFilter): Optional filter of the haiku generated
+            before, to leave out; see drop_duplicates.
+    Yields:
+        (index, haiku) pairs, in order of index.
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    # build the syllable index once, instead of once per worker
+    if not chain.syllables_indexed:
+        chain.index_syllables(util.lookup_syllables)
+    # repeats are checked before their punctuation is fixed, which is then
+    # only done for the new ones
+    clean = seen is None
+    stop = start + count
+    starts = range(start, stop, chunk_size)
+    if jobs == 1:
+        _init_worker(chain)
+        results = itertools.chain.from_iterable(
+            _generate_range(seed, first, min(first + chunk_size, stop),
+                            stats, clean)[0]
+            for first in starts)
+    else:
+        results = _generate_in_pool(chain, jobs, stats, [
+            (seed, first, min(first + chunk_size, stop),
+             GenerationStats() if stats is not None else None, clean)
+            for first in starts])
+    if seen is not None:
+        results = drop_duplicates(results, seen, stats, clean=True)
+    yield from results
 
 
-if __name__ == '__main__':
+def _generate_in_pool(chain, jobs, stats, chunks):
+    """Generate chunks of haiku in a pool of worker processes.
+
+    Each chunk counts its work separately, to be added up here.
+    """
+    import multiprocessing
+    with multiprocessing.Pool(jobs, initializer=_init_worker,
+                              initargs=(chain,)) as pool:
+        for haiku, chunk_stats in pool.imap(_generate_chunk, chunks):
+            if stats is not None:
+                stats.merge(chunk_stats)
+            yield from haiku
+
+
+def drop_duplicates(results, seen, stats=None, clean=False):
+    """Leave out the haiku that were generated before.
+
+    Args:
+        results (iterable): (index, haiku) pairs, from generate_many or
+            generate_batch
+        seen (dedup.BloomFilter): the haiku generated before. Each new
+            haiku is added to it.
+        stats (GenerationStats): optional counters to update
+        clean (bool): whether the haiku still need their punctuation fixed,
+            which is then done for the new ones only
+    Yields:
+        The (index, haiku) pairs with haiku that weren't in seen. The
+        indexes are left as they were, so the ones dropped are missing.
+    """
+    for index, text in results:
+        duplicate = seen.add(text.split("\n"))
+        if stats is not None:
+            stats.checked += 1
+            stats.duplicates += duplicate
+        if not duplicate:
+            yield index, util.strip_punctuation(text) if clean else text
+
+
+def generate_unique(generate, chain, count, seen, **kwargs):
+    """Generate haiku until count new ones have been made.
+
+    The haiku are generated count at a time, less the new ones so far, to
+    make up for the repeats left out. A chain might not have count
+    different haiku in it at all, so this stops early after a round that
+    makes nothing new.
+
+    Args:
+        generate: generate_many or generate_batch
+        chain: the chain to generate from
+        count (int): how many new haiku to generate
+        seen (dedup.BloomFilter): the haiku generated before. Each new
+            haiku is added to it.
+        kwargs: other arguments to generate
+    Yields:
+        (index, haiku) pairs for up to count new haiku. The indexes count
+        the repeats too, so they can go past count.
+    """
+    start = made = 0
+    while made < count:
+        wanted = count - made
+        new = 0
+        for result in generate(chain, wanted, start=start, seen=seen,
+                               **kwargs):
+            new += 1
+            yield result
+        if not new:
+            return
+        made += new
+        start += wanted
+
+
+# The BatchSampler used by generate_batch's worker processes
+_worker_sampler = None
+
+
+def _init_batch_worker(chain, batch_size):
+    global _worker_sampler
+    import batch
+    _worker_sampler = batch.BatchSampler(chain, LINE_SYLLABLES, batch_size)
+
+
+def _generate_batch_chunk(args):
+    """Generate a chunk of haiku with the worker's BatchSampler.
+
+    Returns:
+        A list of haiku, and the GenerationStats passed in
+    """
+    import numpy as np
+    seed, first, count, stats, clean = args
+    # seeds for SeedSequence can't be negative
+    rng = np.random.default_rng([first, seed & 0xFFFFFFFFFFFFFFFF])
+    haiku = list(_worker_sampler.generate(count, rng, stats, clean))
+    # the haiku with the fewest words finish first
+    rng.shuffle(haiku)
+    return haiku, stats
+
+
+def generate_batch(chain, count, jobs=1, seed=None, batch_size=4096,
+                   chunk_size=65536, stats=None, start=0, seen=None):
+    """Generate many haiku with the vectorized batch sampler.
+
+    This is much faster than generate_many, but needs a csrchain.CSRChain
+    and NumPy. The haiku differ from generate_many's for the same seed,
+    but they're reproducible in the same way: the same seed always gives
+    the same haiku, whatever the number of jobs.
+
+    Args:
+        chain (csrchain.CSRChain): Markov chain to use to generate the haiku.
+        count (int): How many haiku to generate.
+        jobs (int): How many worker processes to use. With 1, the haiku
+            are generated in this process.
+        seed (int): Optional random seed.
+        batch_size (int): How many haiku each process generates at once.
+        chunk_size (int): How many haiku to hand to a worker at a time.
+        stats (GenerationStats): Optional counters to update. Only the
+            counts are updated, not the timings.
+        start (int): The number of the first haiku, to carry on from an
+            earlier call with the same seed.
+        seen (dedup.BloomFilter): Optional filter of the haiku generated
+            before, to leave out; see drop_duplicates.
+    Yields:
+        (index, haiku) pairs, in order of index.
+    Raises:
+        ValueError if the chain isn't a CSRChain, or no haiku can be
+            generated from it.
+    """
+    import csrchain
+    if not isinstance(chain, csrchain.CSRChain):
+        raise ValueError("The batch sampler needs a CSR chain")
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    if not chain.syllables_indexed:
+        chain.index_syllables(util.lookup_syllables)
+    # each chunk's random numbers are seeded with its first haiku's number
+    stop = start + count
+    clean = seen is None
+    chunks = [(seed, first, min(chunk_size, stop - first),
+               GenerationStats() if stats is not None else None, clean)
+              for first in range(start, stop, chunk_size)]
+    # this also finds out whether the chain can make a haiku at all
+    _init_batch_worker(chain, batch_size)
+    if jobs == 1:
+        results = _number_chunks(map(_generate_batch_chunk, chunks), stats,
+                                 start)
+    else:
+        results = _generate_batch_in_pool(chain, jobs, batch_size, stats,
+                                          chunks, start)
+    if seen is not None:
+        results = drop_duplicates(results, seen, stats, clean=True)
+    yield from results
+
+
+def _generate_batch_in_pool(chain, jobs, batch_size, stats, chunks, start):
+    """Generate chunks of haiku in a pool of batch worker processes."""
+    import multiprocessing
+    with multiprocessing.Pool(jobs, initializer=_init_batch_worker,
+                              initargs=(chain, batch_size)) as pool:
+        yield from _number_chunks(pool.imap(_generate_batch_chunk, chunks),
+                                  stats, start)
+
+
+def _number_chunks(results, stats, start=0):
+    """Number the haiku in chunks of results from start, and add up their
+    stats."""
+    index = start
+    for haiku, chunk_stats in results:
+        if stats is not None:
+            stats.merge(chunk_stats)
+        for text in haiku:
+            yield index, text
+            index += 1
+
+
+def load_model(path, prefix_len=2):
+    """Load a chain saved by --compile.
+
+    Args:
+        path (string): a compiled chain file, or a directory saved with
+            --csr or --suffix-array
+        prefix_len (int): the prefix length to generate with, for a suffix
+            array chain; the others were built with theirs
+    Returns:
+        A chain
+    Raises:
+        ValueError if path isn't a saved chain
+    """
+    if not os.path.isdir(path):
+        return chainfile.load(path)
+    try:
+        with open(os.path.join(path, "chain.json")) as f:
+            chain_format = json.load(f).get("format")
+    except (OSError, ValueError):
+        chain_format = None
+    if chain_format == "haiku-suffix-array":
+        import suffixarray
+        return suffixarray.load(path, prefix_len)
+    import csrchain
+    return csrchain.load(path)
+
+
+def chain_cache(args):
+    """Get the ChainCache set up by the command line arguments, if any."""
+    if args.cache_dir is None:
+        return None
+    import chaincache
+    return chaincache.ChainCache(args.cache_dir, args.cache_size << 20)
+
+
+def serve(argv):
+    """Run the haiku server (haiku.py serve) until interrupted."""
+    import asyncio
+    import server
+
+    args = util.parse_serve_args(argv)
+    chains = server.load_chains(args.input, args.prefix_lens,
+                                punkt=args.punkt, cache=chain_cache(args),
+                                backoff_min_successors=args.backoff,
+                                suffix_array=args.suffix_array)
+    haiku_server = server.HaikuServer(chains, args.host, args.port,
+                                      args.jobs)
+    print("Serving {} on http://{}:{}/haiku".format(
+        ", ".join("{}/{}".format(*key) for key in sorted(chains)),
+        args.host, args.port), file=sys.stderr)
+    try:
+        asyncio.run(haiku_server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__' and sys.argv[1:2] == ["serve"]:
+    serve(sys.argv[2:])
+elif __name__ == '__main__':
     args = util.parse_args()
-    chain = markov.MarkovChain.from_files(args.input, args.prefix_len)
-    haiku = generate_haiku(chain)
-    print(haiku)
+    if args.model:
+        chain = load_model(args.model, args.prefix_len)
+    elif args.suffix_array:
+        import suffixarray
+        chain = suffixarray.SuffixArrayChain.from_files(args.input,
+                                                        args.prefix_len)
+    elif args.csr or args.batch:
+        import csrchain
+        chain = csrchain.CSRChain.from_files(args.input, args.prefix_len,
+                                             punkt=args.punkt)
+    elif args.backoff is not None:
+        import backoff
+        chain = backoff.BackoffChain.from_files(
+            args.input, args.prefix_len, punkt=args.punkt,
+            min_successors=args.backoff)
+    else:
+        chain = markov.MarkovChain.from_files(args.input, args.prefix_len,
+                                              jobs=args.jobs, punkt=args.punkt,
+                                              cache=chain_cache(args))
+    if args.estimate_syllables:
+        chain.index_syllables(util.estimate_syllables)
+    if args.compile:
+        # a chain loaded with --model already has its syllable index
+        if not chain.syllables_indexed:
+            chain.index_syllables(util.lookup_syllables)
+        if args.csr:
+            csrchain.save(chain, args.output)
+        elif args.suffix_array:
+            suffixarray.save(chain, args.output)
+        else:
+            chainfile.save(chain, args.output)
+    elif args.count is not None:
+        stats = GenerationStats() if args.stats else None
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            generate = generate_batch if args.batch else generate_many
+            if args.unique:
+                import dedup
+                seen = dedup.BloomFilter(args.unique_mb << 20,
+                                         args.unique_error)
+                results = generate_unique(generate, chain, args.count,
+                                          seen, jobs=args.jobs,
+                                          seed=args.seed, stats=stats)
+            else:
+                results = generate(chain, args.count, args.jobs,
+                                   args.seed, stats=stats)
+            written = 0
+            for index, haiku in results:
+                out.write(json.dumps({"index": index, "haiku": haiku}))
+                out.write("\n")
+                written += 1
+        except ValueError as e:
+            sys.exit(str(e))
+        finally:
+            # only close the output if it was opened here, not stdout
+            if args.output:
+                out.close()
+        if written < args.count:
+            print("Only {} different haiku could be generated, of the {} "
+                  "asked for".format(written, args.count), file=sys.stderr)
+        if stats is not None:
+            print(stats.format(), file=sys.stderr)
+            if args.unique:
+                print("unique filter: {} haiku of {}, estimated false "
+                      "positive rate {:.2g}".format(
+                          seen.count, seen.capacity,
+                          seen.estimated_error_rate()), file=sys.stderr)
+    else:
+        stats = GenerationStats() if args.stats else None
+        if args.seed is not None:
+            random.seed(args.seed)
+        try:
+            haiku = generate_haiku(chain, stats)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(haiku)
+        if stats is not None:
+            print(stats.format(), file=sys.stderr)
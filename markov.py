@@ -1,10 +1,36 @@
 """Markov chain text generator.
 
-This module exports the MarkovChain class.
+This module exports the MarkovChain and Vocabulary classes, the BaseChain
+class that other chain representations build on, and the GenerationState
+class for generating text from a chain one word at a time.
 """
+import bisect
+import bz2
+import collections
+import gzip
 import random
-import os
-import nltk
+from array import array
+
+# Characters to read from an input file at a time
+_CHUNK_SIZE = 1 << 20
+
+# The version of the way MarkovChain.from_files builds chains. Change it
+# whenever a change to the code changes the chains built from the same text,
+# so that chains saved by a chaincache.ChainCache are built again.
+BUILD_VERSION = 3
+
+# Punctuation that ends a sentence, and punctuation that can come after it
+# or before the first word of the next one
+_SENTENCE_END = ".!?"
+_CLOSING_PUNCTUATION = "\"'”’)]_"
+_OPENING_PUNCTUATION = "\"'“‘([_"
+# The last characters of words that might end a sentence
+_MAYBE_END = _SENTENCE_END + _CLOSING_PUNCTUATION
+# Abbreviations (lowercase, without the period) that don't end a sentence
+_ABBREVIATIONS = frozenset([
+    "capt", "ch", "col", "dr", "esq", "etc", "fig", "gen", "gov", "hon",
+    "jr", "lt", "messrs", "mr", "mrs", "ms", "mt", "prof", "rev", "sgt",
+    "sr", "st", "vol", "vs"])
 
 
 def _update_prefix(prefix_len, current_prefix, new_word):
@@ -28,15 +54,498 @@ def _update_prefix(prefix_len, current_prefix, new_word):
     return new_prefix.strip()
 
 
-class MarkovChain:
+class Vocabulary:
+    """A two-way mapping between words and integer ids.
+
+    Each distinct word is stored once, and gets the next unused id
+    the first time it's added.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._words = []
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._ids
+
+    def add(self, word):
+        """Return the id of a word, assigning it a new id if necessary."""
+        word_id = self._ids.get(word)
+        if word_id is None:
+            word_id = len(self._words)
+            self._ids[word] = word_id
+            self._words.append(word)
+        return word_id
+
+    def get_id(self, word):
+        """Return the id of a word, or None if it isn't in the vocabulary."""
+        return self._ids.get(word)
+
+    def word(self, word_id):
+        """Return the word with the given id."""
+        return self._words[word_id]
+
+    def copy(self):
+        """Return a copy of the vocabulary, with the same ids."""
+        vocab = Vocabulary()
+        vocab._ids = dict(self._ids)
+        vocab._words = list(self._words)
+        return vocab
+
+    def _truncate(self, size):
+        """Forget the words added after the vocabulary had size words."""
+        for word in self._words[size:]:
+            del self._ids[word]
+        del self._words[size:]
+
+
+# The syllable count of a word that isn't in the pronouncing dictionary.
+# It's larger than any real count, so those words sort last.
+UNKNOWN_SYLLABLES = 255
+
+# Bits in the flags chains keep for each word, alongside its syllable count
+WORD_ENDS_SENTENCE = 1
+
+
+def word_flags(word):
+    """Work out the flags for a word (a combination of the WORD_ bits)."""
+    if word and word[-1] in _SENTENCE_END:
+        return WORD_ENDS_SENTENCE
+    return 0
+
+
+class _SuccessorTable:
+    """The words that follow a prefix, and how many times each one occurs.
+
+    Sampling draws an integer below the total count and finds it in a
+    cumulative count array, so each word is chosen with the same probability
+    as random.choice over a list holding one copy per occurrence.
+    The cumulative array is rebuilt lazily after the counts change.
+
+    If the chain has a syllable index, the successors are sorted by their
+    number of syllables, so the ones with at most k syllables are always
+    at the start of the table, and can be sampled with a single draw.
+
+    Tables with many successors can also be sampled with alias tables, kept
+    in an _AliasCache, which take constant time per draw.
+    """
+
+    __slots__ = ("counts", "_ids", "_cumulative", "_syllables", "_alias")
+
+    def __init__(self, counts):
+        self.counts = counts
+        self._ids = None
+        self._cumulative = None
+        self._syllables = None
+        # {number of successors sampled from: alias table}, or None
+        self._alias = None
+
+    def __reduce__(self):
+        # the sampling arrays are cheaper to rebuild than to pickle
+        return (_SuccessorTable, (self.counts,))
+
+    def add(self, word_id, count=1):
+        """Record count more occurrences of word_id."""
+        self.counts[word_id] = self.counts.get(word_id, 0) + count
+        self._ids = None
+
+    def add_counts(self, counts):
+        """Record the occurrences in a {word id: count} dictionary."""
+        own = self.counts
+        for word_id, count in counts.items():
+            own[word_id] = own.get(word_id, 0) + count
+        self._ids = None
+
+    def subtract_counts(self, counts):
+        """Forget the occurrences in a {word id: count} dictionary.
+
+        Each count must be at most the recorded one. Words left with no
+        occurrences are removed.
+        """
+        own = self.counts
+        for word_id, count in counts.items():
+            own[word_id] -= count
+            if not own[word_id]:
+                del own[word_id]
+        self._ids = None
+
+    def _compile(self, word_syllables):
+        ids = list(self.counts)
+        self._alias = None
+        self._syllables = None
+        if word_syllables is not None:
+            ids.sort(key=word_syllables)
+            self._syllables = array("B", map(word_syllables, ids))
+        self._ids = array("I", ids)
+        self._cumulative = array("Q")
+        total = 0
+        for word_id in ids:
+            total += self.counts[word_id]
+            self._cumulative.append(total)
+
+    def sample(self, max_syllables=None, word_syllables=None, aliases=None):
+        """Return a random successor id, weighted by its count.
+
+        Args:
+            max_syllables (int): optional; if given, only choose from
+                successors with at most this many syllables.
+            word_syllables: function giving the syllable count of a word id;
+                required with max_syllables.
+            aliases (_AliasCache): optional cache of alias tables to sample
+                with, if there are enough successors to choose from
+        Returns:
+            The word id, or None if no successor is short enough.
+        """
+        if self._ids is None or (word_syllables is not None and
+                                 self._syllables is None):
+            self._compile(word_syllables)
+        end = len(self._ids)
+        if max_syllables is not None:
+            end = bisect.bisect_right(self._syllables, max_syllables)
+            if end == 0:
+                return None
+        if aliases is not None and end >= aliases.min_successors:
+            word_id = aliases.sample(self, end)
+            if word_id is not None:
+                return word_id
+        target = random.randrange(self._cumulative[end - 1])
+        return self._ids[bisect.bisect_right(self._cumulative, target, 0, end)]
+
+
+# Successor tables with at least this many successors to choose from are
+# sampled with alias tables
+ALIAS_MIN_SUCCESSORS = 64
+# The most memory a chain's alias tables take, in bytes
+ALIAS_MAX_BYTES = 8 << 20
+# How many draws per successor a table takes without an alias table before
+# one is built. Building one costs about as much per successor as a draw
+# saves, so by then the draws made without it have paid for it.
+ALIAS_DRAWS_PER_SUCCESSOR = 1
+
+
+def _build_alias(weights):
+    """Build an alias table for sampling with Vose's method.
+
+    Returns:
+        A (probabilities, aliases) pair of arrays. Draw x uniformly from
+        [0, n), and take i = int(x); the choice is i if x - i is below
+        probabilities[i], or else aliases[i].
+    """
+    n = len(weights)
+    total = sum(weights)
+    scaled = [weight * n / total for weight in weights]
+    aliases = array("I", bytes(4 * n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        less = small.pop()
+        more = large[-1]
+        aliases[less] = more
+        scaled[more] -= 1.0 - scaled[less]
+        if scaled[more] < 1.0:
+            small.append(large.pop())
+    # whatever's left is 1, apart from rounding errors
+    for i in small + large:
+        scaled[i] = 1.0
+    return array("d", scaled), aliases
+
+
+class _AliasCache:
+    """Alias tables for a chain's successor tables with the most successors.
+
+    An alias table draws a word in constant time, rather than in time
+    logarithmic in the number of successors, but it takes 12 bytes per
+    successor and about as long to build as a draw saves per successor.
+    So they're only built for tables with at least min_successors to choose
+    from, once each has been drawn from draws_per_successor times per
+    successor without one. Once they take more than max_bytes, the least
+    recently used are dropped.
+    """
+
+    def __init__(self, min_successors=ALIAS_MIN_SUCCESSORS,
+                 max_bytes=ALIAS_MAX_BYTES,
+                 draws_per_successor=ALIAS_DRAWS_PER_SUCCESSOR):
+        self.min_successors = min_successors
+        self.max_bytes = max_bytes
+        self.draws_per_successor = draws_per_successor
+        self.nbytes = 0
+        # successor table -> (its alias tables, their size in bytes), least
+        # recently used first
+        self._tables = collections.OrderedDict()
+        # (successor table, number of successors) -> draws made without an
+        # alias table
+        self._draws = {}
+
+    def __reduce__(self):
+        # the tables are rebuilt as they're used
+        return (_AliasCache, (self.min_successors, self.max_bytes,
+                              self.draws_per_successor))
+
+    def sample(self, table, end):
+        """Sample one of the first end successors of a _SuccessorTable.
+
+        Returns:
+            The successor's id, or None if the table hasn't been drawn from
+            often enough yet for an alias table to pay off
+        """
+        cached = self._tables.get(table)
+        # the table drops its alias tables when its successors change
+        if (cached is not None and cached[0] is table._alias and
+                end in table._alias):
+            self._tables.move_to_end(table)
+            probabilities, aliases = table._alias[end]
+        else:
+            key = table, end
+            draws = self._draws.get(key, 0)
+            if draws < self.draws_per_successor * end:
+                self._draws[key] = draws + 1
+                return None
+            self._draws.pop(key, None)
+            probabilities, aliases = self._build(table, end)
+        x = random.random() * end
+        i = int(x)
+        if x - i >= probabilities[i]:
+            i = aliases[i]
+        return table._ids[i]
+
+    def _build(self, table, end):
+        """Build the alias table for the first end successors of table."""
+        tables = self._tables
+        alias, size = tables.pop(table, (None, 0))
+        if alias is None or alias is not table._alias:
+            self.nbytes -= size
+            alias = table._alias = {}
+            size = 0
+        counts = table.counts
+        alias[end] = _build_alias(
+            [counts[word_id] for word_id in table._ids[:end]])
+        tables[table] = alias, size + 12 * end
+        self.nbytes += 12 * end
+        while self.nbytes > self.max_bytes and len(tables) > 1:
+            evicted, (evicted_alias, size) = tables.popitem(last=False)
+            if evicted._alias is evicted_alias:
+                evicted._alias = None
+            self.nbytes -= size
+        return alias[end]
+
+
+def _successor_counts(entry):
+    """Return a {word id: count} dictionary for a chain entry."""
+    if type(entry) is int:
+        return {entry: 1}
+    return entry.counts
+
+
+def _sample(entry, max_syllables=None, word_syllables=None, aliases=None):
+    """Return a random successor id from a chain entry.
+
+    Takes the same optional arguments as _SuccessorTable.sample.
+    """
+    if type(entry) is int:
+        if max_syllables is not None and word_syllables(entry) > max_syllables:
+            return None
+        return entry
+    return entry.sample(max_syllables, word_syllables, aliases)
+
+
+# The id used in prefixes for words that aren't in the vocabulary.
+UNKNOWN_WORD = -1
+
+
+class GenerationState:
+    """A position in a Markov chain, for generating text a word at a time.
+
+    The state holds the current prefix as a tuple of word ids, so each step
+    takes the same amount of work no matter how much text came before it.
+    Get one with BaseChain.start().
+
+    Attributes:
+        chain (BaseChain): the chain being generated from
+        prefix (tuple of ints): the ids of the last words generated
+    """
+
+    __slots__ = ("chain", "prefix")
+
+    def __init__(self, chain, prefix):
+        self.chain = chain
+        self.prefix = prefix
+
+    def copy(self):
+        """Return an independent copy of this state."""
+        return GenerationState(self.chain, self.prefix)
+
+    def sample(self, max_syllables=None):
+        """Pick a random next word id, without advancing the state.
+
+        Args:
+            max_syllables (int): optional limit on the number of syllables
+                in the word, as for BaseChain.next_word.
+
+        Returns:
+            The word id, or None if no word can follow the current prefix.
+        """
+        return self.chain._sample_next(self.prefix, max_syllables)
+
+    def advance(self, word_id):
+        """Move the state past a word."""
+        self.prefix = (self.prefix + (word_id,))[-self.chain._prefix_len:]
+
+    def next_word(self, max_syllables=None):
+        """Generate the next word, and advance the state past it.
+
+        Args:
+            max_syllables (int): optional limit on the number of syllables
+                in the word, as for BaseChain.next_word.
+
+        Returns:
+            The next word (as a string), or an empty string if no word can
+            follow the current prefix (in which case the state doesn't
+            change).
+        """
+        word_id = self.chain._sample_next(self.prefix, max_syllables)
+        if word_id is None:
+            return ""
+        self.advance(word_id)
+        return self.chain._vocab.word(word_id)
+
+
+class BaseChain:
+    """Text generation shared by every Markov chain representation.
+
+    Subclasses store the chain however they like; they must set
+    ``_prefix_len`` and ``_vocab`` and implement:
+        _sample_next(prefix, max_syllables=None): Return a random successor
+            id for a tuple of word ids, or None if the prefix isn't in the
+            chain. If max_syllables is given, only successors with at most
+            that many syllables count, which needs a syllable index.
+        _successor_items(): Iterate over (prefix, {word id: count}) pairs.
+        successors(prefix): Return a {word id: count} dictionary of the
+            words that follow a prefix, which is empty if it isn't in the
+            chain.
+        syllable_count(word_id): Return the indexed number of syllables in
+            a word, or None if it's unknown.
+        syllables_indexed (attribute): Whether there is a syllable index.
+        ends_sentence(word_id): Return whether a word ends with .!?
+
+    Chains that can change after they're built add one to ``version`` each
+    time, so anything worked out from the chain can tell it's out of date.
+    """
+
+    version = 0
+
+    def ends_sentence(self, word_id):
+        """Return whether a word ends with sentence-final punctuation."""
+        return bool(word_flags(self._vocab.word(word_id)) &
+                    WORD_ENDS_SENTENCE)
+
+    @property
+    def prefix_len(self):
+        """The number of words in each prefix."""
+        return self._prefix_len
+
+    @property
+    def vocab(self):
+        """The vocabulary of words that appear in the chain."""
+        return self._vocab
+
+    def _prefix_for(self, text):
+        """Return the prefix made up of the last words of text.
+
+        Words that aren't in the vocabulary get the id UNKNOWN_WORD, so no
+        prefix containing them is in the chain.
+        """
+        get_id = self._vocab.get_id
+        return tuple(UNKNOWN_WORD if word_id is None else word_id
+                     for word_id in map(get_id,
+                                        text.split()[-self._prefix_len:]))
+
+    def start(self, current_text=""):
+        """Get a GenerationState for generating text after some seed text.
+
+        Args:
+            current_text (string): optional seed text, which can be any length
+
+        Returns:
+            A GenerationState
+        """
+        return GenerationState(self, self._prefix_for(current_text))
+
+    def generate(self, word_count, current_text=""):
+        """Generate word_count words.
+
+        Args:
+            word_count (int): number of words to generate
+            current_text (string): optional seed text, which can be any length
+
+        Returns:
+            The generated text, as a string
+        """
+        state = self.start(current_text)
+        generated_words = []
+        for i in range(word_count):
+            word = state.next_word()
+            if not word:
+                # we're out of prefixes,
+                # so just return what we've generated thus far
+                break
+            generated_words.append(word)
+
+        return " ".join(generated_words)
+
+    def next_word(self, current_text, max_syllables=None):
+        """Given some text, generate another word.
+
+        Args:
+            current_text (string): seed text, which can be any length
+            max_syllables (int): optional limit on the number of syllables
+                in the word; the chain must have a syllable index.
+                Words that aren't in the pronouncing dictionary are never
+                chosen when this is given.
+
+        Returns:
+            The next word (as a string), or an empty string if no word
+            can follow the seed text.
+        """
+        return self.start(current_text).next_word(max_syllables)
+
+    def to_dict(self):
+        """Get the successor counts for every prefix in the chain.
+
+        Returns:
+            A dictionary mapping each prefix, as a space-separated string,
+            to a dictionary from each word that follows it to the number of
+            times it does.
+        """
+        word = self._vocab.word
+        return {
+            " ".join(word(w) for w in prefix): {
+                word(w): count for w, count in counts.items()
+            }
+            for prefix, counts in self.items()
+        }
+
+    def items(self):
+        """Iterate over the prefixes in the chain.
+
+        Yields:
+            (prefix, counts) pairs, where prefix is a tuple of word ids and
+            counts is a dictionary from word id to number of occurrences.
+        """
+        return self._successor_items()
+
+
+class MarkovChain(BaseChain):
     """A Markov chain text generator.
 
-    To build a chain, this class creates a dictionary from each prefix
-    to a list of all possible words that could follow that prefix (where every
-    substring consisting of ``_prefix_len`` words is a prefix).
-    If a word follows a prefix at more than one point in the text, it will
-    appear more than once on the list of next words in that prefix's dictionary
-    entry.
+    Every word is interned in a Vocabulary, and each prefix (a tuple of up to
+    ``_prefix_len`` word ids) maps to the words that can follow it, along
+    with the number of times each one follows it in the text.
+    Since most prefixes are only ever followed by a single word, once,
+    those are stored as a bare word id; a _SuccessorTable of counts is
+    only created when a prefix gets a second successor.
 
     In order to generate long chunks of text, the factory methods (from_string
     and from_files) first build the chain from the whole text at once,
@@ -51,35 +560,209 @@ class MarkovChain:
             of a list of files
         generate: Generate text.
         next_word: Given some text, generate the next word.
+        to_dict: Get the chain's successor counts, keyed by prefix text.
+        items: Iterate over each prefix and its successor counts.
+        merge: Add the successor counts of another chain.
+        add_text, add_files: Add more documents to the chain.
+        remove_text, remove_files: Take out documents added earlier.
 
     """
 
-    def __init__(self, prefix_len):
+    def __init__(self, prefix_len, vocab=None):
         """Initialize the Markov chain.
 
         Args:
             prefix_len (int): number of words in each prefix
+            vocab (Vocabulary): the vocabulary to intern words in. By default,
+                a new, empty one.
         """
         if prefix_len < 1:
             raise ValueError('Prefix length must be at least one')
 
         self._prefix_len = prefix_len
-        self._chain = {
-            "": []
-        }
+        self._vocab = Vocabulary() if vocab is None else vocab
+        self._chain = {}
+        self.syllables_indexed = False
+        self._lookup_syllables = None
+        self._syllables = array("B")
+        self._word_flags = array("B")
+        self._aliases = _AliasCache()
 
-    def _update(self, text):
-        """Update the chain with the provided text."""
-        current_prefix = ""
-        word_list = text.split()
-        for word in word_list:
+    def index_syllables(self, syllables):
+        """Group each prefix's successors by their number of syllables.
+
+        Afterwards, next_word can be asked for a word with at most some
+        number of syllables, and picks it with one draw from just the
+        successors that qualify, instead of sampling and rejecting words.
+
+        Args:
+            syllables: a function that returns the number of syllables in
+                a word, or None if it isn't known.
+        """
+        self._lookup_syllables = syllables
+        self._syllables = array("B")
+        for entry in self._chain.values():
+            if type(entry) is not int:
+                entry._ids = None
+        self.syllables_indexed = True
+        # the syllable counts may have changed
+        self.version += 1
+
+    def _word_syllables(self, word_id):
+        syllables = self._syllables
+        # look up any words added since the last call
+        while len(syllables) <= word_id:
+            count = self._lookup_syllables(self._vocab.word(len(syllables)))
+            if count is None or count >= UNKNOWN_SYLLABLES:
+                count = UNKNOWN_SYLLABLES
+            syllables.append(count)
+        return syllables[word_id]
+
+    def syllable_count(self, word_id):
+        """Return the number of syllables in a word, or None if unknown."""
+        if not self.syllables_indexed:
+            return None
+        count = self._word_syllables(word_id)
+        return None if count == UNKNOWN_SYLLABLES else count
+
+    def ends_sentence(self, word_id):
+        """Return whether a word ends with sentence-final punctuation."""
+        flags = self._word_flags
+        # work out the flags of any words added since the last call
+        while len(flags) <= word_id:
+            flags.append(word_flags(self._vocab.word(len(flags))))
+        return bool(flags[word_id] & WORD_ENDS_SENTENCE)
+
+    def _sample_next(self, prefix, max_syllables=None):
+        entry = self._chain.get(prefix)
+        if entry is None:
+            return None
+        if not self.syllables_indexed:
+            if max_syllables is not None:
+                raise ValueError("The chain has no syllable index")
+            return _sample(entry, aliases=self._aliases)
+        return _sample(entry, max_syllables, self._word_syllables,
+                       self._aliases)
+
+    def _successor_items(self):
+        for prefix, entry in self._chain.items():
+            yield prefix, _successor_counts(entry)
+
+    def successors(self, prefix):
+        """Return a {word id: count} dictionary of the successors of a
+        prefix (a tuple of word ids)."""
+        entry = self._chain.get(prefix)
+        if entry is None:
+            return {}
+        return dict(_successor_counts(entry))
+
+    def _add(self, prefix, word_id, count=1):
+        """Record count occurrences of word_id following prefix."""
+        entry = self._chain.get(prefix)
+        if entry is None and count == 1:
+            self._chain[prefix] = word_id
+        elif entry is None:
+            self._chain[prefix] = _SuccessorTable({word_id: count})
+        elif type(entry) is int:
+            table = _SuccessorTable({entry: 1})
+            table.add(word_id, count)
+            self._chain[prefix] = table
+        else:
+            entry.add(word_id, count)
+
+    # a sentence start is just a successor of a prefix with fewer words
+    _add_start = _add
+
+    def merge(self, other):
+        """Add the successor counts of another chain to this one.
+
+        Words are matched up by their text, so the two chains can have
+        different vocabularies. Words new to this chain are added to the
+        vocabulary in the order of the other chain's ids.
+
+        Args:
+            other (BaseChain): a chain with the same prefix length
+        Raises:
+            ValueError if the prefix lengths differ
+        """
+        if other.prefix_len != self._prefix_len:
+            raise ValueError("Can't merge chains with different prefix "
+                             "lengths")
+        other_vocab = other.vocab
+        ids = [self._vocab.add(other_vocab.word(word_id))
+               for word_id in range(len(other_vocab))]
+        if isinstance(other, MarkovChain):
+            # skip copying every successor table
+            entries = other._chain.items()
+        else:
+            entries = other.items()
+        self._merge_entries(entries, ids)
+
+    def _merge_entries(self, entries, word_ids):
+        """Add successor entries from a chain with a different vocabulary.
+
+        Args:
+            entries: (prefix, entry) pairs, where each entry is a word id,
+                a _SuccessorTable or a {word id: count} dictionary
+            word_ids (list of ints): this chain's id for each word id in
+                the entries
+        """
+        chain = self._chain
+        for prefix, entry in entries:
+            prefix = tuple([word_ids[word_id] for word_id in prefix])
+            if type(entry) is int:
+                self._add(prefix, word_ids[entry])
+                continue
+            counts = entry if type(entry) is dict else entry.counts
+            if prefix not in chain:
+                chain[prefix] = _SuccessorTable(
+                    {word_ids[word_id]: count
+                     for word_id, count in counts.items()})
+                continue
+            for word_id, count in counts.items():
+                self._add(prefix, word_ids[word_id], count)
+
+    def _merge_counts(self, singles, tables):
+        """Add successor counts that already use this chain's word ids.
+
+        Both dictionaries are emptied or taken over by the chain.
+
+        Args:
+            singles (dict): maps prefixes to a word seen after them once
+            tables (dict): maps prefixes to {word id: count} dictionaries
+        """
+        chain = self._chain
+        # most prefixes are new, so the others are dealt with first, and
+        # the rest added all at once
+        for prefix in singles.keys() & chain.keys():
+            self._add(prefix, singles.pop(prefix))
+        for prefix in tables.keys() & chain.keys():
+            table = chain[prefix]
+            if type(table) is int:
+                table = chain[prefix] = _SuccessorTable({table: 1})
+            table.add_counts(tables.pop(prefix))
+        chain.update(singles)
+        chain.update((prefix, _SuccessorTable(counts))
+                     for prefix, counts in tables.items())
+
+    def _update_words(self, words, current_prefix=()):
+        """Update the chain with a list of words that follow current_prefix.
+
+        Returns:
+            The prefix after the last word.
+        """
+        prefix_len = self._prefix_len
+        add_word = self._vocab.add
+        for word in words:
             # add word to chain for appropriate prefix
-            if current_prefix not in self._chain:
-                self._chain[current_prefix] = []
-            self._chain[current_prefix].append(word)
+            word_id = add_word(word)
+            self._add(current_prefix, word_id)
+            current_prefix = (current_prefix + (word_id,))[-prefix_len:]
+        return current_prefix
 
-            current_prefix = _update_prefix(self._prefix_len,
-                                            current_prefix, word)
+    def _update(self, text):
+        """Update the chain with the provided text."""
+        self._update_words(text.split())
 
     def _add_chain_start(self, sentence):
         """Update chain with first _prefix_len words of the sentence.
@@ -92,85 +775,343 @@ class MarkovChain:
         sentence_start = words[:self._prefix_len]
         self._update(" ".join(sentence_start))
 
-    def _add_sentences(self, text):
-        # First read in everything as one string,
-        # So we can generate more than one sentence at a time
-        self._update(text)
-        # now make each sentence a starting point
-        # first sentence already is, so ignore it
-        sentences = nltk.sent_tokenize(text)[1:]
-        for sentence in sentences:
-            # make each sentence a starting point!
-            self._add_chain_start(sentence)
+    def _add_sentences(self, text, punkt=False):
+        builder = _PunktBuilder(self) if punkt else _ChainBuilder(self)
+        builder.feed(text.split())
+        builder.close()
+
+    def _add_files(self, file_names, punkt=False):
+        builder_class = _PunktBuilder if punkt else _ChainBuilder
+        for file_name in file_names:
+            with _open_text(file_name) as f:
+                builder = builder_class(self)
+                for words in _read_words(f):
+                    builder.feed(words)
+                builder.close()
+
+    def add_text(self, text, punkt=False):
+        """Add a document to the chain.
+
+        The chain ends up just as if the document had been one of the ones
+        it was built from, and the work done is proportional to the length
+        of the document, not of the chain.
+
+        Args:
+            text (string): the document
+            punkt (bool): find sentences with NLTK's Punkt tokenizer; this
+                should match the way the chain was built
+        """
+        self._add_sentences(text, punkt)
+        self.version += 1
+
+    def add_files(self, file_names, punkt=False):
+        """Add the contents of each of a list of files as a document.
+
+        Args:
+            file_names (list of strings): files to read, as for from_files
+            punkt (bool): find sentences with NLTK's Punkt tokenizer; this
+                should match the way the chain was built
+        """
+        self._add_files(file_names, punkt)
+        self.version += 1
+
+    def remove_text(self, text, punkt=False):
+        """Take a document that was added to the chain back out.
+
+        Afterwards, the chain's successor counts are just as if the chain
+        had been built without the document, and the work done is
+        proportional to the length of the document. Words that no longer
+        appear anywhere keep their place in the vocabulary, but are never
+        generated.
+
+        Args:
+            text (string): the document, as it was added
+            punkt (bool): find sentences with NLTK's Punkt tokenizer, as
+                when the document was added
+        Raises:
+            ValueError if the document can't have been added to the chain,
+                in which case the chain is left unchanged
+        """
+        self._remove(lambda chain: chain._add_sentences(text, punkt))
+
+    def remove_files(self, file_names, punkt=False):
+        """Take the contents of each of a list of files back out.
+
+        Args:
+            file_names (list of strings): files that were added, as for
+                from_files or add_files, and haven't changed since
+            punkt (bool): find sentences with NLTK's Punkt tokenizer, as
+                when the files were added
+        Raises:
+            ValueError if the files can't have been added to the chain, in
+                which case the chain is left unchanged
+        """
+        self._remove(lambda chain: chain._add_files(file_names, punkt))
+
+    def _remove(self, build):
+        """Subtract the counts of a chain built by build(chain).
+
+        The chain being subtracted shares this chain's vocabulary, so its
+        prefixes can be looked up directly.
+        """
+        n_words = len(self._vocab)
+        removed = MarkovChain(self._prefix_len, self._vocab)
+        try:
+            build(removed)
+        finally:
+            added_words = len(self._vocab) > n_words
+            self._vocab._truncate(n_words)
+        if added_words:
+            raise ValueError("The text has words that aren't in the chain")
+        chain = self._chain
+        for prefix, entry in removed._chain.items():
+            own = chain.get(prefix)
+            counts = {} if own is None else _successor_counts(own)
+            if any(counts.get(word_id, 0) < count for word_id, count
+                   in _successor_counts(entry).items()):
+                raise ValueError("The text wasn't added to the chain")
+        for prefix, entry in removed._chain.items():
+            table = chain[prefix]
+            if type(table) is int:
+                # it was only seen once, so the text has the one occurrence
+                del chain[prefix]
+                continue
+            table.subtract_counts(_successor_counts(entry))
+            counts = table.counts
+            if not counts:
+                del chain[prefix]
+            elif len(counts) == 1 and next(iter(counts.values())) == 1:
+                # store it as a fresh build would
+                chain[prefix] = next(iter(counts))
+        self.version += 1
 
     @classmethod
-    def from_string(cls, text, prefix_len=2):
+    def from_string(cls, text, prefix_len=2, punkt=False):
         """Build a markov chain from a string.
 
         Args:
             text (string): the input text
             prefix_len: optional prefix length
+            punkt (bool): find sentences with NLTK's Punkt tokenizer,
+                rather than the faster built-in rules
 
         Returns:
             A MarkovChain
         """
         chain = cls(prefix_len)
-        chain._add_sentences(text)
+        chain._add_sentences(text, punkt)
         return chain
 
     @classmethod
-    def from_files(cls, file_names, prefix_len):
+    def from_files(cls, file_names, prefix_len, jobs=1, punkt=False,
+                   cache=None):
         """Build a Markov chain from a list of files.
 
+        The files are read a chunk at a time, so only the chain itself has
+        to fit in memory. Files ending in .gz or .bz2 are decompressed.
+
         Args:
             file_names (list of strings): files to read input text from
             prefix_len: the prefix length of the Markov chain
+            jobs (int): the number of processes to build it with; see
+                sharding.build_chain
+            punkt (bool): find sentences with NLTK's Punkt tokenizer,
+                rather than the faster built-in rules
+            cache (chaincache.ChainCache): optional cache to look for the
+                chain in before building it, and to add it to after
 
         Returns:
             A MarkovChain
         """
+        if cache is not None:
+            key = cache.key(cls, file_names, prefix_len, punkt)
+            chain = cache.load(key)
+            if chain is None:
+                chain = cls.from_files(file_names, prefix_len, jobs, punkt)
+                cache.store(key, chain)
+            return chain
+        if jobs > 1:
+            # sharding builds on this module
+            import sharding
+            return sharding.build_chain(cls, file_names, prefix_len, jobs,
+                                        punkt=punkt)
         chain = cls(prefix_len)
-        for file_name in file_names:
-            with open(file_name, 'r') as f:
-                text = " ".join(f.read().splitlines())
-                chain._add_sentences(text)
-                # chain.update_from_file(f)
+        chain._add_files(file_names, punkt)
         return chain
 
-    def generate(self, word_count, current_text=""):
-        """Generate word_count words.
 
-        Args:
-            word_count (int): number of words to generate
-            current_text (string): optional seed text, which can be any length
+def _open_text(file_name):
+    """Open a text file for reading, decompressing .gz and .bz2 files."""
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, "rt")
+    if file_name.endswith(".bz2"):
+        return bz2.open(file_name, "rt")
+    return open(file_name, "r")
 
-        Returns:
-            The generated text, as a string
+
+def _read_words(f, chunk_size=_CHUNK_SIZE):
+    """Read the words in a file, a chunk at a time.
+
+    Yields:
+        Lists of words. A word is never split between two lists.
+    """
+    partial_word = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        words = (partial_word + chunk).split()
+        partial_word = ""
+        if words and not chunk[-1].isspace():
+            # the last word might continue in the next chunk
+            partial_word = words.pop()
+        yield words
+    if partial_word:
+        yield [partial_word]
+
+
+def _ends_sentence(word, next_word):
+    """Guess whether a sentence ends between two words.
+
+    A sentence ends after a word ending in sentence-final punctuation
+    (possibly followed by closing quotes or brackets), unless the word looks
+    like an abbreviation or an initial, or the next word starts with a
+    lowercase letter.
+    """
+    stripped = word.rstrip(_CLOSING_PUNCTUATION)
+    if not stripped or stripped[-1] not in _SENTENCE_END:
+        return False
+    if stripped[-1] == ".":
+        body = stripped[:-1].lstrip(_OPENING_PUNCTUATION)
+        if body.lower() in _ABBREVIATIONS or (len(body) == 1 and
+                                              body.isalpha()):
+            return False
+    return not next_word.lstrip(_OPENING_PUNCTUATION)[:1].islower()
+
+
+class _ChainBuilder:
+    """Adds a stream of text to a MarkovChain, a list of words at a time.
+
+    Every word is added to the chain, following the words before it, so we
+    can generate more than one sentence at a time. The start of each
+    sentence (other than the first, which already is) is also added as a
+    starting point for generated text: each of its first prefix_len words
+    is added again, following just the words of the sentence before it.
+    Sentence boundaries are found by _ends_sentence as the words go by, so
+    the text is only read once.
+
+    The prefix and the start of the current sentence are carried from one
+    list of words to the next, so the chain comes out the same however the
+    text is split up.
+    """
+
+    def __init__(self, chain):
+        self._chain = chain
+        self._prefix = ()
+        # the ids of the words so far in a sentence whose start is being
+        # added, or None if it isn't
+        self._start = None
+        self._last_word = None
+
+    def feed(self, words):
+        """Add a list of words to the chain."""
+        self._scan(words, self._chain._add, self._chain._add_start)
+
+    def skip(self, words):
+        """Carry on from a list of words, without adding them to the chain.
+
+        This is for picking up in the middle of a text whose earlier words
+        were added by another builder.
         """
-        prefix_words = current_text.split()[-self._prefix_len:]
-        current_prefix = " ".join(prefix_words)
-        generated_words = []
-        for i in range(word_count):
-            if current_prefix in self._chain:
-                word = random.choice(self._chain[current_prefix])
-            else:
-                # we're out of prefixes,
-                # so just return what we've generated thus far
-                break
+        self._scan(words, _ignore, _ignore)
 
-            generated_words.append(word)
-            current_prefix = _update_prefix(self._prefix_len,
-                                            current_prefix, word)
+    def close(self):
+        """Finish adding text to the chain."""
 
-        return " ".join(generated_words)
+    def _scan(self, words, add, add_start):
+        add_word = self._chain.vocab.add
+        prefix_len = self._chain.prefix_len
+        prefix = self._prefix
+        start = self._start
+        last_word = self._last_word
+        for word in words:
+            word_id = add_word(word)
+            add(prefix, word_id)
+            prefix = (prefix + (word_id,))[-prefix_len:]
+            if (last_word is not None and last_word[-1] in _MAYBE_END and
+                    _ends_sentence(last_word, word)):
+                # make each sentence a starting point!
+                start = ()
+            if start is not None:
+                add_start(start, word_id)
+                start += (word_id,)
+                if len(start) == prefix_len:
+                    start = None
+            last_word = word
+        self._prefix = prefix
+        self._start = start
+        self._last_word = last_word
 
-    def next_word(self, current_text):
-        """Given some text, generate another word.
 
-        Args:
-            current_text (string): seed text, which can be any length
+def _ignore(prefix, word_id):
+    pass
 
-        Returns:
-            The next word (as a string)
+
+class _PunktBuilder:
+    """Adds a stream of text to a MarkovChain, finding sentences with Punkt.
+
+    This builds the same kind of chain as _ChainBuilder, but splits the text
+    into sentences with NLTK's Punkt tokenizer, which is more thorough (it
+    also splits "dashed—Then" between sentences) but several times slower.
+    The text is tokenized after its words have been added to the chain,
+    and the start of each sentence is added then.
+
+    The prefix is carried from one list of words to the next, and so are
+    the words of the last sentence, which might not be over yet. That way,
+    the chain comes out the same however the text is split up.
+    """
+
+    def __init__(self, chain):
+        self._chain = chain
+        self._prefix = ()
+        # words of the sentence that might continue in the next list
+        self._pending = []
+        self._first_sentence = True
+
+    def feed(self, words):
+        """Add a list of words to the chain."""
+        self._prefix = self._chain._update_words(words, self._prefix)
+        self._add_sentences(words)
+
+    def _add_sentences(self, words, complete=False):
+        """Split the pending words, followed by words, into sentences.
+
+        If complete, the words are known to end a sentence, so none of them
+        are left pending.
         """
-        return self.generate(1, current_text=current_text)
+        # only needed in this mode, and slow to import
+        import nltk
+
+        self._pending.extend(words)
+        sentences = nltk.sent_tokenize(" ".join(self._pending))
+        if complete:
+            finished, self._pending = sentences, []
+        else:
+            finished = sentences[:-1]
+            self._pending = sentences[-1].split() if sentences else []
+        for sentence in finished:
+            self._add_sentence_start(sentence)
+
+    def close(self):
+        """Finish adding text to the chain."""
+        if self._pending:
+            self._add_sentence_start(" ".join(self._pending))
+            self._pending = []
+
+    def _add_sentence_start(self, sentence):
+        if self._first_sentence:
+            # the chain already starts with this sentence
+            self._first_sentence = False
+        else:
+            # make each sentence a starting point!
+            self._chain._add_chain_start(sentence)
@@ -0,0 +1,384 @@
+"""An HTTP server that generates haiku from chains held in memory.
+
+The chains are built (or memory-mapped) once, when the server starts, so
+each request only pays for generating a haiku. Generation is CPU-bound, so
+it runs in a pool of worker processes, each with its own copy of the
+chains, and the event loop is left free to handle connections.
+
+The interface is plain HTTP/1.1 with JSON responses:
+
+    GET /haiku?corpus=walden&prefix_len=2
+        {"corpus": "walden", "prefix_len": 2, "haiku": "..."}
+    GET /corpora
+        {"corpora": [{"corpus": "walden", "prefix_len": 2}, ...]}
+    GET /stats
+        {"haiku": 1234, "rejections": 5678, ...}
+
+/stats gives the counters of haiku.GenerationStats, added up over every
+request since the server started.
+
+/haiku also takes an optional seed, for reproducible output. The corpus and
+prefix_len can be left out if only one chain matches. Errors are reported
+with a 4xx status (or 500, if generating failed) and {"error": "..."}.
+
+This module exports the HaikuServer and Client classes, and load_chains.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import urllib.parse
+
+import haiku
+import markov
+import util
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Content Too Large",
+            422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+# The longest request body read (and ignored); none of the endpoints take one
+_MAX_BODY_BYTES = 1 << 16
+
+# The chains in each worker process, keyed by (corpus, prefix length)
+_worker_chains = None
+
+
+def corpus_name(file_name):
+    """Name a corpus after its file, without the directory or extensions.
+
+    For example, corpus/walden.txt.gz is walden.
+    """
+    return os.path.basename(file_name).split(".")[0]
+
+
+def load_chains(file_names, prefix_lens, jobs=1, punkt=False, cache=None,
+                backoff_min_successors=None, suffix_array=False):
+    """Load the chains a server generates from.
+
+    Args:
+        file_names (list of strings): input text files, each built into a
+            chain for each prefix length, or compiled chain files (ending
+            in .model) and directories saved with --csr or --suffix-array
+            to load as they are
+        prefix_lens (list of ints): prefix lengths to build chains with
+        jobs (int): the number of processes to build each chain with
+        punkt (bool): find sentences with NLTK's Punkt tokenizer
+        cache (chaincache.ChainCache): optional cache of built chains
+        backoff_min_successors (int): if given, build one
+            backoff.BackoffChain for each file, with this min_successors,
+            and serve views of it for each prefix length
+        suffix_array (bool): build one suffixarray.SuffixArrayChain for
+            each file, and serve views of it for each prefix length
+
+    Returns:
+        A dictionary mapping (corpus name, prefix length) to chains
+    """
+    chains = {}
+    for file_name in file_names:
+        name = corpus_name(file_name)
+        if file_name.endswith(".model") or os.path.isdir(file_name):
+            chain = haiku.load_model(file_name)
+            if hasattr(chain, "with_prefix_len"):
+                # a suffix array chain serves every prefix length
+                for prefix_len in prefix_lens:
+                    chains[(name, prefix_len)] = chain.with_prefix_len(
+                        prefix_len)
+            else:
+                chains[(name, chain.prefix_len)] = chain
+            continue
+        if suffix_array:
+            import suffixarray
+            chain = suffixarray.SuffixArrayChain.from_files([file_name])
+            for prefix_len in prefix_lens:
+                chains[(name, prefix_len)] = chain.with_prefix_len(prefix_len)
+            continue
+        if backoff_min_successors is not None:
+            import backoff
+            # one build serves every prefix length
+            chain = backoff.BackoffChain.from_files(
+                [file_name], max(prefix_lens), punkt=punkt,
+                min_successors=backoff_min_successors)
+            for prefix_len in prefix_lens:
+                chains[(name, prefix_len)] = chain.with_prefix_len(prefix_len)
+            continue
+        for prefix_len in prefix_lens:
+            chains[(name, prefix_len)] = markov.MarkovChain.from_files(
+                [file_name], prefix_len, jobs=jobs, punkt=punkt, cache=cache)
+    return chains
+
+
+def _init_worker(chains):
+    global _worker_chains
+    _worker_chains = chains
+    # forked workers start with the same random state
+    random.seed()
+    # generate a haiku from each chain, to fill in the worker's tables
+    for key in chains:
+        _generate(key, None)
+
+
+def _generate(key, seed):
+    """Generate a haiku in a worker process.
+
+    Returns:
+        A (haiku, error message, GenerationStats) tuple, where one of the
+        haiku and error message is None
+    """
+    chain = _worker_chains[key]
+    stats = haiku.GenerationStats()
+    if seed is not None:
+        state = random.getstate()
+        random.seed(seed)
+    try:
+        return haiku.generate_haiku(chain, stats), None, stats
+    except ValueError as e:
+        return None, str(e), stats
+    finally:
+        if seed is not None:
+            random.setstate(state)
+
+
+class HaikuServer:
+    """Serves haiku over HTTP from a dictionary of chains.
+
+    Use it as an asynchronous context manager, which starts the worker pool
+    and listens for connections:
+
+        async with HaikuServer(chains, port=0) as server:
+            client = Client(server.host, server.port)
+            status, response = await client.get("/haiku?corpus=walden")
+    """
+
+    def __init__(self, chains, host="127.0.0.1", port=8080, jobs=None):
+        """Initialize the server.
+
+        Args:
+            chains (dict): maps (corpus name, prefix length) to chains, as
+                returned by load_chains
+            host (string): the address to listen on
+            port (int): the port to listen on; 0 picks a free one
+            jobs (int): the number of worker processes. By default, one per
+                CPU.
+        """
+        if not chains:
+            raise ValueError("No chains to serve")
+        self._chains = chains
+        # the work done for every request, as reported by the workers
+        self.stats = haiku.GenerationStats()
+        self.host = host
+        self.port = port
+        self._jobs = jobs or os.cpu_count() or 1
+        self._pool = None
+        self._server = None
+
+    async def start(self):
+        """Start the worker pool, and start listening for connections."""
+        # build the syllable indexes once, instead of once per worker
+        for chain in self._chains.values():
+            if not chain.syllables_indexed:
+                chain.index_syllables(util.lookup_syllables)
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            self._jobs, initializer=_init_worker, initargs=(self._chains,))
+        # start the workers now, rather than on the first requests; each
+        # one warms up as it starts
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._pool, os.getpid)
+                               for _ in range(self._jobs)])
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Start the server, and handle connections until cancelled."""
+        async with self:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """Stop listening, and shut down the worker pool."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def handle_request(self, method, target):
+        """Handle one request.
+
+        Args:
+            method (string): the HTTP method
+            target (string): the request target, e.g. "/haiku?corpus=walden"
+
+        Returns:
+            A (status, response) pair, where response is a JSON-serializable
+            dictionary
+        """
+        url = urllib.parse.urlsplit(target)
+        if url.path not in ("/haiku", "/corpora", "/stats"):
+            return 404, {"error": "Not found: " + url.path}
+        if method != "GET":
+            return 405, {"error": "Method not allowed: " + method}
+        if url.path == "/corpora":
+            return 200, {"corpora": [
+                {"corpus": name, "prefix_len": prefix_len}
+                for name, prefix_len in sorted(self._chains)]}
+        if url.path == "/stats":
+            return 200, self.stats.as_dict()
+
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            corpus = query.get("corpus", [None])[-1]
+            prefix_len = query.get("prefix_len", [None])[-1]
+            prefix_len = int(prefix_len) if prefix_len is not None else None
+            seed = query.get("seed", [None])[-1]
+            seed = int(seed) if seed is not None else None
+        except ValueError:
+            return 400, {"error": "prefix_len and seed must be integers"}
+        keys = [key for key in self._chains
+                if corpus in (None, key[0]) and prefix_len in (None, key[1])]
+        if not keys:
+            return 404, {"error": "No chain for corpus={} prefix_len={}"
+                         .format(corpus, prefix_len)}
+        if len(keys) > 1:
+            return 400, {"error": "Several chains match; give the corpus "
+                                  "and prefix_len"}
+
+        key = keys[0]
+        loop = asyncio.get_running_loop()
+        text, error, stats = await loop.run_in_executor(self._pool,
+                                                        _generate, key, seed)
+        self.stats.merge(stats)
+        if error is not None:
+            return 422, {"error": error}
+        return 200, {"corpus": key[0], "prefix_len": key[1], "haiku": text}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await _read_head(reader)
+                if request is None:
+                    break
+                start_line, headers = request
+                try:
+                    method, target, version = start_line.split()
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError("Negative Content-Length")
+                except ValueError:
+                    await _write_response(writer, 400,
+                                          {"error": "Malformed request"},
+                                          False)
+                    break
+                if length > _MAX_BODY_BYTES:
+                    await _write_response(writer, 413,
+                                          {"error": "Request body too large"},
+                                          False)
+                    break
+                # requests don't need a body, so skip it
+                await reader.readexactly(length)
+                try:
+                    status, response = await self.handle_request(method,
+                                                                 target)
+                except Exception:
+                    # such as a worker process dying
+                    await _write_response(writer, 500,
+                                          {"error": "Internal server error"},
+                                          False)
+                    break
+                keep_alive = (headers.get("connection", "").lower() !=
+                              "close" and version == "HTTP/1.1")
+                await _write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _read_head(reader):
+    """Read the start line and headers of an HTTP message.
+
+    Returns:
+        A (start line, {lowercase header name: value}) pair, or None at the
+        end of the stream
+    """
+    start_line = await reader.readline()
+    if not start_line.strip():
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return start_line.decode("latin-1").strip(), headers
+
+
+async def _write_response(writer, status, response, keep_alive):
+    body = json.dumps(response).encode("utf-8")
+    head = ("HTTP/1.1 {} {}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            "Content-Length: {}\r\n"
+            "Connection: {}\r\n\r\n").format(
+                status, _REASONS[status], len(body),
+                "keep-alive" if keep_alive else "close")
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+
+class Client:
+    """A minimal HTTP client for the haiku server, over one connection.
+
+    It's meant for tests and benchmarks, which make lots of requests from
+    the same process as the server.
+    """
+
+    def __init__(self, host, port):
+        self._host = host
+        self._port = port
+        self._reader = None
+        self._writer = None
+
+    async def get(self, target):
+        """Make a GET request.
+
+        Returns:
+            A (status, decoded JSON response) pair
+        """
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self._host, self._port)
+        self._writer.write("GET {} HTTP/1.1\r\nHost: {}\r\n\r\n".format(
+            target, self._host).encode("latin-1"))
+        await self._writer.drain()
+        start_line, headers = await _read_head(self._reader)
+        body = await self._reader.readexactly(
+            int(headers["content-length"]))
+        if headers.get("connection") == "close":
+            await self.close()
+        return int(start_line.split()[1]), json.loads(body)
+
+    async def close(self):
+        """Close the connection."""
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
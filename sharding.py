@@ -0,0 +1,310 @@
+"""Building a Markov chain in several processes at once.
+
+The input is split into shards: whole files, with large uncompressed files
+split further into byte ranges at whitespace. The shards are processed in a
+pool of worker processes, in two passes:
+
+1. Each worker lists the distinct words in a shard, and the lists are
+   combined, in order, into the vocabulary of the finished chain.
+2. Each worker splits a shard into sentences and counts its successors,
+   using the finished chain's word ids, so the partial tables can be added
+   to the chain without translating every prefix.
+
+Shards of the same file depend on each other in two ways:
+
+- The first words of a shard follow the last words of the one before it.
+  Each worker reads the prefix_len words before its range, and counts the
+  successors of the words at the start of its range itself.
+- Whether the words at the start of a shard begin a sentence depends on
+  the text before them. The built-in sentence rules only look at the word
+  before a boundary, so the words read before the range settle it. Punkt
+  needs the whole sentence, so with it, each worker reports the words
+  before its first sentence boundary and after its last one, and the merge
+  splits the joined pieces into sentences, just as the serial builder does
+  at the edges of the chunks it reads.
+
+The result is equal to the chain MarkovChain.from_files builds, although
+words that only appear at sentence starts might get different ids.
+
+This module exports the build_chain function.
+"""
+import codecs
+import locale
+import marshal
+import multiprocessing
+import os
+
+import markov
+
+# Smallest byte range a file is split into
+_MIN_SHARD_SIZE = 1 << 16
+# Shards per process, so one slow shard doesn't hold up the others
+_SHARDS_PER_JOB = 4
+_WHITESPACE = b" \t\n\r\x0b\x0c"
+
+# The vocabulary counts are built with, in each worker process
+_worker_vocab = None
+
+
+def build_chain(cls, file_names, prefix_len, jobs, shard_size=None,
+                punkt=False):
+    """Build a Markov chain from a list of files, in a pool of processes.
+
+    Args:
+        cls (type): the MarkovChain class to build
+        file_names (list of strings): files to read input text from
+        prefix_len (int): the prefix length of the Markov chain
+        jobs (int): the number of worker processes
+        shard_size (int): the largest byte range to split files into. By
+            default, the input is split into a few shards per process.
+        punkt (bool): find sentences with NLTK's Punkt tokenizer
+
+    Returns:
+        A chain of class cls, equal to
+        cls.from_files(file_names, prefix_len, punkt=punkt)
+    """
+    if shard_size is None:
+        total = sum(os.path.getsize(file_name) for file_name in file_names)
+        shard_size = max(_MIN_SHARD_SIZE, total // (jobs * _SHARDS_PER_JOB))
+    shards = [(file_name, start, end, prefix_len, punkt)
+              for file_name in file_names
+              for start, end in _byte_ranges(file_name, shard_size)]
+
+    vocab = markov.Vocabulary()
+    with multiprocessing.Pool(jobs) as pool:
+        for words in pool.imap(_shard_words, shards):
+            for word in words:
+                vocab.add(word)
+
+    chain = cls(prefix_len, vocab)
+    n_words = len(vocab)
+    builder = None
+    with multiprocessing.Pool(jobs, initializer=_init_worker,
+                              initargs=(vocab,)) as pool:
+        results = pool.imap(_build_shard, shards)
+        for (_, start, _, _, _), result in zip(shards, results):
+            if punkt and start == 0:
+                # a new file
+                if builder is not None:
+                    builder.close()
+                builder = markov._PunktBuilder(chain)
+            _merge_shard(builder, chain, n_words, *result)
+    if builder is not None:
+        builder.close()
+    return chain
+
+
+def _merge_shard(builder, chain, n_words, counts, new_entries, new_words,
+                 head, pending):
+    """Add a shard to the chain being built from its file.
+
+    Args:
+        builder (markov._PunktBuilder): the builder for the shard's file,
+            holding the words of the sentence that might continue into this
+            shard, or None if the shard isn't split with Punkt
+        chain (markov.MarkovChain): the chain being built
+        n_words (int): the size of the vocabulary the shard was built with
+        counts (bytes): the shard's successor counts, as marshalled
+            arguments to MarkovChain._merge_counts, which are much quicker
+            to pass between processes than the chain's tables
+        new_entries (dict): the successor entries that involve new_words
+        new_words (list of strings): words that weren't in the chain's
+            vocabulary when the shard was built
+        head (list of strings): with Punkt, the words before the shard's
+            first sentence boundary, or None if it has none
+        pending (list of strings): with Punkt, the words after its last
+            sentence boundary
+    """
+    chain._merge_counts(*marshal.loads(counts))
+    if new_entries:
+        word_ids = list(range(n_words))
+        word_ids.extend(chain.vocab.add(word) for word in new_words)
+        chain._merge_entries(new_entries.items(), word_ids)
+    if builder is None:
+        return
+    if head is None:
+        # the whole shard might be in the middle of a sentence
+        builder._add_sentences(pending)
+    else:
+        builder._add_sentences(head, complete=True)
+        builder._pending = pending
+
+
+def _byte_ranges(file_name, shard_size):
+    """Split a file into byte ranges of about shard_size bytes.
+
+    Each range after the first starts with a whitespace byte, so no word is
+    split between two ranges. Compressed files can't be split.
+
+    Returns:
+        A list of (start, end) pairs. The end of the last range is None.
+    """
+    size = os.path.getsize(file_name)
+    if file_name.endswith((".gz", ".bz2")) or size <= shard_size:
+        return [(0, None)]
+    starts = [0]
+    with open(file_name, "rb") as f:
+        position = shard_size
+        while position < size:
+            f.seek(position)
+            while True:
+                block = f.read(4096)
+                if not block:
+                    break
+                offsets = [block.find(c) for c in _WHITESPACE]
+                offsets = [offset for offset in offsets if offset >= 0]
+                if offsets:
+                    position += min(offsets)
+                    break
+                position += len(block)
+            if position >= size:
+                break
+            starts.append(position)
+            position += shard_size
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def _init_worker(vocab):
+    global _worker_vocab
+    _worker_vocab = vocab
+
+
+def _shard_words(shard):
+    """List the distinct words in a shard, in the order they first appear."""
+    file_name, start, end, _, _ = shard
+    words = {}
+    for chunk in _read_shard(file_name, start, end):
+        words.update(dict.fromkeys(chunk))
+    return list(words)
+
+
+def _build_shard(shard):
+    """Count the successors in one shard of a file.
+
+    Returns:
+        The arguments to _merge_shard after n_words
+    """
+    file_name, start, end, prefix_len, punkt = shard
+    vocab = _worker_vocab.copy()
+    n_words = len(vocab)
+    chain = markov.MarkovChain(prefix_len, vocab)
+    before = []
+    if start > 0:
+        with open(file_name, "rb") as f:
+            before = _words_before(f, start, prefix_len,
+                                   locale.getpreferredencoding(False))
+    if punkt:
+        builder = _ShardBuilder(chain,
+                                tuple(vocab.get_id(word) for word in before))
+    else:
+        builder = markov._ChainBuilder(chain)
+        builder.skip(before)
+    for words in _read_shard(file_name, start, end):
+        builder.feed(words)
+
+    singles = {}
+    tables = {}
+    new_entries = {}
+    for prefix, entry in chain._chain.items():
+        # Punkt can split up words between sentences, so the sentence
+        # starts might have words that aren't in the vocabulary
+        if len(prefix) < prefix_len and _has_new_word(prefix, entry,
+                                                      n_words):
+            new_entries[prefix] = entry
+        elif type(entry) is int:
+            singles[prefix] = entry
+        else:
+            tables[prefix] = entry.counts
+    if punkt:
+        head, pending = builder.head, builder._pending
+    else:
+        head, pending = None, []
+    return (marshal.dumps((singles, tables)), new_entries,
+            vocab._words[n_words:], head, pending)
+
+
+def _has_new_word(prefix, entry, n_words):
+    """Check whether a successor entry involves a word id >= n_words."""
+    if any(word_id >= n_words for word_id in prefix):
+        return True
+    if type(entry) is int:
+        return entry >= n_words
+    return max(entry.counts) >= n_words
+
+
+def _read_shard(file_name, start, end):
+    """Read the words in a shard, a chunk at a time.
+
+    Yields:
+        Lists of words, as markov._read_words does
+    """
+    if start == 0 and end is None:
+        # the whole file, which might be compressed
+        with markov._open_text(file_name) as f:
+            yield from markov._read_words(f)
+        return
+    with open(file_name, "rb") as f:
+        reader = _RangeReader(f, start, end,
+                              locale.getpreferredencoding(False))
+        yield from markov._read_words(reader)
+
+
+def _words_before(f, start, count, encoding):
+    """Read the last count words of a binary file before offset start."""
+    size = 256
+    while True:
+        begin = max(0, start - size)
+        f.seek(begin)
+        words = f.read(start - begin).decode(encoding, "replace").split()
+        if begin > 0:
+            # the first word might have started earlier
+            words = words[1:]
+        if len(words) >= count or begin == 0:
+            return words[-count:]
+        size *= 4
+
+
+class _RangeReader:
+    """Reads the text in a byte range of a binary file, like a text file."""
+
+    def __init__(self, f, start, end, encoding):
+        f.seek(start)
+        self._f = f
+        self._left = end - start if end is not None else None
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+
+    def read(self, size):
+        """Read up to size bytes, and return them as text.
+
+        Returns an empty string at the end of the range.
+        """
+        while True:
+            if self._left is not None:
+                size = min(size, self._left)
+            data = self._f.read(size)
+            if self._left is not None:
+                self._left -= len(data)
+            text = self._decoder.decode(data, final=not data)
+            # the decoder holds on to a character split between two reads
+            if text or not data:
+                return text
+
+
+class _ShardBuilder(markov._PunktBuilder):
+    """Builds the chain for one shard of a file, using Punkt.
+
+    The shard's first sentence might start in an earlier shard, so its words
+    are kept in head rather than added as a sentence start, and the words
+    of its last sentence are left pending.
+    """
+
+    def __init__(self, chain, prefix):
+        super().__init__(chain)
+        self._prefix = prefix
+        self.head = None
+
+    def _add_sentence_start(self, sentence):
+        if self.head is None:
+            self.head = sentence.split()
+        else:
+            self._chain._add_chain_start(sentence)
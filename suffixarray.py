@@ -0,0 +1,498 @@
+"""A Markov chain backed by a suffix array, for any prefix length.
+
+A SuffixArrayChain stores the text itself, as an array of word ids, with
+a separator after each input file, and a suffix array: the position of
+every word, sorted by the text that starts there. The positions where a
+prefix occurs are then a contiguous range of the suffix array, found by
+binary search, and the word after each of them is a successor. Since that
+works for a prefix of any length, one index serves every prefix length:
+with_prefix_len gives a view of it that generates like a MarkovChain built
+with that prefix length.
+
+Drawing a position from the range uniformly picks each successor in
+proportion to its count, without counting anything. Counts are only worked
+out when they're asked for (by successors, or when drawing words with few
+enough syllables keeps failing), with NumPy, and the last few thousand are
+kept.
+
+The starts of sentences are kept separately, sorted the same way, along
+with how many of each sentence's words count as a start; with prefix
+length L, a prefix shorter than L is always looked up among them, as in a
+MarkovChain. Finding sentences with Punkt isn't supported, since it can
+split a sentence in the middle of a word.
+
+The index is saved as a directory of .npy files, which load memory-maps,
+so processes generating from the same index share it through the page
+cache. Building one needs NumPy, and so does loading one.
+
+This module exports the SuffixArrayChain class, and the save and load
+functions.
+"""
+import bisect
+import collections
+import copy
+import json
+import os
+import random
+from array import array
+
+import numpy as np
+
+import chainfile
+import markov
+
+FORMAT = "haiku-suffix-array"
+VERSION = 1
+
+# Marks the end of each input file in the text. It's larger than any word
+# id, so suffixes that end there sort after the others with the same start.
+_SEPARATOR = 0xFFFFFFFF
+# Draws that may be rejected before _sample_next counts the successors
+_SAMPLE_TRIES = 8
+# How many successor counts are kept
+_CACHED_COUNTS = 4096
+# Ranges of the suffix array up to this long are counted without NumPy
+_SMALL_RANGE = 32
+
+_ARRAYS = ("tokens", "suffixes", "starts", "start_limits", "word_offsets",
+           "word_bytes", "word_flags")
+
+
+class _StartRecorder:
+    """Collects the word ids of a file, and where its sentences start.
+
+    It stands in for a chain with prefix length 1 for _ChainBuilder, which
+    then reports just the first word of each sentence with _add_start.
+    """
+
+    prefix_len = 1
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+        self.tokens = array("I")
+        self.starts = array("I")
+
+    def _add(self, prefix, word_id):
+        self.tokens.append(word_id)
+
+    def _add_start(self, prefix, word_id):
+        self.starts.append(len(self.tokens) - 1)
+
+
+def _suffix_array(tokens):
+    """Sort the positions in tokens by the suffix starting there.
+
+    This is prefix doubling: after each pass, the positions are sorted by
+    twice as many tokens as before, until every suffix has a different
+    rank.
+    """
+    n = len(tokens)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    rank = tokens.astype(np.int64)
+    order = np.argsort(rank, kind="stable")
+    length = 1
+    while True:
+        following = np.full(n, -1, dtype=np.int64)
+        following[:n - length] = rank[length:]
+        order = np.lexsort((following, rank))
+        first = rank[order]
+        second = following[order]
+        new_group = np.empty(n, dtype=np.int64)
+        new_group[0] = 0
+        new_group[1:] = (first[1:] != first[:-1]) | (second[1:] !=
+                                                     second[:-1])
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.cumsum(new_group)
+        if rank[order[-1]] == n - 1:
+            return order
+        length *= 2
+
+
+class SuffixArrayChain(markov.BaseChain):
+    """A read-only Markov chain that finds successors in a suffix array.
+
+    Build one with from_string or from_files, or load one saved with save.
+    Pickling a loaded chain just records its directory, and unpickling
+    memory-maps the files again.
+    """
+
+    directory = None
+
+    def __init__(self, prefix_len, arrays, indexed=False):
+        """Initialize from arrays.
+
+        Args:
+            prefix_len (int): the prefix length to generate with
+            arrays (dict): maps the names in _ARRAYS (and word_syllables, if
+                indexed) to NumPy arrays
+            indexed (bool): whether arrays has the syllable counts
+        """
+        if prefix_len < 1:
+            raise ValueError('Prefix length must be at least one')
+        self._prefix_len = prefix_len
+        self._arrays = arrays
+        self._tokens = arrays["tokens"]
+        self._suffixes = arrays["suffixes"]
+        self._starts = arrays["starts"]
+        self._start_limits = arrays["start_limits"]
+        # memoryviews are much faster than NumPy for single elements
+        self._token_view = memoryview(self._tokens)
+        self._suffix_view = memoryview(self._suffixes)
+        self._start_view = memoryview(self._starts)
+        self._limit_view = memoryview(self._start_limits)
+        self._vocab = chainfile._CompiledVocabulary(arrays["word_offsets"],
+                                                    arrays["word_bytes"])
+        self.syllables_indexed = indexed
+        if indexed:
+            self._word_syllables = memoryview(arrays["word_syllables"])
+        # (prefix, whether it's a sentence start) -> {word id: count}
+        self._counts = collections.OrderedDict()
+
+    def __reduce__(self):
+        if self.directory is None:
+            return (SuffixArrayChain, (self._prefix_len, self._arrays,
+                                       self.syllables_indexed))
+        return (load, (self.directory, self._prefix_len))
+
+    @property
+    def nbytes(self):
+        """The total size of the chain's arrays, in bytes."""
+        return sum(values.nbytes for values in self._arrays.values())
+
+    def with_prefix_len(self, prefix_len):
+        """Get a view of the chain that generates with another prefix length.
+
+        The view shares the index with this chain, so it's cheap to make.
+
+        Returns:
+            A SuffixArrayChain
+        """
+        if prefix_len < 1:
+            raise ValueError('Prefix length must be at least one')
+        view = copy.copy(self)
+        view._prefix_len = prefix_len
+        return view
+
+    @classmethod
+    def from_string(cls, text, prefix_len=2):
+        """Build a chain from a string, as MarkovChain.from_string does.
+
+        Returns:
+            A SuffixArrayChain
+        """
+        return cls._build([text.split()], prefix_len)
+
+    @classmethod
+    def from_files(cls, file_names, prefix_len=2, punkt=False):
+        """Build a chain from a list of files, as MarkovChain.from_files does.
+
+        Args:
+            file_names (list of strings): files to read input text from
+            prefix_len (int): the prefix length to generate with; any other
+                can be used later, with with_prefix_len
+            punkt (bool): not supported
+        Returns:
+            A SuffixArrayChain
+        Raises:
+            ValueError if punkt is set
+        """
+        if punkt:
+            raise ValueError("A suffix array chain can't find sentences "
+                             "with Punkt")
+
+        def read(file_name):
+            with markov._open_text(file_name) as f:
+                for words in markov._read_words(f):
+                    yield from words
+
+        return cls._build(map(read, file_names), prefix_len)
+
+    @classmethod
+    def _build(cls, texts, prefix_len):
+        """Build a chain from an iterable of texts, each an iterable of
+        words."""
+        vocab = markov.Vocabulary()
+        tokens = array("I")
+        starts = array("I")
+        start_limits = array("I")
+        for words in texts:
+            recorder = _StartRecorder(vocab)
+            builder = markov._ChainBuilder(recorder)
+            builder.feed(words)
+            builder.close()
+            begin = len(tokens)
+            end = begin + len(recorder.tokens)
+            if end == begin:
+                continue
+            tokens.extend(recorder.tokens)
+            tokens.append(_SEPARATOR)
+            # a file's first words start its first sentence, and every one
+            # of them counts, while a later sentence's start ends where the
+            # next sentence starts
+            starts.append(begin)
+            start_limits.append(end - begin)
+            sentence_starts = [begin + start for start in recorder.starts]
+            for start, following in zip(sentence_starts,
+                                        sentence_starts[1:] + [end]):
+                starts.append(start)
+                start_limits.append(following - start)
+        return cls._from_arrays(prefix_len, vocab, tokens, starts,
+                                start_limits)
+
+    @classmethod
+    def _from_arrays(cls, prefix_len, vocab, tokens, starts, start_limits):
+        """Sort the suffixes and the starts, and build the chain."""
+        tokens = np.frombuffer(tokens, dtype=np.uint32)
+        order = _suffix_array(tokens)
+        # nothing is looked up starting from a separator
+        suffixes = order[tokens[order] != _SEPARATOR].astype(np.uint32)
+        # sort the starts into the same order as their suffixes
+        suffix_rank = np.empty(len(tokens), dtype=np.int64)
+        suffix_rank[order] = np.arange(len(tokens))
+        starts = np.frombuffer(starts, dtype=np.uint32)
+        start_order = np.argsort(suffix_rank[starts], kind="stable")
+
+        encoded = [word.encode("utf-8") for word in vocab._words]
+        word_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in encoded], out=word_offsets[1:])
+        arrays = {
+            "tokens": tokens,
+            "suffixes": suffixes,
+            "starts": starts[start_order],
+            "start_limits": np.frombuffer(start_limits, dtype=np.uint32)[
+                start_order],
+            "word_offsets": word_offsets,
+            "word_bytes": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "word_flags": np.array([markov.word_flags(word)
+                                    for word in vocab._words],
+                                   dtype=np.uint8),
+        }
+        return cls(prefix_len, arrays)
+
+    def index_syllables(self, syllables):
+        """Look up the number of syllables in every word.
+
+        Afterwards, next_word can be asked for a word with at most some
+        number of syllables, as for a MarkovChain.
+
+        Args:
+            syllables: a function that returns the number of syllables in
+                a word, or None if it isn't known.
+        """
+        word_syllables = np.empty(len(self._vocab), dtype=np.uint8)
+        for word_id in range(len(word_syllables)):
+            count = syllables(self._vocab.word(word_id))
+            if count is None or count >= markov.UNKNOWN_SYLLABLES:
+                count = markov.UNKNOWN_SYLLABLES
+            word_syllables[word_id] = count
+        arrays = dict(self._arrays, word_syllables=word_syllables)
+        version = self.version
+        self.__init__(self._prefix_len, arrays, indexed=True)
+        self.directory = None
+        # the syllable counts may have changed
+        self.version = version + 1
+
+    def syllable_count(self, word_id):
+        """Return the number of syllables in a word, or None if unknown."""
+        if not self.syllables_indexed:
+            return None
+        count = self._word_syllables[word_id]
+        return None if count == markov.UNKNOWN_SYLLABLES else count
+
+    def ends_sentence(self, word_id):
+        """Return whether a word ends with sentence-final punctuation."""
+        return bool(self._arrays["word_flags"][word_id] &
+                    markov.WORD_ENDS_SENTENCE)
+
+    def _range(self, positions, prefix):
+        """Find the range of positions (a view of suffixes or starts) where
+        the text starts with prefix."""
+        tokens = self._token_view
+        lo = 0
+        hi = len(positions)
+        for offset, word_id in enumerate(prefix):
+            if word_id == markov.UNKNOWN_WORD:
+                return 0, 0
+            # the positions from lo to hi all start with the words before
+            # this one, so they're sorted by this one
+
+            def key(position):
+                return tokens[position + offset]
+
+            lo = bisect.bisect_left(positions, word_id, lo, hi, key=key)
+            hi = bisect.bisect_right(positions, word_id, lo, hi, key=key)
+            if lo == hi:
+                break
+        return lo, hi
+
+    def _find(self, prefix):
+        """Find where a prefix's successors are.
+
+        Returns:
+            (positions, lo, hi, is_start): the successors are the words
+            len(prefix) after positions[lo:hi], and if is_start, only the
+            ones within the starts' limits
+        """
+        if len(prefix) < self._prefix_len:
+            lo, hi = self._range(self._start_view, prefix)
+            return self._start_view, lo, hi, True
+        tokens = self._token_view
+        length = len(prefix)
+        lo, hi = self._range(self._suffix_view, prefix)
+        # leave out the occurrences at the ends of files
+        hi = bisect.bisect_left(self._suffix_view, _SEPARATOR, lo, hi,
+                                key=lambda position: tokens[position + length])
+        return self._suffix_view, lo, hi, False
+
+    def _successor_counts(self, prefix):
+        """Return a {word id: count} dictionary of a prefix's successors.
+
+        The dictionary is shared; don't change it.
+        """
+        key = (prefix, len(prefix) < self._prefix_len)
+        counts = self._counts.get(key)
+        if counts is not None:
+            self._counts.move_to_end(key)
+            return counts
+        positions, lo, hi, is_start = self._find(prefix)
+        counts = self._count_range(positions, lo, hi, is_start, len(prefix))
+        self._counts[key] = counts
+        if len(self._counts) > _CACHED_COUNTS:
+            self._counts.popitem(last=False)
+        return counts
+
+    def _count_range(self, positions, lo, hi, is_start, length):
+        """Count the successors in a range found by _find."""
+        if hi - lo <= _SMALL_RANGE:
+            # NumPy costs more than it saves for a few words
+            tokens = self._token_view
+            limits = self._limit_view
+            return dict(collections.Counter(
+                tokens[positions[index] + length] for index in range(lo, hi)
+                if not is_start or limits[index] > length))
+        if is_start:
+            starts = self._starts[lo:hi].astype(np.int64)
+            starts = starts[self._start_limits[lo:hi] > length]
+            words = self._tokens[starts + length]
+        else:
+            words = self._tokens[self._suffixes[lo:hi].astype(np.int64) +
+                                 length]
+        ids, totals = np.unique(words, return_counts=True)
+        return dict(zip(ids.tolist(), totals.tolist()))
+
+    def successors(self, prefix):
+        """Return a {word id: count} dictionary of the successors of a
+        prefix (a tuple of word ids)."""
+        return dict(self._successor_counts(tuple(prefix)))
+
+    def _sample_next(self, prefix, max_syllables=None):
+        if max_syllables is not None and not self.syllables_indexed:
+            raise ValueError("The chain has no syllable index")
+        positions, lo, hi, is_start = self._find(prefix)
+        if lo == hi:
+            return None
+        tokens = self._token_view
+        limits = self._limit_view
+        length = len(prefix)
+        for _ in range(_SAMPLE_TRIES):
+            index = lo + int(random.random() * (hi - lo))
+            if is_start and limits[index] <= length:
+                continue
+            word_id = tokens[positions[index] + length]
+            if (max_syllables is None or
+                    self._word_syllables[word_id] <= max_syllables):
+                return word_id
+        # most of the occurrences don't qualify, so count the ones that do
+        candidates = [(word_id, count) for word_id, count
+                      in self._successor_counts(prefix).items()
+                      if max_syllables is None or
+                      self._word_syllables[word_id] <= max_syllables]
+        if not candidates:
+            return None
+        target = random.randrange(sum(count for _, count in candidates))
+        for word_id, count in candidates:
+            target -= count
+            if target < 0:
+                return word_id
+
+    def _successor_items(self):
+        """Iterate over the prefixes a MarkovChain with this prefix length
+        would have, and their successor counts."""
+        prefix_len = self._prefix_len
+        tokens = self._tokens
+        # the starts, with every prefix shorter than prefix_len
+        start_counts = collections.defaultdict(collections.Counter)
+        starts = self._starts.astype(np.int64)
+        limits = self._start_limits
+        for length in range(prefix_len):
+            valid = starts[limits > length]
+            rows = np.stack([tokens[valid + i]
+                             for i in range(length + 1)], axis=1).tolist()
+            for row in rows:
+                start_counts[tuple(row[:-1])][row[-1]] += 1
+        for prefix, counts in start_counts.items():
+            yield prefix, dict(counts)
+
+        # padding the text means every suffix has prefix_len + 1 words
+        padded = np.concatenate([tokens, np.full(prefix_len + 1, _SEPARATOR,
+                                                 dtype=np.uint32)])
+        suffixes = self._suffixes.astype(np.int64)
+        rows = np.stack([padded[suffixes + i]
+                         for i in range(prefix_len + 1)], axis=1)
+        rows = rows[np.all(rows != _SEPARATOR, axis=1)]
+        # the rows are sorted, so each prefix's are together
+        new_prefix = np.ones(len(rows), dtype=bool)
+        new_prefix[1:] = np.any(rows[1:, :-1] != rows[:-1, :-1], axis=1)
+        bounds = np.append(np.flatnonzero(new_prefix), len(rows)).tolist()
+        rows = rows.tolist()
+        for lo, hi in zip(bounds, bounds[1:]):
+            yield (tuple(rows[lo][:-1]),
+                   dict(collections.Counter(row[-1] for row in rows[lo:hi])))
+
+
+def save(chain, directory):
+    """Save a SuffixArrayChain's arrays as .npy files in a directory.
+
+    Args:
+        chain (SuffixArrayChain): the chain to save
+        directory (string): where to save it; created if necessary
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, values in chain._arrays.items():
+        np.save(os.path.join(directory, name + ".npy"), values)
+    with open(os.path.join(directory, "chain.json"), "w") as f:
+        json.dump({"format": FORMAT, "version": VERSION,
+                   "syllables_indexed": chain.syllables_indexed}, f)
+
+
+def load(directory, prefix_len=2):
+    """Memory-map a chain saved with save.
+
+    Args:
+        directory (string): where the chain was saved
+        prefix_len (int): the prefix length to generate with
+    Returns:
+        A SuffixArrayChain
+    Raises:
+        ValueError if the directory doesn't hold a chain saved by a
+            compatible version of this module
+    """
+    try:
+        with open(os.path.join(directory, "chain.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise ValueError("Not a suffix array chain directory: " + directory)
+    if meta.get("format") != FORMAT:
+        raise ValueError("Not a suffix array chain directory: " + directory)
+    if meta.get("version") != VERSION:
+        raise ValueError("Unsupported suffix array chain version {}".format(
+            meta.get("version")))
+    names = _ARRAYS + (("word_syllables",) if meta["syllables_indexed"]
+                       else ())
+    arrays = {name: np.load(os.path.join(directory, name + ".npy"),
+                            mmap_mode="r")
+              for name in names}
+    chain = SuffixArrayChain(prefix_len, arrays, meta["syllables_indexed"])
+    chain.directory = directory
+    return chain
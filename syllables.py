@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Syllable counts for the words in the CMU pronouncing dictionary.
+
+The haiku generator only ever needs to know whether a word is in the
+dictionary and how many syllables it has, so instead of loading NLTK's
+copy of the dictionary (every pronunciation of every word) at startup,
+the counts are precomputed into syllables.txt. The table is read the
+first time it's needed.
+
+The file lists the words with each syllable count under a ``[count]``
+header, one word per line.
+To regenerate it after updating the NLTK cmudict corpus, run:
+
+    python3 syllables.py
+
+For words that aren't in the dictionary, estimate guesses the count from
+the spelling.
+"""
+import functools
+import os
+import re
+
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "syllables.txt")
+
+_table = None
+
+
+def get_table():
+    """Get the dictionary mapping each word to its number of syllables.
+
+    Words are lowercase, as in the CMU dictionary.
+    """
+    global _table
+    if _table is None:
+        _table = _read_table(TABLE_FILE)
+    return _table
+
+
+def _read_table(file_name):
+    table = {}
+    with open(file_name, encoding="utf-8") as f:
+        text = f.read()
+    # anything before the first header is comments
+    for section in text.split("\n[")[1:]:
+        count, words = section.split("]", 1)
+        table.update(dict.fromkeys(words.split(), int(count)))
+    return table
+
+
+def _is_vowel(phone):
+    """Check whether a phoneme from the CMU dictionary represents a vowel."""
+    return any(c.isdigit() for c in phone)
+
+
+def count_syllables(phones):
+    """Count the syllables in a pronunciation from the CMU dictionary.
+
+    Each syllable corresponds to one vowel phoneme.
+    """
+    return len([phone for phone in phones if _is_vowel(phone)])
+
+
+# Runs of vowels, each usually one syllable. A y is a vowel unless it
+# starts the word or comes before another vowel.
+_VOWEL_GROUPS = re.compile(r"[aeiou]+y?|(?<!^)y(?![aeiou])")
+# Vowel pairs that are usually two syllables, as in "lion", "video",
+# "dual", "terrier" or "going", but not in "special", "vision", "nation"
+# or "quote"; and the extra syllables in "-ism" and "Mc-"
+_SPLIT_VOWELS = re.compile(r"(?<![cst])i[aou]|(?<![gq])u[ao]|eo(?!u)|"
+                           r"(?<=[^aeiou][^aeiou])ier|[aeou]ing$|ism$|^mc")
+# Endings whose vowel is silent: "make", "makes", "jumped", "vague"
+_SILENT_ENDING = re.compile(r"[^aeiouy]e$|[^aeiouycghsxz]es$|[^cs]hes$|"
+                            r"[^aeiouydt]ed$|[gq]ue$")
+# Silent endings that add a syllable after all: "table", "tables"
+_SYLLABIC_ENDING = re.compile(r"[^aeiouy]l(e|es|ed)$|[^aeiouy]re$")
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def estimate(word):
+    """Guess the number of syllables in a word from its spelling.
+
+    This counts the runs of vowels, with a few rules for silent and split
+    vowels; it gets more than nine in ten of the words in the dictionary
+    right.
+
+    Args:
+        word (string): a lowercase word. Anything but letters is ignored.
+    Returns:
+        The estimate, at least one, or None if the word has no letters
+    """
+    word = "".join(c for c in word if c.isalpha())
+    if not word:
+        return None
+    count = len(_VOWEL_GROUPS.findall(word))
+    count += len(_SPLIT_VOWELS.findall(word))
+    if _SILENT_ENDING.search(word) and not _SYLLABIC_ENDING.search(word):
+        count -= 1
+    return max(count, 1)
+
+
+def write_table(file_name=TABLE_FILE):
+    """Regenerate the syllable table from NLTK's CMU dictionary.
+
+    Some words have multiple pronunciations, so just use the first one.
+    """
+    from nltk.corpus import cmudict
+
+    words_by_count = {}
+    for word, pronunciations in cmudict.dict().items():
+        count = count_syllables(pronunciations[0])
+        words_by_count.setdefault(count, []).append(word)
+
+    with open(file_name, "w", encoding="utf-8") as f:
+        f.write("# Syllable counts from the CMU pronouncing dictionary.\n"
+                "# Generated by syllables.py, don't edit by hand.\n")
+        for count in sorted(words_by_count):
+            f.write("[{}]\n".format(count))
+            for word in sorted(words_by_count[count]):
+                f.write(word + "\n")
+
+
+if __name__ == '__main__':
+    write_table()
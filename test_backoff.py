@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import backoff
+import haiku
+import markov
+
+
+class BackoffChainTests(unittest.TestCase):
+
+    files = ["test_inputs/test0.txt", "test_inputs/test1.txt",
+             "test_inputs/test2.txt", "test_inputs/test3.txt",
+             "corpus/tender_buttons.txt"]
+
+    def _successors(self, chain, words):
+        prefix = tuple(chain.vocab.get_id(word) for word in words)
+        counts = chain.successors(prefix)
+        return {chain.vocab.word(word_id): count
+                for word_id, count in counts.items()}
+
+    def test_same_as_markov_chain(self):
+        for punkt in (False, True):
+            chain = backoff.BackoffChain.from_files(self.files, 3,
+                                                    punkt=punkt)
+            for prefix_len in (1, 2, 3):
+                expected = markov.MarkovChain.from_files(
+                    self.files, prefix_len, punkt=punkt)
+                view = chain.with_prefix_len(prefix_len)
+                self.assertEqual(prefix_len, view.prefix_len)
+                for prefix, counts in expected.items():
+                    words = [expected.vocab.word(word_id)
+                             for word_id in prefix]
+                    self.assertEqual(
+                        {expected.vocab.word(word_id): count
+                         for word_id, count in counts.items()},
+                        self._successors(view, words))
+                # the contexts that are stored are the same, too
+                expected_dict = expected.to_dict()
+                for prefix, successors in view.to_dict().items():
+                    self.assertEqual(sorted(expected_dict[prefix]),
+                                     sorted(successors))
+
+    def test_sentence_starts(self):
+        chain = backoff.BackoffChain.from_string(
+            "I am a cat! You are a rat. I am a bat.", 2)
+        self.assertEqual({"I": 2, "You": 1}, self._successors(chain, []))
+        self.assertEqual({"am": 2}, self._successors(chain, ["I"]))
+        # "a" was seen after "are", and the sentence starts don't count
+        # twice in the shorter contexts
+        self.assertEqual({"cat!": 1, "rat.": 1, "bat.": 1},
+                         self._successors(chain.with_prefix_len(1), ["a"]))
+
+    def test_back_off_at_dead_end(self):
+        chain = backoff.BackoffChain.from_string("one two three four.", 2)
+        markov_chain = markov.MarkovChain.from_string("one two three four.")
+        self.assertEqual("", markov_chain.next_word("three four."))
+        # no successor of "three four." or "four.", so use every word
+        self.assertEqual({"one": 1, "two": 1, "three": 1, "four.": 1},
+                         self._successors(chain, ["three", "four."]))
+        self.assertEqual(20, len(chain.generate(20).split()))
+
+    def test_min_successors(self):
+        text = "We saw the cat sat. They saw the dog ran. The cat ran."
+        chain = backoff.BackoffChain.from_string(text, 2)
+        self.assertEqual({"sat.": 1},
+                         self._successors(chain, ["the", "cat"]))
+        chain = chain.with_prefix_len(2, min_successors=2)
+        self.assertEqual({"sat.": 1, "ran.": 1},
+                         self._successors(chain, ["the", "cat"]))
+        # "saw the" has two successors, so it's used
+        self.assertEqual({"cat": 1, "dog": 1},
+                         self._successors(chain, ["saw", "the"]))
+
+    def test_unknown_word(self):
+        chain = backoff.BackoffChain.from_string("I am a cat!", 2)
+        self.assertEqual("cat!", chain.next_word("unknown a"))
+
+    def test_with_prefix_len(self):
+        chain = backoff.BackoffChain.from_string("I am a cat!", 2)
+        self.assertEqual(2, chain.with_prefix_len(2).max_prefix_len)
+        with self.assertRaises(ValueError):
+            chain.with_prefix_len(3)
+        with self.assertRaises(ValueError):
+            chain.with_prefix_len(0)
+        with self.assertRaises(ValueError):
+            chain.with_prefix_len(1, min_successors=0)
+
+    def test_generate_haiku(self):
+        chain = backoff.BackoffChain.from_files(["corpus/tender_buttons.txt"],
+                                                4, min_successors=2)
+        random.seed(1)
+        for _ in range(10):
+            lines = haiku.generate_haiku(chain).split("\n")
+            self.assertEqual(3, len(lines))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
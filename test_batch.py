@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import unittest
+
+import numpy as np
+
+import batch
+import csrchain
+import dedup
+import haiku
+import markov
+import util
+
+
+class BatchSamplerTests(unittest.TestCase):
+
+    def _chain(self, text, prefix_len=2):
+        chain = csrchain.CSRChain.from_string(text, prefix_len)
+        chain.index_syllables(util.lookup_syllables)
+        return chain
+
+    def _assert_haiku(self, text):
+        lines = text.split("\n")
+        self.assertEqual([5, 7, 5], [
+            sum(util.get_syllable_count(word) for word in line.split())
+            for line in lines])
+        self.assertIn(text[-1], ".!?")
+
+    def test_generate(self):
+        chain = csrchain.CSRChain.from_files(["corpus/tender_buttons.txt"], 2)
+        chain.index_syllables(util.lookup_syllables)
+        sampler = batch.BatchSampler(chain, haiku.LINE_SYLLABLES,
+                                     batch_size=64)
+        stats = haiku.GenerationStats()
+        generated = list(sampler.generate(500, np.random.default_rng(1),
+                                          stats))
+        self.assertEqual(500, len(generated))
+        for text in generated:
+            self._assert_haiku(text)
+        self.assertEqual(500, stats.haiku)
+        self.assertGreater(stats.fallbacks, 0)
+        self.assertEqual(sum(len(text.split()) for text in generated),
+                         stats.words)
+
+    def test_only_haiku(self):
+        # every word has only one successor
+        text = ("Yellow flowers are. Down the hill the rivers go. "
+                "Over the mountains.")
+        sampler = batch.BatchSampler(self._chain(text), haiku.LINE_SYLLABLES)
+        generated = list(sampler.generate(10, np.random.default_rng(1)))
+        self.assertEqual(
+            ["Yellow flowers are.\nDown the hill the rivers go.\n"
+             "Over the mountains."] * 10, generated)
+
+    def test_zero_syllable_words(self):
+        text = ("Hmm hmm hmm the cat sat on the mat. The dog ate the cake "
+                "in the morning time. Hmm the old bird flew away.")
+        chain = self._chain(text, 1)
+        self.assertEqual(0, chain.syllable_count(chain.vocab.get_id("hmm")))
+        sampler = batch.BatchSampler(chain, haiku.LINE_SYLLABLES)
+        for text in sampler.generate(200, np.random.default_rng(1)):
+            self._assert_haiku(text)
+
+    def test_no_haiku(self):
+        with self.assertRaises(ValueError):
+            batch.BatchSampler(self._chain("The cat sat."),
+                               haiku.LINE_SYLLABLES)
+        chain = markov.MarkovChain.from_files(["corpus/tender_buttons.txt"],
+                                             2)
+        chain.index_syllables(util.lookup_syllables)
+        with self.assertRaises(ValueError):
+            batch.BatchSampler(chain, haiku.LINE_SYLLABLES)
+
+    def test_generate_batch(self):
+        chain = csrchain.CSRChain.from_files(["corpus/tender_buttons.txt"], 2)
+        first = list(haiku.generate_batch(chain, 300, seed=1, batch_size=32,
+                                          chunk_size=100))
+        self.assertEqual(list(range(300)), [index for index, _ in first])
+        # the same haiku whatever the number of jobs
+        self.assertEqual(first, list(haiku.generate_batch(
+            chain, 300, jobs=2, seed=1, batch_size=32, chunk_size=100)))
+
+    def test_generate_batch_unique(self):
+        chain = csrchain.CSRChain.from_files(["corpus/tender_buttons.txt"], 4)
+        unique = list(haiku.generate_unique(
+            haiku.generate_batch, chain, 1000, dedup.BloomFilter(1 << 16),
+            seed=1, batch_size=64, chunk_size=500))
+        # tender_buttons.txt makes only a few dozen different haiku at -l 4
+        self.assertLess(len(unique), 1000)
+        self.assertEqual(len(unique), len(set(poem for _, poem in unique)))
+        for _, text in unique:
+            self._assert_haiku(text)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import chaincache
+import markov
+
+
+def _build_cached(args):
+    directory, file_name = args
+    cache = chaincache.ChainCache(directory)
+    return markov.MarkovChain.from_files([file_name], 2,
+                                         cache=cache).to_dict()
+
+
+class ChainCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = chaincache.ChainCache(os.path.join(self.directory,
+                                                        "cache"))
+        self.input = os.path.join(self.directory, "input.txt")
+        shutil.copy("test_inputs/test0.txt", self.input)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _entries(self):
+        return [name for name in os.listdir(self.cache.directory)
+                if name.endswith(".chain")]
+
+    def test_from_files(self):
+        built = markov.MarkovChain.from_files([self.input], 2)
+        first = markov.MarkovChain.from_files([self.input], 2,
+                                              cache=self.cache)
+        self.assertEqual(built.to_dict(), first.to_dict())
+        self.assertEqual(1, len(self._entries()))
+        second = markov.MarkovChain.from_files([self.input], 2,
+                                               cache=self.cache)
+        self.assertIsInstance(second, markov.MarkovChain)
+        self.assertEqual(built.to_dict(), second.to_dict())
+        self.assertEqual(1, len(self._entries()))
+
+    def test_key(self):
+        key = self.cache.key(markov.MarkovChain, [self.input], 2)
+        self.assertEqual(key, self.cache.key(markov.MarkovChain,
+                                             [self.input], 2))
+        self.assertNotEqual(key, self.cache.key(markov.MarkovChain,
+                                                [self.input], 3))
+        self.assertNotEqual(key, self.cache.key(markov.MarkovChain,
+                                                [self.input], 2, punkt=True))
+        # only the contents matter, not the file name
+        other = os.path.join(self.directory, "other.txt")
+        shutil.copy(self.input, other)
+        self.assertEqual(key, self.cache.key(markov.MarkovChain, [other], 2))
+
+    def test_file_changed(self):
+        markov.MarkovChain.from_files([self.input], 2, cache=self.cache)
+        with open(self.input, "a") as f:
+            f.write(" Here is more text.")
+        chain = markov.MarkovChain.from_files([self.input], 2,
+                                              cache=self.cache)
+        self.assertEqual(
+            markov.MarkovChain.from_files([self.input], 2).to_dict(),
+            chain.to_dict())
+        self.assertEqual(2, len(self._entries()))
+
+    def test_damaged_entry(self):
+        key = self.cache.key(markov.MarkovChain, [self.input], 2)
+        with open(os.path.join(self.cache.directory, key + ".chain"),
+                  "wb") as f:
+            f.write(b"not a chain")
+        self.assertIsNone(self.cache.load(key))
+        self.assertEqual([], self._entries())
+
+    def test_evict_least_recently_used(self):
+        chain = markov.MarkovChain.from_files([self.input], 2)
+        for key in ("a", "b", "c"):
+            self.cache.store(key, chain)
+        size = os.path.getsize(os.path.join(self.cache.directory,
+                                            "a.chain"))
+        # make the order of use unambiguous, then use "a" again
+        now = time.time()
+        for age, key in enumerate(("c", "b", "a")):
+            os.utime(os.path.join(self.cache.directory, key + ".chain"),
+                     (now - 10 * age, now - 10 * age))
+        self.cache.load("a")
+        self.cache.max_bytes = 2 * size
+        self.cache.evict()
+        self.assertEqual(["a.chain", "c.chain"], sorted(self._entries()))
+
+    def test_concurrent_processes(self):
+        expected = markov.MarkovChain.from_files([self.input], 2).to_dict()
+        with multiprocessing.Pool(4) as pool:
+            results = pool.map(_build_cached,
+                               [(self.cache.directory, self.input)] * 8)
+        for result in results:
+            self.assertEqual(expected, result)
+        self.assertEqual(1, len(self._entries()))
+        # no temporary files are left behind
+        self.assertEqual(self._entries(), os.listdir(self.cache.directory))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import chainfile
+import haiku
+import markov
+import os
+import pickle
+import tempfile
+import unittest
+
+
+class ChainFileTests(unittest.TestCase):
+    text = ("It is a far, far better thing that I do, "
+            "than I have ever done; "
+            "it is a far, far better rest that I go to "
+            "than I have ever known.")
+
+    def setUp(self):
+        fd, self.file_name = tempfile.mkstemp(suffix=".model")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def _round_trip(self, chain):
+        chainfile.save(chain, self.file_name)
+        return chainfile.load(self.file_name)
+
+    def test_round_trip(self):
+        chain = markov.MarkovChain.from_string(self.text)
+        loaded = self._round_trip(chain)
+        self.assertEqual(chain.prefix_len, loaded.prefix_len)
+        self.assertEqual(chain.to_dict(), loaded.to_dict())
+
+    def test_round_trip_longer_prefix(self):
+        chain = markov.MarkovChain.from_string(self.text, prefix_len=3)
+        loaded = self._round_trip(chain)
+        self.assertEqual(chain.to_dict(), loaded.to_dict())
+
+    def test_vocabulary(self):
+        chain = markov.MarkovChain.from_string("Où est le café? Ici.")
+        loaded = self._round_trip(chain)
+        self.assertEqual(len(chain.vocab), len(loaded.vocab))
+        word_id = chain.vocab.get_id("café?")
+        self.assertEqual("café?", loaded.vocab.word(word_id))
+        self.assertEqual(word_id, loaded.vocab.get_id("café?"))
+        self.assertIsNone(loaded.vocab.get_id("missing"))
+
+    def test_ends_sentence(self):
+        chain = markov.MarkovChain.from_string("Où est le café? Ici.")
+        loaded = self._round_trip(chain)
+        for word in ("café?", "Ici."):
+            self.assertTrue(loaded.ends_sentence(chain.vocab.get_id(word)))
+        self.assertFalse(loaded.ends_sentence(chain.vocab.get_id("est")))
+
+    def test_generate(self):
+        text = "Here are words."
+        chain = markov.MarkovChain.from_string(text, prefix_len=1)
+        loaded = self._round_trip(chain)
+        self.assertEqual(text, loaded.generate(10))
+
+    def test_next_word(self):
+        chain = markov.MarkovChain.from_string("Here is some text!")
+        loaded = self._round_trip(chain)
+        self.assertEqual("text!", loaded.next_word("Here is some"))
+        self.assertEqual("", loaded.next_word("Unknown words"))
+
+    def test_syllable_index(self):
+        chain = markov.MarkovChain(1)
+        chain._update("a bbb a cc a xa a d")
+        chain.index_syllables(
+            lambda word: None if word.startswith("x") else len(word))
+        loaded = self._round_trip(chain)
+        self.assertTrue(loaded.syllables_indexed)
+        self.assertEqual(chain.to_dict(), loaded.to_dict())
+        self.assertEqual(3, loaded.syllable_count(chain.vocab.get_id("bbb")))
+        self.assertIsNone(loaded.syllable_count(chain.vocab.get_id("xa")))
+        for _ in range(50):
+            self.assertIn(loaded.next_word("a", max_syllables=2),
+                          ["cc", "d"])
+        self.assertEqual("", loaded.next_word("bbb", max_syllables=0))
+
+    def test_no_syllable_index(self):
+        chain = markov.MarkovChain.from_string("Here is some text!")
+        loaded = self._round_trip(chain)
+        self.assertFalse(loaded.syllables_indexed)
+        with self.assertRaises(ValueError):
+            loaded.next_word("Here", max_syllables=1)
+        # it can't be indexed after loading, so it can't make haiku
+        with self.assertRaises(ValueError):
+            loaded.index_syllables(lambda word: 1)
+        with self.assertRaises(ValueError):
+            haiku.generate_haiku(loaded)
+
+    def test_pickle(self):
+        chain = markov.MarkovChain.from_string(self.text)
+        loaded = self._round_trip(chain)
+        unpickled = pickle.loads(pickle.dumps(loaded))
+        self.assertEqual(chain.to_dict(), unpickled.to_dict())
+
+    def test_not_a_chain_file(self):
+        with open(self.file_name, "wb") as f:
+            f.write(b"Here is some text. It is not long.")
+        with self.assertRaises(ValueError):
+            chainfile.load(self.file_name)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
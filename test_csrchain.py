@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+import csrchain
+import haiku
+import markov
+import util
+
+
+class CSRChainTests(unittest.TestCase):
+
+    files = ["test_inputs/test0.txt", "test_inputs/test1.txt",
+             "test_inputs/test2.txt", "test_inputs/test3.txt",
+             "corpus/tender_buttons.txt"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_same_as_markov_chain(self):
+        for prefix_len in (1, 2, 3):
+            expected = markov.MarkovChain.from_files(self.files, prefix_len)
+            chain = csrchain.CSRChain.from_files(self.files, prefix_len)
+            self.assertEqual(expected.to_dict(), chain.to_dict())
+
+    def test_punkt(self):
+        text = "Mr. Smith went to Washington. He saw the Capitol."
+        expected = markov.MarkovChain.from_string(text, 2, punkt=True)
+        chain = csrchain.CSRChain.from_string(text, 2, punkt=True)
+        self.assertEqual(expected.to_dict(), chain.to_dict())
+
+    def test_successors(self):
+        chain = csrchain.CSRChain.from_string(
+            "I am a cat! You are a rat. I am a bat.", 2)
+        vocab = chain.vocab
+        self.assertEqual({vocab.get_id("I"): 2, vocab.get_id("You"): 1},
+                         chain.successors(()))
+        self.assertEqual({vocab.get_id("cat!"): 1, vocab.get_id("bat."): 1},
+                         chain.successors((vocab.get_id("am"),
+                                           vocab.get_id("a"))))
+        self.assertEqual({}, chain.successors((vocab.get_id("a"),
+                                               vocab.get_id("am"))))
+        self.assertEqual("", chain.next_word("unknown words"))
+
+    def test_ends_sentence(self):
+        chain = csrchain.CSRChain.from_string("Où est le café? Ici. Oui")
+        for word, ends in [("café?", True), ("Ici.", True), ("est", False),
+                           ("Oui", False)]:
+            self.assertEqual(ends,
+                             chain.ends_sentence(chain.vocab.get_id(word)))
+
+    def test_save_and_load(self):
+        chain = csrchain.CSRChain.from_files(self.files, 2)
+        chain.index_syllables(util.lookup_syllables)
+        csrchain.save(chain, self.directory)
+        loaded = csrchain.load(self.directory)
+        self.assertTrue(loaded.syllables_indexed)
+        self.assertEqual(chain.to_dict(), loaded.to_dict())
+        # pickling a loaded chain maps the files again
+        unpickled = pickle.loads(pickle.dumps(loaded))
+        self.assertEqual(self.directory, unpickled.directory)
+        self.assertEqual(chain.to_dict(), unpickled.to_dict())
+
+    def test_load_not_a_chain(self):
+        with self.assertRaises(ValueError):
+            csrchain.load(self.directory)
+
+    def test_max_syllables(self):
+        chain = csrchain.CSRChain.from_string(
+            "The cat sat. The elephant sat. The dog sat.", 1)
+        chain.index_syllables(util.lookup_syllables)
+        prefix = (chain.vocab.get_id("The"),)
+        for _ in range(20):
+            word_id = chain._sample_next(prefix, max_syllables=1)
+            self.assertIn(chain.vocab.word(word_id), ("cat", "dog"))
+        self.assertIsNone(chain._sample_next(prefix, max_syllables=0))
+
+    def test_generate_haiku(self):
+        chain = csrchain.CSRChain.from_files(["corpus/tender_buttons.txt"], 2)
+        chain.index_syllables(util.lookup_syllables)
+        random.seed(1)
+        for _ in range(10):
+            lines = haiku.generate_haiku(chain).split("\n")
+            self.assertEqual(3, len(lines))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
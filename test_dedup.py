@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import unittest
+
+import dedup
+
+
+class BloomFilterTests(unittest.TestCase):
+
+    def test_add(self):
+        seen = dedup.BloomFilter(1024, 0.01)
+        self.assertFalse(seen.add(["caw! caw!", "caw!"]))
+        self.assertTrue(seen.add(["caw! caw!", "caw!"]))
+        # the same words, split into lines differently
+        self.assertFalse(seen.add(["caw!", "caw! caw!"]))
+        self.assertIn(["caw!", "caw! caw!"], seen)
+        self.assertNotIn(["caw!"], seen)
+        self.assertEqual(2, seen.count)
+
+    def test_no_false_negatives(self):
+        seen = dedup.BloomFilter(4096, 0.01)
+        haiku = [["line {}".format(i), str(i * i)]
+                 for i in range(seen.capacity)]
+        for lines in haiku:
+            seen.add(lines)
+        for lines in haiku:
+            self.assertIn(lines, seen)
+
+    def test_error_rate(self):
+        seen = dedup.BloomFilter(4096, 0.01)
+        for i in range(seen.capacity):
+            seen.add(["added", str(i)])
+        false_positives = sum(["new", str(i)] in seen for i in range(20000))
+        self.assertLess(false_positives / 20000, 0.02)
+        self.assertAlmostEqual(0.01, seen.estimated_error_rate(),
+                               delta=0.005)
+
+    def test_positions_are_distinct(self):
+        # 24 bits, for 20 hashes; a step of 3 would cycle back after 8
+        seen = dedup.BloomFilter(3, 2 ** -20)
+        for i in range(200):
+            positions = seen._positions(["line", str(i)])
+            self.assertEqual(20, len(set(positions)))
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            dedup.BloomFilter(0)
+        with self.assertRaises(ValueError):
+            dedup.BloomFilter(1024, 1)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
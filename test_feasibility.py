@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import feasibility
+import markov
+import unittest
+import util
+
+
+class FeasibilityTests(unittest.TestCase):
+
+    def _chain(self, text, prefix_len=1):
+        chain = markov.MarkovChain(prefix_len)
+        chain._update(text)
+        # count letters instead of syllables; words starting with "x" are
+        # unknown
+        chain.index_syllables(lambda word: None if word.startswith("x")
+                              else len(word.strip(".")))
+        return chain
+
+    def _prefix(self, chain, text):
+        return chain.start(text).prefix
+
+    def test_line_remaining(self):
+        chain = self._chain("a b")
+        table = feasibility.FeasibilityTable(chain, (5, 7, 5))
+        self.assertEqual(17, table.total_syllables)
+        self.assertEqual([5, 1, 7, 1, 5, 1],
+                         [table.line_remaining(r)
+                          for r in [17, 13, 12, 6, 5, 1]])
+
+    def test_can_finish(self):
+        chain = self._chain("aa b. aa bb c.")
+        table = feasibility.FeasibilityTable(chain, (2, 1))
+        self.assertTrue(table.can_finish(self._prefix(chain, "aa"), 1))
+        # "c." is the only other ending, and it needs a whole line to itself
+        self.assertTrue(table.can_finish(self._prefix(chain, "bb"), 1))
+        self.assertFalse(table.can_finish(self._prefix(chain, "c."), 1))
+        # the line can't end in the middle of "bb"
+        self.assertFalse(table.can_finish(self._prefix(chain, "aa"), 2))
+
+    def test_needs_sentence_end(self):
+        chain = self._chain("aa bb aa c")
+        table = feasibility.FeasibilityTable(chain, (2, 2))
+        self.assertFalse(table.can_finish(self._prefix(chain, "aa"), 4))
+        table = feasibility.FeasibilityTable(chain, (2, 2),
+                                             end_sentence=False)
+        self.assertTrue(table.can_finish(self._prefix(chain, "aa"), 4))
+
+    def test_unknown_words(self):
+        chain = self._chain("a xy b.")
+        table = feasibility.FeasibilityTable(chain, (1, 1))
+        self.assertFalse(table.can_finish(self._prefix(chain, "a"), 1))
+
+    def test_zero_syllable_loop(self):
+        chain = self._chain("a . . a b.")
+        table = feasibility.FeasibilityTable(chain, (2,))
+        self.assertTrue(table.can_finish(self._prefix(chain, "."), 2))
+        self.assertFalse(table.can_finish(self._prefix(chain, "."), 1))
+        self.assertTrue(table.can_finish(self._prefix(chain, "a"), 1))
+
+    def test_sample_avoids_dead_ends(self):
+        # after "a", "dd" is much more likely, but it can't end the poem
+        chain = self._chain("a dd a dd a dd a dd a cc.")
+        table = feasibility.FeasibilityTable(chain, (3,))
+        prefix = self._prefix(chain, "a")
+        for _ in range(20):
+            word_id = table.sample(prefix, 2)
+            self.assertEqual("cc.", chain.vocab.word(word_id))
+        self.assertTrue(table.rejections > 0)
+        self.assertTrue(table.fallbacks <= 20)
+
+    def test_sample_impossible(self):
+        chain = self._chain("a dd")
+        table = feasibility.FeasibilityTable(chain, (3,))
+        self.assertIsNone(table.sample(self._prefix(chain, "a"), 2))
+
+    def test_sample_max_syllables(self):
+        chain = markov.MarkovChain.from_string("The next word is dog.")
+        chain.index_syllables(util.lookup_syllables)
+        table = feasibility.FeasibilityTable(chain, (5,))
+        word_id = table.sample(self._prefix(chain, "The next word is"), 1)
+        self.assertEqual("dog.", chain.vocab.word(word_id))
+
+    def test_sample_too_many_syllables(self):
+        chain = markov.MarkovChain.from_string(
+            "The next word is multisyllabic.")
+        chain.index_syllables(util.lookup_syllables)
+        table = feasibility.FeasibilityTable(chain, (5,))
+        self.assertIsNone(
+            table.sample(self._prefix(chain, "The next word is"), 1))
+
+    def test_needs_syllable_index(self):
+        chain = markov.MarkovChain.from_string("Here is some text.")
+        with self.assertRaises(ValueError):
+            feasibility.FeasibilityTable(chain, (5, 7, 5))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
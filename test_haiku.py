@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import chainfile
+import dedup
 import util
 import markov
 import haiku
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 
@@ -16,14 +22,14 @@ class HaikuTests(unittest.TestCase):
     def test_get_next_word_success(self):
         text = "The next word is dog."
         chain = markov.MarkovChain.from_string(text)
-        word = haiku.get_next_word(chain, "The next word is", 2)
+        word = haiku.get_next_word(chain, chain.start("The next word is"), 2)
         self.assertEqual("dog.", word)
 
     def test_get_next_word_failure(self):
         text = "The next word is multisyllabic."
         chain = markov.MarkovChain.from_string(text)
         with self.assertRaises(RuntimeError):
-            haiku.get_next_word(chain, "The next word is", 2)
+            haiku.get_next_word(chain, chain.start("The next word is"), 2)
 
     def test_generate_first_line(self):
         text = "Just five syllables"
@@ -35,7 +41,8 @@ class HaikuTests(unittest.TestCase):
     def test_generate_later_line(self):
         text = "Just five syllables in the first line of the text"
         chain = markov.MarkovChain.from_string(text)
-        line = haiku.generate_line(chain, 7, "Just five syllables")
+        state = chain.start("Just five syllables")
+        line = haiku.generate_line(chain, 7, state)
         # only valid line is original text
         self.assertEqual("in the first line of the text", line)
 
@@ -83,6 +90,192 @@ class HaikuTests(unittest.TestCase):
         actual_haiku = haiku.generate_haiku(chain)
         self.assertEqual(expected_haiku, actual_haiku)
 
+    def test_generate_haiku_impossible(self):
+        """Fail right away, instead of retrying forever."""
+        text = ("This haiku would be "
+                "perfect except that it has "
+                "too many syllables on the last line.")
+        chain = markov.MarkovChain.from_string(text)
+        with self.assertRaises(ValueError):
+            haiku.generate_haiku(chain)
+
+    def test_generate_haiku_avoids_dead_ends(self):
+        # "so" can be followed by "just repeat it!" or "just use it but",
+        # and only the first can end the haiku
+        text = ("This is already "
+                "a perfectly fine haiku "
+                "so just use it but "
+                "this is already "
+                "a perfectly fine haiku "
+                "so just repeat it!")
+        chain = markov.MarkovChain.from_string(text, prefix_len=1)
+        for _ in range(20):
+            poem = haiku.generate_haiku(chain)
+            lines = poem.split("\n")
+            self._assert_syllable_count(5, lines[0])
+            self._assert_syllable_count(7, lines[1])
+            self._assert_syllable_count(5, lines[2])
+            self.assertTrue(lines[2][-1] in "?.!")
+
+    def test_generate_haiku_after_change(self):
+        first = ("This is already "
+                 "a perfectly fine haiku "
+                 "so just repeat it!")
+        second = ("Here is another "
+                  "perfectly acceptable "
+                  "haiku to use here.")
+        chain = markov.MarkovChain.from_string(first)
+        self.assertEqual("This is already\na perfectly fine haiku\n"
+                         "so just repeat it!", haiku.generate_haiku(chain))
+        chain.add_text(second)
+        chain.remove_text(first)
+        self.assertEqual("Here is another\nperfectly acceptable\n"
+                         "haiku to use here.", haiku.generate_haiku(chain))
+
+    def test_generation_stats(self):
+        text = ("This is already "
+                "a perfectly fine haiku "
+                "so just use it but "
+                "this is already "
+                "a perfectly fine haiku "
+                "so just repeat it!")
+        chain = markov.MarkovChain.from_string(text, prefix_len=1)
+        stats = haiku.GenerationStats()
+        for _ in range(20):
+            haiku.generate_haiku(chain, stats)
+        self.assertEqual(20, stats.haiku)
+        self.assertEqual(0, stats.failures)
+        self.assertEqual(20 * 11, stats.words)
+        self.assertEqual(set(haiku.GenerationStats.STAGES),
+                         set(stats.stage_seconds))
+        self.assertGreater(stats.slowest_seconds, 0)
+        self.assertLessEqual(stats.slowest_seconds,
+                             sum(stats.stage_seconds.values()))
+
+        impossible = markov.MarkovChain.from_string("Far too short.")
+        with self.assertRaises(ValueError):
+            haiku.generate_haiku(impossible, stats)
+        self.assertEqual(1, stats.failures)
+        self.assertEqual(20, stats.haiku)
+
+    def test_generate_haiku_after_reindexing(self):
+        text = ("This is already "
+                "a perfectly fine haiku "
+                "so just repeat it!")
+        chain = markov.MarkovChain.from_string(text)
+        self.assertEqual("This is already\na perfectly fine haiku\n"
+                         "so just repeat it!", haiku.generate_haiku(chain))
+        # with "haiku" at three syllables, the second line is too long
+        chain.index_syllables(lambda word: 3 if word == "haiku"
+                              else util.lookup_syllables(word))
+        with self.assertRaises(ValueError):
+            haiku.generate_haiku(chain)
+
+    def test_generate_many(self):
+        text = ("This is already\n"
+                "a perfectly fine haiku\n"
+                "so just repeat it!\n"
+                "This is already\n"
+                "an acceptable haiku\n"
+                "so just use this one.")
+        chain = markov.MarkovChain.from_string(text)
+        serial = list(haiku.generate_many(chain, 10, seed=1, chunk_size=3))
+        self.assertEqual(list(range(10)), [index for index, _ in serial])
+        for _, poem in serial:
+            self.assertEqual(3, len(poem.split("\n")))
+        # the same seed gives the same haiku, however the work is split
+        parallel = list(haiku.generate_many(chain, 10, jobs=2, seed=1,
+                                            chunk_size=4))
+        self.assertEqual(serial, parallel)
+
+    def test_generate_many_stats(self):
+        text = ("This is already\n"
+                "a perfectly fine haiku\n"
+                "so just repeat it!")
+        chain = markov.MarkovChain.from_string(text)
+        for jobs in (1, 2):
+            stats = haiku.GenerationStats()
+            list(haiku.generate_many(chain, 10, jobs=jobs, seed=1,
+                                     chunk_size=3, stats=stats))
+            self.assertEqual(10, stats.haiku)
+            self.assertEqual(10 * 11, stats.words)
+
+    def test_drop_duplicates(self):
+        text = ("This is already\n"
+                "a perfectly fine haiku\n"
+                "so just repeat it!")
+        chain = markov.MarkovChain.from_string(text)
+        stats = haiku.GenerationStats()
+        unique = list(haiku.drop_duplicates(
+            haiku.generate_many(chain, 10, seed=1),
+            dedup.BloomFilter(1024), stats))
+        self.assertEqual([(0, text)], unique)
+        self.assertEqual(10, stats.checked)
+        self.assertEqual(9, stats.duplicates)
+        self.assertIn("unique yield 10.0%", stats.format())
+
+    def test_drop_duplicates_cleans_new_haiku(self):
+        results = [(0, '"Just five syllables\nline\nend.'),
+                   (1, '"Just five syllables\nline\nend.')]
+        self.assertEqual(
+            [(0, "Just five syllables\nline\nend.")],
+            list(haiku.drop_duplicates(results, dedup.BloomFilter(1024),
+                                       clean=True)))
+
+    def test_generate_unique(self):
+        # four different haiku can be made from this
+        text = ("This is already\n"
+                "a perfectly fine haiku\n"
+                "so just repeat it!\n"
+                "This is already\n"
+                "an acceptable haiku\n"
+                "so just use this one.")
+        chain = markov.MarkovChain.from_string(text)
+        for jobs in (1, 2):
+            stats = haiku.GenerationStats()
+            unique = list(haiku.generate_unique(
+                haiku.generate_many, chain, 3, dedup.BloomFilter(1024),
+                jobs=jobs, seed=1, chunk_size=2, stats=stats))
+            self.assertEqual(3, len(set(poem for _, poem in unique)))
+            self.assertEqual(stats.checked - stats.duplicates, 3)
+        # after all four, a round with nothing new gives up
+        unique = list(haiku.generate_unique(
+            haiku.generate_many, chain, 10, dedup.BloomFilter(1024), seed=1))
+        self.assertEqual(4, len(set(poem for _, poem in unique)))
+        self.assertEqual(len(unique), len(set(unique)))
+
+    def test_count_leaves_stdout_open(self):
+        code = ("import runpy, sys\n"
+                "sys.argv = ['haiku.py', 'corpus/tender_buttons.txt', "
+                "'-n', '1']\n"
+                "runpy.run_path('haiku.py', run_name='__main__')\n"
+                "print('done')")
+        output = subprocess.run([sys.executable, "-c", code],
+                                capture_output=True, text=True,
+                                check=True).stdout
+        self.assertTrue(output.endswith("done\n"))
+
+    def test_compile_from_model(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = os.path.join(directory, "first.model")
+            second = os.path.join(directory, "second.model")
+            for args in (["test_inputs/test0.txt", "--compile", "-o", first],
+                         ["--model", first, "--compile", "-o", second]):
+                subprocess.run([sys.executable, "haiku.py"] + args,
+                               check=True)
+            self.assertEqual(chainfile.load(first).to_dict(),
+                             chainfile.load(second).to_dict())
+
+    def test_lazy_imports(self):
+        # modules only some paths need aren't imported up front
+        code = ("import sys, haiku; print(' '.join(sorted(sys.modules)))")
+        modules = subprocess.run([sys.executable, "-c", code],
+                                 capture_output=True, text=True,
+                                 check=True).stdout.split()
+        for name in ("nltk", "multiprocessing", "numpy", "chaincache",
+                     "backoff"):
+            self.assertNotIn(name, modules)
+
 
 def main():
     unittest.main()
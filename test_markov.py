@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
+import bz2
+import collections
+import gzip
 import markov
+import os
+import random
+import tempfile
 import unittest
 
 
@@ -23,12 +29,11 @@ class MarkovTests(unittest.TestCase):
         "is not": ["long."]
     }
 
-    def _compare_dictionaries(self, expected, actual):
-        for key in expected:
-            self.assertTrue(actual[key])
-            self.assertEqual(expected[key], actual[key])
-        for key in actual:
-            self.assertTrue(expected[key])
+    def _compare_dictionaries(self, expected, chain):
+        """Compare a chain to a dict of prefixes to lists of successors."""
+        expected_counts = {prefix: dict(collections.Counter(words))
+                           for prefix, words in expected.items()}
+        self.assertEqual(expected_counts, chain.to_dict())
 
     def test_update_prefix(self):
         prefix = markov._update_prefix(2, "I am", "a")
@@ -87,7 +92,7 @@ class MarkovTests(unittest.TestCase):
         }
         chain = markov.MarkovChain(prefix_len)
         chain._update(self.long_text)
-        self._compare_dictionaries(word_dict, chain._chain)
+        self._compare_dictionaries(word_dict, chain)
 
     def test_update_chain_longer_prefix(self):
         prefix_len = 3
@@ -122,7 +127,7 @@ class MarkovTests(unittest.TestCase):
 
         chain = markov.MarkovChain(prefix_len)
         chain._update(self.long_text)
-        self._compare_dictionaries(word_dict, chain._chain)
+        self._compare_dictionaries(word_dict, chain)
 
     def test_add_chain_start(self):
         chain = markov.MarkovChain(2)
@@ -135,25 +140,25 @@ class MarkovTests(unittest.TestCase):
             "is a": ["sentence."],
             "I": ["have"]
         }
-        self._compare_dictionaries(expected_dict, chain._chain)
+        self._compare_dictionaries(expected_dict, chain)
 
     def test_add_sentences(self):
         chain = markov.MarkovChain(2)
         chain._add_sentences(self.factory_text)
-        self._compare_dictionaries(self.expected_factory_dict, chain._chain)
+        self._compare_dictionaries(self.expected_factory_dict, chain)
 
     def test_from_string(self):
         chain = markov.MarkovChain.from_string(self.factory_text)
-        self._compare_dictionaries(self.expected_factory_dict, chain._chain)
+        self._compare_dictionaries(self.expected_factory_dict, chain)
 
     def test_from_file(self):
         """Test that both sentences are starting points for text generation"""
         chain = markov.MarkovChain.from_files(["test_inputs/test0.txt"], 2)
-        self._compare_dictionaries(self.expected_factory_dict, chain._chain)
+        self._compare_dictionaries(self.expected_factory_dict, chain)
 
     def test_from_files_with_newline(self):
         chain = markov.MarkovChain.from_files(["test_inputs/test1.txt"], 2)
-        self._compare_dictionaries(self.expected_factory_dict, chain._chain)
+        self._compare_dictionaries(self.expected_factory_dict, chain)
 
     def test_from_multiple_files(self):
         file_names = ["test_inputs/test2.txt", "test_inputs/test3.txt"]
@@ -165,7 +170,292 @@ class MarkovTests(unittest.TestCase):
             "I am": ["a", "a"],
             "am a": ["cat!", "rat."]
         }
-        self._compare_dictionaries(expected_dict, chain._chain)
+        self._compare_dictionaries(expected_dict, chain)
+
+    def test_generation_state(self):
+        chain = markov.MarkovChain.from_string("Here is some text!")
+        state = chain.start("Here")
+        self.assertEqual("is", state.next_word())
+        self.assertEqual("some", state.next_word())
+        copy = state.copy()
+        self.assertEqual("text!", state.next_word())
+        self.assertEqual("", state.next_word())
+        # the copy didn't move
+        self.assertEqual("text!", copy.next_word())
+
+    def test_generation_state_unknown_words(self):
+        """Unknown seed words leave the prefix until they're shifted out."""
+        chain = markov.MarkovChain.from_string("a b c d", prefix_len=2)
+        state = chain.start("unknown b")
+        self.assertIsNone(state.sample())
+        state.advance(chain.vocab.get_id("c"))
+        self.assertEqual("d", state.next_word())
+
+    def test_vocabulary(self):
+        vocab = markov.Vocabulary()
+        first = vocab.add("word")
+        second = vocab.add("other")
+        self.assertEqual(first, vocab.add("word"))
+        self.assertNotEqual(first, second)
+        self.assertEqual("other", vocab.word(second))
+        self.assertEqual(second, vocab.get_id("other"))
+        self.assertIsNone(vocab.get_id("missing"))
+        self.assertEqual(2, len(vocab))
+
+    def test_successor_counts(self):
+        chain = markov.MarkovChain(1)
+        chain._update("a b a b a c")
+        self.assertEqual({"b": 2, "c": 1}, chain.to_dict()["a"])
+
+    def test_word_flags(self):
+        chain = markov.MarkovChain.from_string("Is it? It is. (Yes!) No")
+        for word, ends in [("it?", True), ("is.", True), ("(Yes!)", False),
+                           ("No", False)]:
+            self.assertEqual(ends,
+                             chain.ends_sentence(chain.vocab.get_id(word)))
+        # words added later get flags too
+        chain.add_text("Maybe so!")
+        self.assertTrue(chain.ends_sentence(chain.vocab.get_id("so!")))
+
+    def test_sample_by_count(self):
+        """Sampling matches random.choice over one entry per occurrence."""
+        table = markov._SuccessorTable({0: 1})
+        table.add(1, 3)
+        random.seed(0)
+        samples = collections.Counter(table.sample() for _ in range(4000))
+        self.assertAlmostEqual(0.25, samples[0] / 4000, delta=0.03)
+        self.assertAlmostEqual(0.75, samples[1] / 4000, delta=0.03)
+
+    def test_build_alias(self):
+        """An alias table gives each choice its share of the weight."""
+        weights = [5, 1, 1, 9, 0, 3, 13]
+        probabilities, aliases = markov._build_alias(weights)
+        shares = list(probabilities)
+        for i, probability in enumerate(probabilities):
+            shares[aliases[i]] += 1 - probability
+        for share, weight in zip(shares, weights):
+            self.assertAlmostEqual(weight / sum(weights),
+                                   share / len(weights))
+
+    def test_sample_with_aliases(self):
+        chain = markov.MarkovChain(1)
+        chain._aliases = markov._AliasCache(min_successors=2,
+                                            draws_per_successor=0)
+        chain._update("a bbb a cc a cc a cc a d")
+        self._index(chain)
+        random.seed(0)
+        words = collections.Counter(chain.next_word("a", max_syllables=2)
+                                    for _ in range(4000))
+        self.assertEqual({"cc", "d"}, set(words))
+        self.assertAlmostEqual(0.75, words["cc"] / 4000, delta=0.03)
+        # changing the counts rebuilds the alias tables
+        chain.add_text("a d a d a d a d a d a d")
+        words = collections.Counter(chain.next_word("a", max_syllables=2)
+                                    for _ in range(4000))
+        self.assertAlmostEqual(0.3, words["cc"] / 4000, delta=0.03)
+
+    def test_alias_cache_evicts_least_recently_used(self):
+        aliases = markov._AliasCache(min_successors=2, max_bytes=12 * 5,
+                                     draws_per_successor=0)
+        tables = [markov._SuccessorTable({0: 1, 1: 2}) for _ in range(3)]
+        for table in tables:
+            table.sample(aliases=aliases)
+        tables[0].sample(aliases=aliases)
+        # the three tables take 24 bytes each, so only two fit
+        self.assertIsNotNone(tables[0]._alias)
+        self.assertIsNone(tables[1]._alias)
+        self.assertIsNotNone(tables[2]._alias)
+        self.assertEqual(48, aliases.nbytes)
+
+    def test_alias_table_built_once_paid_for(self):
+        aliases = markov._AliasCache(min_successors=2)
+        table = markov._SuccessorTable({0: 1, 1: 2, 2: 3})
+        for _ in range(3):
+            self.assertIn(table.sample(aliases=aliases), (0, 1, 2))
+            self.assertIsNone(table._alias)
+        table.sample(aliases=aliases)
+        self.assertIsNotNone(table._alias)
+
+    def _index(self, chain):
+        # count letters instead of syllables; words starting with "x" are
+        # unknown
+        chain.index_syllables(
+            lambda word: None if word.startswith("x") else len(word))
+
+    def test_next_word_max_syllables(self):
+        chain = markov.MarkovChain(1)
+        chain._update("a bbb a cc a xa a d")
+        self._index(chain)
+        random.seed(0)
+        words = collections.Counter(chain.next_word("a", max_syllables=2)
+                                    for _ in range(3000))
+        # only cc and d are short enough, and they're equally likely
+        self.assertEqual({"cc", "d"}, set(words))
+        self.assertAlmostEqual(0.5, words["cc"] / 3000, delta=0.04)
+
+    def test_next_word_max_syllables_none_valid(self):
+        chain = markov.MarkovChain(1)
+        chain._update("a bbb a xa")
+        self._index(chain)
+        self.assertEqual("", chain.next_word("a", max_syllables=2))
+
+    def test_next_word_max_syllables_single_successor(self):
+        chain = markov.MarkovChain(1)
+        chain._update("a bbb")
+        self._index(chain)
+        self.assertEqual("", chain.next_word("a", max_syllables=2))
+        self.assertEqual("bbb", chain.next_word("a", max_syllables=3))
+
+    def test_index_words_added_later(self):
+        chain = markov.MarkovChain(1)
+        chain._update("a bbb")
+        self._index(chain)
+        chain._update("a cc")
+        self.assertEqual("cc", chain.next_word("a", max_syllables=2))
+        self.assertEqual(2, chain.syllable_count(chain.vocab.get_id("cc")))
+        chain._update("a xa")
+        self.assertIsNone(chain.syllable_count(chain.vocab.get_id("xa")))
+
+    def test_max_syllables_needs_index(self):
+        chain = markov.MarkovChain.from_string(self.short_text)
+        with self.assertRaises(ValueError):
+            chain.next_word("", max_syllables=2)
+
+    def test_read_words(self):
+        with open("test_inputs/test1.txt") as f:
+            chunks = list(markov._read_words(f, chunk_size=5))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(self.factory_text.split(), sum(chunks, []))
+
+    def test_from_files_chunks(self):
+        """The chain doesn't depend on how the input is split up."""
+        text = self.long_text + " " + self.factory_text
+        words = text.split()
+        for builder_class in [markov._ChainBuilder, markov._PunktBuilder]:
+            for size in [1, 2, 5]:
+                chain = markov.MarkovChain(2)
+                builder = builder_class(chain)
+                for i in range(0, len(words), size):
+                    builder.feed(words[i:i + size])
+                builder.close()
+                expected = markov.MarkovChain.from_string(
+                    text, punkt=builder_class is markov._PunktBuilder)
+                self.assertEqual(expected.to_dict(), chain.to_dict())
+
+    def test_ends_sentence(self):
+        for word, next_word in [("end.", "Next"), ("end?", "“Next"),
+                                ("end!”", "Next"), ("(end.)", "Next"),
+                                ("end.", "1851")]:
+            self.assertTrue(markov._ends_sentence(word, next_word))
+        for word, next_word in [("middle", "Next"), ("end?", "he"),
+                                ("Mr.", "Smith"), ("J.", "Smith"),
+                                ("end,", "Next")]:
+            self.assertFalse(markov._ends_sentence(word, next_word))
+
+    def test_sentence_starts(self):
+        text = "Mr. Smith said “Go!” Then he went. “Where?” asked Jo. I am."
+        chain = markov.MarkovChain.from_string(text, prefix_len=1)
+        starts = chain.to_dict()[""]
+        self.assertEqual({"Mr.": 1, "Then": 1, "“Where?”": 1, "I": 1},
+                         starts)
+
+    def test_punkt(self):
+        chain = markov.MarkovChain.from_files(["test_inputs/test0.txt"], 2,
+                                              punkt=True)
+        self._compare_dictionaries(self.expected_factory_dict, chain)
+        text = "“Where?” asked Jo. I am."
+        chain = markov.MarkovChain.from_string(text, prefix_len=1,
+                                               punkt=True)
+        self.assertIn("asked", chain.to_dict()[""])
+
+    def test_from_compressed_files(self):
+        for module, suffix in [(gzip, ".gz"), (bz2, ".bz2")]:
+            fd, file_name = tempfile.mkstemp(suffix=suffix)
+            os.close(fd)
+            try:
+                with module.open(file_name, "wt") as f:
+                    f.write("Here is some\ntext. It is\nnot long.\n")
+                chain = markov.MarkovChain.from_files([file_name], 2)
+            finally:
+                os.remove(file_name)
+            self._compare_dictionaries(self.expected_factory_dict, chain)
+
+    def test_merge(self):
+        chain = markov.MarkovChain.from_string("I am a cat!", prefix_len=1)
+        other = markov.MarkovChain.from_string("You are a rat. I am a rat.",
+                                               prefix_len=1)
+        chain.merge(other)
+        expected_dict = {
+            "": ["I", "You", "I"],
+            "I": ["am", "am"],
+            "You": ["are"],
+            "am": ["a", "a"],
+            "are": ["a"],
+            "a": ["cat!", "rat.", "rat."],
+            "rat.": ["I"]
+        }
+        self._compare_dictionaries(expected_dict, chain)
+        self.assertEqual(["I", "am", "a", "cat!", "You", "are", "rat."],
+                         [chain.vocab.word(i)
+                          for i in range(len(chain.vocab))])
+
+    def test_merge_prefix_len(self):
+        chain = markov.MarkovChain(2)
+        with self.assertRaises(ValueError):
+            chain.merge(markov.MarkovChain(3))
+
+    def _assert_same_entries(self, expected, actual):
+        """Check two chains store the same counts in the same way."""
+        self.assertEqual(expected.to_dict(), actual.to_dict())
+        stored = {prefix: type(entry) is int
+                  for prefix, entry in actual._chain.items()}
+        self.assertEqual(len(expected._chain), len(stored))
+        for prefix, entry in expected._chain.items():
+            words = " ".join(expected.vocab.word(word_id)
+                             for word_id in prefix)
+            prefix = tuple(actual.vocab.get_id(word)
+                           for word in words.split())
+            self.assertEqual(type(entry) is int, stored[prefix])
+
+    def test_add_files(self):
+        files = ["test_inputs/test0.txt", "test_inputs/test1.txt",
+                 "test_inputs/test2.txt"]
+        for punkt in (False, True):
+            chain = markov.MarkovChain.from_files(files[:1], 2, punkt=punkt)
+            chain.add_files(files[1:2], punkt=punkt)
+            with open(files[2]) as f:
+                chain.add_text(f.read(), punkt=punkt)
+            self._assert_same_entries(
+                markov.MarkovChain.from_files(files, 2, punkt=punkt), chain)
+            self.assertEqual(2, chain.version)
+
+    def test_remove_files(self):
+        files = ["test_inputs/test0.txt", "test_inputs/test1.txt",
+                 "test_inputs/test2.txt", "test_inputs/test3.txt"]
+        for punkt in (False, True):
+            chain = markov.MarkovChain.from_files(files, 2, punkt=punkt)
+            chain.remove_files(files[1:2], punkt=punkt)
+            with open(files[3]) as f:
+                chain.remove_text(f.read(), punkt=punkt)
+            self._assert_same_entries(
+                markov.MarkovChain.from_files([files[0], files[2]], 2,
+                                              punkt=punkt), chain)
+            chain.remove_files([files[0], files[2]], punkt=punkt)
+            self.assertEqual({}, chain.to_dict())
+
+    def test_remove_text_not_added(self):
+        chain = markov.MarkovChain.from_string("I am a cat! I am a rat.")
+        expected = chain.to_dict()
+        vocab_size = len(chain.vocab)
+        # a new word
+        with self.assertRaises(ValueError):
+            chain.remove_text("I am a dog!")
+        # known words, in an order that wasn't added
+        with self.assertRaises(ValueError):
+            chain.remove_text("I am a cat! I am a cat!")
+        self.assertEqual(expected, chain.to_dict())
+        self.assertEqual(vocab_size, len(chain.vocab))
+        self.assertEqual(0, chain.version)
 
     def test_generate(self):
         chain = markov.MarkovChain.from_string(self.short_text, prefix_len=1)
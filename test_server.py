@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+import asyncio
+import concurrent.futures
+import haiku
+import markov
+import server
+import subprocess
+import suffixarray
+import sys
+import tempfile
+import unittest
+
+
+class ServerTests(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chains = {
+            ("tender_buttons", 2): markov.MarkovChain.from_files(
+                ["corpus/tender_buttons.txt"], 2),
+            ("words", 1): markov.MarkovChain.from_string("Here are words.",
+                                                         prefix_len=1),
+        }
+
+    async def asyncSetUp(self):
+        self.server = server.HaikuServer(self.chains, port=0, jobs=1)
+        await self.server.start()
+        self.client = server.Client(self.server.host, self.server.port)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.close()
+
+    async def test_haiku(self):
+        status, response = await self.client.get(
+            "/haiku?corpus=tender_buttons&prefix_len=2")
+        self.assertEqual(200, status)
+        self.assertEqual("tender_buttons", response["corpus"])
+        self.assertEqual(2, response["prefix_len"])
+        self.assertEqual(3, len(response["haiku"].split("\n")))
+
+    async def test_seed(self):
+        target = "/haiku?corpus=tender_buttons&seed=7"
+        _, first = await self.client.get(target)
+        _, second = await self.client.get(target)
+        self.assertEqual(first, second)
+
+    async def test_concurrent_requests(self):
+        clients = [server.Client(self.server.host, self.server.port)
+                   for _ in range(4)]
+        try:
+            results = await asyncio.gather(*[
+                client.get("/haiku?corpus=tender_buttons")
+                for client in clients])
+        finally:
+            for client in clients:
+                await client.close()
+        self.assertEqual([200] * 4, [status for status, _ in results])
+
+    async def test_corpora(self):
+        status, response = await self.client.get("/corpora")
+        self.assertEqual(200, status)
+        self.assertEqual([{"corpus": "tender_buttons", "prefix_len": 2},
+                          {"corpus": "words", "prefix_len": 1}],
+                         response["corpora"])
+
+    async def test_stats(self):
+        for _ in range(3):
+            await self.client.get("/haiku?corpus=tender_buttons")
+        # "Here are words." is too short for a haiku
+        await self.client.get("/haiku?corpus=words")
+        status, response = await self.client.get("/stats")
+        self.assertEqual(200, status)
+        self.assertEqual(3, response["haiku"])
+        self.assertEqual(1, response["failures"])
+        self.assertGreaterEqual(response["words"], 3 * 3)
+        self.assertEqual(set(haiku.GenerationStats.STAGES),
+                         set(response["stage_seconds"]))
+
+    async def test_errors(self):
+        for target, expected_status in [
+                ("/haiku?corpus=missing", 404),
+                ("/haiku?corpus=tender_buttons&prefix_len=3", 404),
+                ("/haiku?prefix_len=two", 400),
+                ("/haiku", 400),
+                ("/missing", 404),
+                ("/haiku?corpus=words", 422)]:
+            status, response = await self.client.get(target)
+            self.assertEqual(expected_status, status, target)
+            self.assertIn("error", response)
+
+    async def test_malformed_requests(self):
+        for request in [b"GET /corpora\r\n\r\n",
+                        b"GET /corpora HTTP/1.1\r\n"
+                        b"Content-Length: x\r\n\r\n",
+                        b"GET /corpora HTTP/1.1\r\n"
+                        b"Content-Length: -1\r\n\r\n"]:
+            reader, writer = await asyncio.open_connection(self.server.host,
+                                                           self.server.port)
+            try:
+                writer.write(request)
+                await writer.drain()
+                start_line = await reader.readline()
+            finally:
+                writer.close()
+                await writer.wait_closed()
+            self.assertEqual(b"HTTP/1.1 400 Bad Request\r\n", start_line,
+                             request)
+
+    async def test_body_too_large(self):
+        reader, writer = await asyncio.open_connection(self.server.host,
+                                                       self.server.port)
+        try:
+            writer.write(b"GET /corpora HTTP/1.1\r\n"
+                         b"Content-Length: 10000000000\r\n\r\n")
+            await writer.drain()
+            start_line = await reader.readline()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        self.assertEqual(b"HTTP/1.1 413 Content Too Large\r\n", start_line)
+
+    async def test_internal_error(self):
+        async def fail(method, target):
+            raise concurrent.futures.process.BrokenProcessPool()
+        self.server.handle_request = fail
+        status, response = await self.client.get("/haiku")
+        self.assertEqual(500, status)
+        self.assertIn("error", response)
+
+    async def test_method_not_allowed(self):
+        status, _ = await self.server.handle_request("POST", "/haiku")
+        self.assertEqual(405, status)
+
+
+class LoadChainsTests(unittest.TestCase):
+
+    def test_corpus_name(self):
+        self.assertEqual("walden", server.corpus_name("corpus/walden.txt"))
+        self.assertEqual("walden", server.corpus_name("/a/walden.txt.gz"))
+
+    def test_load_chains(self):
+        chains = server.load_chains(["test_inputs/test0.txt"], [1, 2])
+        self.assertEqual([("test0", 1), ("test0", 2)], sorted(chains))
+        self.assertEqual(2, chains[("test0", 2)].prefix_len)
+
+    def test_load_backoff_chains(self):
+        chains = server.load_chains(["test_inputs/test0.txt"], [1, 2],
+                                    backoff_min_successors=2)
+        self.assertEqual([("test0", 1), ("test0", 2)], sorted(chains))
+        for prefix_len in (1, 2):
+            chain = chains[("test0", prefix_len)]
+            self.assertEqual(prefix_len, chain.prefix_len)
+            self.assertEqual(2, chain.min_successors)
+        # built once
+        self.assertIs(chains[("test0", 1)]._entries,
+                      chains[("test0", 2)]._entries)
+
+    def test_load_suffix_array_chains(self):
+        chains = server.load_chains(["test_inputs/test0.txt"], [1, 3],
+                                    suffix_array=True)
+        self.assertEqual([("test0", 1), ("test0", 3)], sorted(chains))
+        with tempfile.TemporaryDirectory() as directory:
+            suffixarray.save(chains[("test0", 1)], directory)
+            loaded = server.load_chains([directory], [1, 3])
+            for prefix_len in (1, 3):
+                key = (server.corpus_name(directory), prefix_len)
+                self.assertEqual(prefix_len, loaded[key].prefix_len)
+                self.assertEqual(chains[("test0", prefix_len)].to_dict(),
+                                 loaded[key].to_dict())
+
+    def test_lazy_imports(self):
+        # the backoff chain is only imported with --backoff
+        code = "import sys, server; print(' '.join(sorted(sys.modules)))"
+        modules = subprocess.run([sys.executable, "-c", code],
+                                 capture_output=True, text=True,
+                                 check=True).stdout.split()
+        self.assertNotIn("backoff", modules)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
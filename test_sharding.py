@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+import gzip
+import markov
+import os
+import sharding
+import tempfile
+import unittest
+
+
+class ShardingTests(unittest.TestCase):
+    corpus_file = "corpus/tender_buttons.txt"
+
+    def _assert_same_chain(self, file_names, prefix_len, shard_size):
+        for punkt in [False, True]:
+            expected = markov.MarkovChain.from_files(file_names, prefix_len,
+                                                     punkt=punkt)
+            chain = sharding.build_chain(markov.MarkovChain, file_names,
+                                         prefix_len, 2, shard_size=shard_size,
+                                         punkt=punkt)
+            self.assertEqual(expected.to_dict(), chain.to_dict())
+
+    def test_byte_ranges(self):
+        ranges = sharding._byte_ranges(self.corpus_file, 10000)
+        self.assertTrue(len(ranges) > 1)
+        self.assertEqual(0, ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+        with open(self.corpus_file, "rb") as f:
+            data = f.read()
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertTrue(data[start:start + 1].isspace())
+
+    def test_small_file_not_split(self):
+        self.assertEqual([(0, None)],
+                         sharding._byte_ranges("test_inputs/test0.txt", 1000))
+
+    def test_same_as_serial(self):
+        for prefix_len in [1, 2, 3]:
+            self._assert_same_chain([self.corpus_file], prefix_len, 5000)
+
+    def test_tiny_shards(self):
+        """Shards with fewer words than the prefix, or no sentence
+        boundaries, still come out the same."""
+        file_names = ["test_inputs/test0.txt", "test_inputs/test2.txt",
+                      "test_inputs/test3.txt"]
+        for shard_size in [1, 3, 8]:
+            self._assert_same_chain(file_names, 3, shard_size)
+
+    def test_compressed_file(self):
+        fd, file_name = tempfile.mkstemp(suffix=".gz")
+        os.close(fd)
+        try:
+            with gzip.open(file_name, "wt") as f:
+                f.write("Here is some\ntext. It is\nnot long.\n")
+            self.assertEqual([(0, None)],
+                             sharding._byte_ranges(file_name, 1))
+            self._assert_same_chain([file_name, "test_inputs/test1.txt"], 2,
+                                    1)
+        finally:
+            os.remove(file_name)
+
+    def test_from_files_jobs(self):
+        expected = markov.MarkovChain.from_files([self.corpus_file], 2)
+        chain = markov.MarkovChain.from_files([self.corpus_file], 2, jobs=2)
+        self.assertEqual(expected.to_dict(), chain.to_dict())
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
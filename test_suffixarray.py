@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+import haiku
+import markov
+import suffixarray
+import util
+
+
+class SuffixArrayChainTests(unittest.TestCase):
+
+    files = ["test_inputs/test0.txt", "test_inputs/test1.txt",
+             "test_inputs/test2.txt", "test_inputs/test3.txt",
+             "corpus/tender_buttons.txt"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _successors(self, chain, words):
+        prefix = tuple(chain.vocab.get_id(word) for word in words)
+        counts = chain.successors(prefix)
+        return {chain.vocab.word(word_id): count
+                for word_id, count in counts.items()}
+
+    def test_same_as_markov_chain(self):
+        chain = suffixarray.SuffixArrayChain.from_files(self.files)
+        for prefix_len in (1, 2, 3, 5):
+            expected = markov.MarkovChain.from_files(self.files, prefix_len)
+            view = chain.with_prefix_len(prefix_len)
+            self.assertEqual(prefix_len, view.prefix_len)
+            self.assertEqual(expected.to_dict(), view.to_dict())
+
+    def test_sentence_starts(self):
+        text = "Hi. Yo. Go on and on. I am a cat! You are a rat. I am a bat."
+        chain = suffixarray.SuffixArrayChain.from_string(text)
+        for prefix_len in (1, 2, 3):
+            expected = markov.MarkovChain.from_string(text, prefix_len)
+            self.assertEqual(expected.to_dict(),
+                             chain.with_prefix_len(prefix_len).to_dict())
+        self.assertEqual({"Hi.": 1, "Yo.": 1, "Go": 1, "I": 2, "You": 1},
+                         self._successors(chain, []))
+        self.assertEqual({"am": 2}, self._successors(chain, ["I"]))
+        # the end of the text has no successor
+        self.assertEqual({}, self._successors(chain, ["a", "bat."]))
+        self.assertEqual("", chain.next_word("unknown words"))
+
+    def test_empty(self):
+        chain = suffixarray.SuffixArrayChain.from_string("")
+        self.assertEqual(markov.MarkovChain.from_string("").to_dict(),
+                         chain.to_dict())
+        self.assertEqual({}, chain.successors(()))
+        with self.assertRaises(ValueError):
+            haiku.generate_haiku(chain)
+
+    def test_files_are_separate(self):
+        chain = suffixarray.SuffixArrayChain.from_files(
+            ["test_inputs/test0.txt", "test_inputs/test0.txt"], 2)
+        expected = markov.MarkovChain.from_files(
+            ["test_inputs/test0.txt", "test_inputs/test0.txt"], 2)
+        self.assertEqual(expected.to_dict(), chain.to_dict())
+
+    def test_punkt(self):
+        with self.assertRaises(ValueError):
+            suffixarray.SuffixArrayChain.from_files(self.files, punkt=True)
+
+    def test_save_and_load(self):
+        chain = suffixarray.SuffixArrayChain.from_files(self.files, 2)
+        chain.index_syllables(util.lookup_syllables)
+        suffixarray.save(chain, self.directory)
+        loaded = suffixarray.load(self.directory, 3)
+        self.assertTrue(loaded.syllables_indexed)
+        self.assertEqual(3, loaded.prefix_len)
+        self.assertEqual(chain.with_prefix_len(3).to_dict(),
+                         loaded.to_dict())
+        # pickling a loaded chain maps the files again
+        unpickled = pickle.loads(pickle.dumps(loaded))
+        self.assertEqual(self.directory, unpickled.directory)
+        self.assertEqual(3, unpickled.prefix_len)
+        self.assertEqual(loaded.to_dict(), unpickled.to_dict())
+
+    def test_load_not_a_chain(self):
+        with self.assertRaises(ValueError):
+            suffixarray.load(self.directory)
+
+    def test_max_syllables(self):
+        chain = suffixarray.SuffixArrayChain.from_string(
+            "The cat sat. The elephant sat. The dog sat.", 1)
+        chain.index_syllables(util.lookup_syllables)
+        prefix = (chain.vocab.get_id("The"),)
+        for _ in range(20):
+            word_id = chain._sample_next(prefix, max_syllables=1)
+            self.assertIn(chain.vocab.word(word_id), ("cat", "dog"))
+        self.assertIsNone(chain._sample_next(prefix, max_syllables=0))
+
+    def test_sample_proportions(self):
+        chain = suffixarray.SuffixArrayChain.from_string(
+            "a b. a b. a b. a c.", 1)
+        prefix = (chain.vocab.get_id("a"),)
+        random.seed(1)
+        drawn = [chain.vocab.word(chain._sample_next(prefix))
+                 for _ in range(2000)]
+        self.assertAlmostEqual(0.75, drawn.count("b.") / len(drawn),
+                               delta=0.05)
+
+    def test_generate_haiku(self):
+        chain = suffixarray.SuffixArrayChain.from_files(
+            ["corpus/tender_buttons.txt"], 2)
+        chain.index_syllables(util.lookup_syllables)
+        random.seed(1)
+        for prefix_len in (1, 2, 3):
+            view = chain.with_prefix_len(prefix_len)
+            for _ in range(5):
+                lines = haiku.generate_haiku(view).split("\n")
+                self.assertEqual(3, len(lines))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import os
+import syllables
+import tempfile
+import unittest
+
+
+class SyllableTableTests(unittest.TestCase):
+
+    def test_lookup(self):
+        table = syllables.get_table()
+        self.assertEqual(1, table["word"])
+        self.assertEqual(3, table["syllable"])
+        self.assertNotIn("asdf", table)
+
+    def test_count_syllables(self):
+        phones = ["S", "IH1", "L", "AH0", "B", "AH0", "L"]
+        self.assertEqual(3, syllables.count_syllables(phones))
+
+    def test_read_table(self):
+        fd, file_name = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write("# comment\n[1]\ncat\ndog\n[3]\ncanary\n")
+        try:
+            table = syllables._read_table(file_name)
+        finally:
+            os.remove(file_name)
+        self.assertEqual({"cat": 1, "dog": 1, "canary": 3}, table)
+
+    def test_estimate(self):
+        for word, count in [("cat", 1), ("make", 1), ("table", 2),
+                            ("jumped", 1), ("wanted", 2), ("boxes", 2),
+                            ("lion", 2), ("nation", 2), ("quote", 1),
+                            ("happy", 2), ("yellow", 2), ("organism", 4),
+                            ("zorbly", 2)]:
+            self.assertEqual(count, syllables.estimate(word), word)
+        self.assertEqual(1, syllables.estimate("hmm"))
+        self.assertEqual(2, syllables.estimate("don't-care"))
+        self.assertIsNone(syllables.estimate("1904"))
+
+    def test_estimate_accuracy(self):
+        table = syllables.get_table()
+        words = sorted(word for word in table if word.isalpha())[::50]
+        right = sum(syllables.estimate(word) == table[word]
+                    for word in words)
+        self.assertGreater(right / len(words), 0.9)
+
+    def test_matches_cmudict(self):
+        from nltk.corpus import cmudict
+        pronunciations = cmudict.dict()
+        table = syllables.get_table()
+        self.assertEqual(len(pronunciations), len(table))
+        for word in ["a", "haiku", "whale", "walden", "ulysses"]:
+            expected = syllables.count_syllables(pronunciations[word][0])
+            self.assertEqual(expected, table[word])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,19 @@ class UtilTests(unittest.TestCase):
         word = "Syllable."
         self.assertEqual(3, util.get_syllable_count(word))
 
+    def test_estimate_syllables(self):
+        # in the dictionary
+        self.assertEqual(3, util.estimate_syllables("Syllable."))
+        self.assertEqual(util.get_syllable_count("Mulligan"),
+                         util.estimate_syllables("Mulligan"))
+        # estimated
+        self.assertIsNone(util.lookup_syllables("snotgreen"))
+        self.assertEqual(2, util.estimate_syllables("snotgreen"))
+        # the parts of hyphenated words are counted separately
+        self.assertEqual(4, util.estimate_syllables("sea-anemone"))
+        self.assertIsNone(util.estimate_syllables("1904"))
+        self.assertIsNone(util.estimate_syllables("--"))
+
     def test_strip_punctuation(self):
         """Strip out unclosed quotation mark"""
         text = "\"Quote"
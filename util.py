@@ -1,13 +1,13 @@
 """A collection of utility functions used by the haiku module."""
-from nltk.corpus import cmudict
+import os
+import re
 import string
 import argparse
-
-syllable_dict = cmudict.dict()
+import syllables
 
 
 def parse_args():
-    """Parse command line and return input filenames and prefix length."""
+    """Parse the command line arguments."""
     default_input = "corpus/moby_dick.txt"
     parser = argparse.ArgumentParser(
         description="Generate a haiku using Markov chains.")
@@ -19,7 +19,164 @@ def parse_args():
     parser.add_argument("-l", "--prefix-len", dest="prefix_len",
                         type=int, default=2,
                         help="Markov chain prefix length (default is 2)")
-    return parser.parse_args()
+    parser.add_argument("--compile", action="store_true",
+                        help=("Build the Markov chain and save it to the "
+                              "file given by --output, instead of "
+                              "generating a haiku"))
+    parser.add_argument("-o", "--output",
+                        help=("Output file for --compile or -n "
+                              "(by default -n writes to stdout)"))
+    parser.add_argument("--model",
+                        help=("Generate from a chain file (or directory, "
+                              "with --csr or --suffix-array) saved by "
+                              "--compile instead of the input files"))
+    parser.add_argument("-n", "--count", type=int,
+                        help=("Generate this many haiku, written as "
+                              "newline-delimited JSON"))
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help=("Number of worker processes to build the "
+                              "chain and run -n with (default is 1)"))
+    parser.add_argument("--punkt", action="store_true",
+                        help=("Split the input into sentences with NLTK's "
+                              "Punkt tokenizer (slower)"))
+    parser.add_argument("--seed", type=int,
+                        help="Random seed, for reproducible output")
+    parser.add_argument("--stats", action="store_true",
+                        help=("Print counts of the work done generating, "
+                              "and how long it took, to stderr. Words are "
+                              "only rejected as dead ends, and lines and "
+                              "haiku are never restarted, with or without "
+                              "--batch; --batch doesn't time the stages"))
+    parser.add_argument("--csr", action="store_true",
+                        help=("Store the chain in NumPy arrays, which takes "
+                              "a fraction of the memory. With --compile, "
+                              "--output is a directory to save the arrays "
+                              "in."))
+    parser.add_argument("--batch", action="store_true",
+                        help=("With -n, generate the haiku many at a time "
+                              "with NumPy, which is much faster. Builds "
+                              "the chain as with --csr, or needs a --model "
+                              "saved with --csr."))
+    parser.add_argument("--suffix-array", dest="suffix_array",
+                        action="store_true",
+                        help=("Store the text itself and a suffix array of "
+                              "it, which serves every prefix length (-l "
+                              "picks one, also for a --model saved with "
+                              "--suffix-array). With --compile, --output is "
+                              "a directory to save the arrays in."))
+    parser.add_argument("--estimate-syllables", dest="estimate_syllables",
+                        action="store_true",
+                        help=("Guess the syllables in words that aren't in "
+                              "the CMU pronouncing dictionary from their "
+                              "spelling, instead of never using them"))
+    parser.add_argument("--unique", action="store_true",
+                        help=("With -n, leave out haiku that were already "
+                              "generated, remembered in a Bloom filter of "
+                              "fixed size. More are generated to make up "
+                              "for the ones left out, whose indexes are "
+                              "skipped, until there are -n, or no more new "
+                              "ones turn up."))
+    parser.add_argument("--unique-mb", dest="unique_mb", type=int,
+                        default=16,
+                        help="Size of the --unique filter in MB (default 16)")
+    parser.add_argument("--unique-error", dest="unique_error", type=float,
+                        default=1e-6,
+                        help=("Chance that --unique takes a new haiku for a "
+                              "repeat, until the filter is full (default "
+                              "is 1e-6; 16 MB holds 4.6 million haiku at "
+                              "that rate)"))
+    _add_cache_args(parser)
+    _add_backoff_arg(parser)
+    args = parser.parse_args()
+    if args.compile and not args.output:
+        parser.error("--compile requires --output")
+    if args.backoff is not None and (args.compile or args.model):
+        parser.error("--backoff can't be used with --compile or --model")
+    if args.csr and (args.backoff is not None or args.model):
+        parser.error("--csr can't be used with --backoff or --model")
+    if args.batch and args.count is None:
+        parser.error("--batch requires -n")
+    if args.estimate_syllables and args.model:
+        parser.error("--estimate-syllables can't be used with --model; "
+                     "use it with --compile instead")
+    if args.unique and args.count is None:
+        parser.error("--unique requires -n")
+    if args.unique_mb < 1 or not 0 < args.unique_error < 1:
+        parser.error("--unique-mb must be positive, and --unique-error "
+                     "between 0 and 1")
+    if args.batch and args.backoff is not None:
+        parser.error("--batch can't be used with --backoff")
+    if args.suffix_array and (args.csr or args.batch or args.model or
+                              args.punkt or args.backoff is not None):
+        parser.error("--suffix-array can't be used with --csr, --batch, "
+                     "--model, --punkt or --backoff")
+    return args
+
+
+def parse_serve_args(argv):
+    """Parse the command line arguments of haiku.py serve."""
+    parser = argparse.ArgumentParser(
+        prog="haiku.py serve",
+        description="Serve haiku over HTTP, from chains held in memory.")
+    parser.add_argument("input", nargs="*",
+                        help=("Input files to build chains from, or chain "
+                              "files saved by --compile (ending in .model, "
+                              "or directories saved with --csr or "
+                              "--suffix-array). "
+                              "By default uses every file in corpus/. Each "
+                              "is served under its file name, without the "
+                              "extension."))
+    parser.add_argument("-l", "--prefix-len", dest="prefix_lens", type=int,
+                        nargs="+", default=[2],
+                        help=("Prefix lengths to build chains with "
+                              "(default is 2)"))
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Address to listen on (default is 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="Port to listen on (default is 8080)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help=("Number of worker processes to generate haiku "
+                              "in (default is one per CPU)"))
+    parser.add_argument("--punkt", action="store_true",
+                        help=("Split the input into sentences with NLTK's "
+                              "Punkt tokenizer (slower)"))
+    parser.add_argument("--suffix-array", dest="suffix_array",
+                        action="store_true",
+                        help=("Build one suffix array chain for each file, "
+                              "and serve views of it for each prefix "
+                              "length"))
+    _add_cache_args(parser)
+    _add_backoff_arg(parser)
+    args = parser.parse_args(argv)
+    if args.suffix_array and (args.punkt or args.backoff is not None):
+        parser.error("--suffix-array can't be used with --punkt or --backoff")
+    if not args.input:
+        args.input = sorted(os.path.join("corpus", name)
+                            for name in os.listdir("corpus"))
+    return args
+
+
+def _add_backoff_arg(parser):
+    """Add the option for building a backoff chain to a parser."""
+    parser.add_argument("--backoff", type=int, metavar="MIN_SUCCESSORS",
+                        help=("Build one chain holding every prefix length "
+                              "up to -l, which backs off to shorter "
+                              "prefixes when a prefix has fewer than "
+                              "MIN_SUCCESSORS different successors (1 only "
+                              "backs off at dead ends)"))
+
+
+def _add_cache_args(parser):
+    """Add the options for caching built chains to a parser."""
+    parser.add_argument("--cache-dir",
+                        default=os.environ.get("HAIKU_CACHE_DIR"),
+                        help=("Directory to cache built chains in, so runs "
+                              "with the same input files and prefix length "
+                              "don't build them again (default is "
+                              "$HAIKU_CACHE_DIR, or no cache)"))
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help=("Most megabytes of chains to keep in the "
+                              "cache (default is 1024)"))
 
 
 def _normalize(word):
@@ -30,116 +187,142 @@ def _normalize(word):
 def in_dict(word):
     """Check whether a word is in the CMU pronouncing dictionary."""
     word = _normalize(word)
-    return (word in syllable_dict)
-
-
-def _is_vowel(phone):
-    """Check whether a phoneme from the CMU dictionary represents a vowel."""
-    return any(c.isdigit() for c in phone)
+    return (word in syllables.get_table())
 
 
 def get_syllable_count(word):
     """Get the number of syllables in a word.
 
     Each sylllable corresponds to one vowel phoneme in the CMU dictionary.
-    Some words have multiple pronunciations, so just pick the first one.
+    The counts are precomputed by the syllables module.
     """
     word = _normalize(word)
-    phones = syllable_dict[word][0]
-    return len([phone for phone in phones if _is_vowel(phone)])
+    return syllables.get_table()[word]
+
 
+def lookup_syllables(word):
+    """Get the number of syllables in a word, or None if it's not in the
+    CMU pronouncing dictionary."""
+    return syllables.get_table().get(_normalize(word))
 
-def _strip_unbalanced_punctuation(text, is_open_char, is_close_char):
+
+def estimate_syllables(word):
+    """Get the number of syllables in a word, estimating it if the word is
+    not in the CMU pronouncing dictionary.
+
+    Hyphenated words are split up, and each part looked up or estimated
+    separately.
+
+    Returns:
+        The number of syllables, or None if the word has no letters
+    """
+    table = syllables.get_table()
+    word = _normalize(word)
+    count = table.get(word)
+    if count is not None:
+        return count
+    total = 0
+    for part in re.split("[-–—]+", word):
+        count = table.get(part)
+        if count is None:
+            count = syllables.estimate(part)
+        if count is None:
+            return None
+        total += count
+    return total
+
+
+# The kinds of punctuation strip_punctuation balances, as (opening, closing)
+# characters. Straight quotes are the same character either way, so
+# _quote_is_open decides which each one is.
+_PARENS = ("(", ")")
+_CURLY_QUOTES = ("“", "”")
+_STRAIGHT_QUOTES = ("\"", "\"")
+
+
+def _strip_unbalanced_punctuation(text, pairs):
     """Remove unbalanced punctuation (e.g parentheses or quotes) from text.
 
     Removes each opening punctuation character for which it can't find
     corresponding closing character, and vice versa.
-    It can only handle one type of punctuation
-    (e.g. it could strip quotes or parentheses but not both).
-    It takes functions (is_open_char, is_close_char),
-    instead of the characters themselves,
-    so that we can determine from nearby characters whether a straight quote is
-    an opening or closing quote.
+    Each kind of punctuation is balanced separately (a parenthesis can
+    close inside a pair of quotes), but all of them in a single pass over
+    the text, so this takes linear time.
 
     Args:
         text (string): the text to fix
-        is_open_char: a function that accepts the text and an index,
-            and returns true if the character at that index is
-            an opening punctuation mark.
-        is_close_char: same as is_open_char for closing punctuation mark.
+        pairs (sequence of tuples): the (opening, closing) characters of each
+            kind of punctuation to balance
 
     Returns:
         The text with unmatched punctuation removed.
     """
-    # lists of unmatched opening and closing chararacters
-    opening_chars = []
-    unmatched_closing_chars = []
-    for idx, c in enumerate(text):
-        if is_open_char(text, idx):
-            opening_chars.append(idx)
-        elif is_close_char(text, idx):
-            if opening_chars:
-                # this matches a character we found earlier
-                opening_chars.pop()
-            else:
-                # this doesn't match any opening character
-                unmatched_closing_chars.append(idx)
-    char_indices = [i for (i, _) in enumerate(text)
-                    if not(i in opening_chars or i in unmatched_closing_chars)]
-    stripped_text = "".join([text[i] for i in char_indices])
-    return stripped_text
+    # for each character, the indices of unmatched opening characters of
+    # its kind
+    opening = {}
+    closing = {}
+    for open_char, close_char in pairs:
+        opening[open_char] = closing[close_char] = []
+    pattern = "[{}]".format(re.escape("".join(opening) + "".join(closing)))
+
+    unmatched = []
+    for match in re.finditer(pattern, text):
+        idx = match.start()
+        c = text[idx]
+        if c in opening and (c not in closing or _quote_is_open(text, idx)):
+            opening[c].append(idx)
+        elif closing[c]:
+            # this matches a character we found earlier
+            closing[c].pop()
+        else:
+            # this doesn't match any opening character
+            unmatched.append(idx)
+    for indices in opening.values():
+        unmatched.extend(indices)
+    if not unmatched:
+        return text
+
+    pieces = []
+    start = 0
+    for idx in sorted(unmatched):
+        pieces.append(text[start:idx])
+        start = idx + 1
+    pieces.append(text[start:])
+    return "".join(pieces)
+
+
+def _quote_is_open(text, idx):
+    """Guess whether the straight quote at text[idx] opens a quotation."""
+    if text[idx-1] in string.whitespace:
+        # Bar. "Foo...
+        return True
+    elif len(text) == idx + 1:
+        # It's the last character in the text so assume it's closing
+        return False
+    elif text[idx+1] in string.whitespace:
+        # foo." Bar...
+        return False
+    else:
+        # No clear indication, just guess True
+        return True
 
 
 def _strip_parens(text):
     """Remove any unmatched parentheses from a string."""
-    def is_open(txt, idx):
-        return txt[idx] == "("
-
-    def is_close(txt, idx):
-        return txt[idx] == ")"
-
-    return _strip_unbalanced_punctuation(text, is_open, is_close)
+    return _strip_unbalanced_punctuation(text, [_PARENS])
 
 
 def _strip_curly_quotes(text):
     """Remove any unmatched curly quotes from a string."""
-    def is_open(text, idx):
-        return text[idx] == "“"
-
-    def is_close(text, idx):
-        return text[idx] == "”"
-
-    return _strip_unbalanced_punctuation(text, is_open, is_close)
+    return _strip_unbalanced_punctuation(text, [_CURLY_QUOTES])
 
 
 def _strip_straight_quotes(text):
     """Remove any unmatched straight quotes from a string."""
-    def quote_is_open(text, idx):
-        if text[idx-1] in string.whitespace:
-            # Bar. "Foo...
-            return True
-        elif len(text) == idx + 1:
-            # It's the last character in the text so assume it's closing
-            return False
-        elif text[idx+1] in string.whitespace:
-            # foo." Bar...
-            return False
-        else:
-            # No clear indication, just guess True
-            return True
-
-    def is_open(text, idx):
-        return text[idx] == "\"" and quote_is_open(text, idx)
-
-    def is_close(text, idx):
-        return text[idx] == "\"" and not quote_is_open(text, idx)
-
-    return _strip_unbalanced_punctuation(text, is_open, is_close)
+    return _strip_unbalanced_punctuation(text, [_STRAIGHT_QUOTES])
 
 
 def strip_punctuation(text):
     """Remove unmatched parentheses and quotes from a string."""
-    text = _strip_straight_quotes(text)
-    text = _strip_curly_quotes(text)
-    text = _strip_parens(text)
-    return text
+    return _strip_unbalanced_punctuation(
+        text, [_STRAIGHT_QUOTES, _CURLY_QUOTES, _PARENS])